@@ -0,0 +1,46 @@
+"""Shared setup for the backend benchmarks.
+
+Benchmarks import server.py directly and call its handlers in-process.
+They run against a local mongod (``--mongo-url``) or, by default, the
+in-process store of memory_store.py (STORAGE=memory), which leaves only
+handler cost in the timings.
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def add_database_arguments(parser):
+    parser.add_argument('--mongo-url', default=None,
+                        help='Run against this MongoDB instead of the in-memory store')
+    parser.add_argument('--db-name', default='bollywood_sensex_bench',
+                        help='Database name (dropped before the run)')
+
+
+async def load_server(args):
+    """Import server.py and point it at a fresh benchmark database"""
+    os.environ.setdefault('STORAGE', 'mongo' if args.mongo_url else 'memory')
+    os.environ.setdefault('MONGO_URL', args.mongo_url or 'mongodb://localhost:27017')
+    os.environ.setdefault('DB_NAME', args.db_name)
+    # Keep the transaction write-ahead log and archive out of backend/data
+    scratch = Path(tempfile.mkdtemp(prefix='sensex-bench-'))
+    os.environ.setdefault('TRANSACTION_WAL_DIR', str(scratch / 'wal'))
+    os.environ.setdefault('TRANSACTION_ARCHIVE_DIR', str(scratch / 'archive'))
+    import server
+
+    if server.STORAGE == 'mongo':
+        await server.client.drop_database(args.db_name)
+    await server.ensure_indexes(server.db)
+    server.transaction_ledger.open()
+    return server
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,129 @@
+"""Latency benchmark for GET /api/portfolio/analytics against history size.
+
+Seeds one user per transaction count, with trades spread over a year of
+daily candles, and times whole requests in three states: first (every
+analytics cache cleared), cold (only the user's analytics result
+cleared, as after one of their trades, so the settled transaction
+history and the shared daily closes are reused) and cached.
+
+    python benchmarks/bench_analytics.py --transactions 100 1000 10000
+    python benchmarks/bench_analytics.py --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from _support import add_database_arguments, load_server, percentile
+
+DAYS = 365
+
+
+async def seed_movies(db, movies: int, rng: random.Random):
+    start = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=DAYS)
+    closes = {}
+    candles = []
+    for i in range(movies):
+        price = 100.0
+        closes[f'movie-{i}'] = series = []
+        for day in range(DAYS):
+            price = round(max(price * (1 + rng.gauss(0, 0.02)), 10.0), 2)
+            series.append(price)
+            candles.append({
+                'movie_id': f'movie-{i}', 'interval': '1d', 'start': start + timedelta(days=day),
+                'open': price, 'high': price, 'low': price, 'close': price, 'volume': 0
+            })
+    await db.movies.insert_many([
+        {
+            'id': f'movie-{i}', 'title': f'Movie {i}', 'symbol': f'MOV{i}',
+            'current_price': closes[f'movie-{i}'][-1], 'initial_price': 100.0,
+            'total_shares': 1000000, 'available_shares': 1000000, 'volume': 0,
+            'change': 0.0, 'change_percent': 0.0,
+        }
+        for i in range(movies)
+    ])
+    await db.price_candles.insert_many(candles)
+    return start, closes
+
+
+async def seed_user(db, user_id: str, transactions: int, movies: int, start, closes, rng: random.Random):
+    """Random buys and sells that never sell more than is held"""
+    held = defaultdict(int)
+    cost = defaultdict(float)
+    docs = []
+    for n in range(transactions):
+        day = n * DAYS // transactions
+        movie_id = f'movie-{rng.randrange(movies)}'
+        price = closes[movie_id][day]
+        if held[movie_id] and rng.random() < 0.4:
+            action, quantity = 'SELL', rng.randint(1, held[movie_id])
+            cost[movie_id] -= cost[movie_id] / held[movie_id] * quantity
+            held[movie_id] -= quantity
+        else:
+            action, quantity = 'BUY', rng.randint(1, 20)
+            cost[movie_id] += price * quantity
+            held[movie_id] += quantity
+        docs.append({
+            'id': str(uuid.uuid4()), 'user_id': user_id, 'movie_id': movie_id,
+            'movie_title': movie_id, 'movie_symbol': movie_id, 'type': action,
+            'quantity': quantity, 'price': price, 'amount': price * quantity,
+            'timestamp': (start + timedelta(days=day, seconds=n % 86400)).isoformat()
+        })
+    await db.transactions.insert_many(docs)
+    await db.portfolio.insert_many([
+        {'user_id': user_id, 'movie_id': movie_id, 'quantity': quantity, 'avg_price': cost[movie_id] / quantity}
+        for movie_id, quantity in held.items() if quantity > 0
+    ])
+    await db.users.insert_one({'id': user_id, 'email': f'{user_id}@bench.local', 'name': user_id, 'balance': 50000.0})
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--transactions', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--movies', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=20, help='Requests per transaction count')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    server = await load_server(args)
+    start, closes = await seed_movies(server.db, args.movies, rng)
+
+    print(f"{'transactions':>12} {'first p50':>10} {'cold p50':>9} {'cold p95':>9} {'cached p50':>11} {'days':>5}")
+    for transactions in args.transactions:
+        user_id = f'user-{transactions}'
+        await seed_user(server.db, user_id, transactions, args.movies, start, closes, rng)
+        current_user = await server.db.users.find_one({'id': user_id}, {'_id': 0})
+
+        first, cold, cached = [], [], []
+        for _ in range(args.requests):
+            server.analytics_cache.clear()
+            server.analytics_history.clear()
+            server.daily_closes.clear()
+            started = time.perf_counter()
+            await server.get_portfolio_analytics(current_user)
+            first.append((time.perf_counter() - started) * 1000)
+            server.analytics_cache.clear()
+            started = time.perf_counter()
+            response = await server.get_portfolio_analytics(current_user)
+            cold.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            await server.get_portfolio_analytics(current_user)
+            cached.append((time.perf_counter() - started) * 1000)
+
+        result = server.analytics_cache.get(user_id)
+        assert result['transactions'] == transactions, 'transactions were truncated'
+        assert response.status_code == 200
+        first.sort()
+        cold.sort()
+        cached.sort()
+        print(f"{transactions:>12} {percentile(first, 50):>10.2f} {percentile(cold, 50):>9.2f} {percentile(cold, 95):>9.2f} "
+              f"{percentile(cached, 50):>11.3f} {len(result['equity_curve']):>5}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""Latency benchmark for GET /api/movies/{id}/candles.
+
+Replays months of simulated ticks for one movie through the price
+history recorder, flushes them, and then times candle range queries for
+every interval. The default in-memory store leaves out query execution
+and round-trips, so use --mongo-url for realistic numbers.
+
+    python benchmarks/bench_candles.py --days 90 --ticks-per-hour 60
+    python benchmarks/bench_candles.py --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from _support import add_database_arguments, load_server, percentile
+
+
+async def replay_ticks(server, movie_id: str, days: int, ticks_per_hour: int):
+    rng = random.Random(movie_id)
+    price = 100.0
+    step = 3600 / ticks_per_hour
+    started_at = time.time() - days * 86400
+    ticks = days * 24 * ticks_per_hour
+
+    for i in range(ticks):
+        price = max(round(price * (1 + rng.uniform(-0.02, 0.02)), 2), 10.0)
+        server.price_history.record(
+            [{'id': movie_id, 'price': price}],
+            {movie_id: rng.randint(0, 50)},
+            timestamp=started_at + i * step
+        )
+        # Flush the way the background writer would, in batches
+        if server.price_history.pending >= 5000:
+            await server.flush_price_history()
+    await server.flush_price_history()
+    return ticks
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--ticks-per-hour', type=int, default=60)
+    parser.add_argument('--requests', type=int, default=50, help='Queries per interval')
+    parser.add_argument('--limit', type=int, default=500)
+    args = parser.parse_args()
+
+    server = await load_server(args)
+    await server.init_price_history()
+
+    started = time.perf_counter()
+    ticks = await replay_ticks(server, 'bench-movie', args.days, args.ticks_per_hour)
+    print(f"replayed {ticks} ticks over {args.days} days in {time.perf_counter() - started:.1f}s")
+
+    print(f"{'interval':>9} {'candles':>8} {'p50 ms':>9} {'p95 ms':>9}")
+    for interval in server.INTERVALS:
+        timings = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            result = await server.get_candles('bench-movie', interval=interval, limit=args.limit)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        print(f"{interval:>9} {len(result['candles']):>8} {percentile(timings, 50):>9.2f} {percentile(timings, 95):>9.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+"""Micro-benchmark of JSON serialization for movie list responses.
+
+Compares FastAPI's default path (jsonable_encoder + JSONResponse) with
+FastJSONResponse, and reports what compression does to the body.
+
+    python benchmarks/bench_json.py --sizes 50 500 5000
+"""
+import argparse
+import gzip
+import random
+import time
+from datetime import datetime, timezone
+
+import _support  # noqa: F401  (puts the backend on sys.path)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from json_responses import FastJSONResponse, orjson
+
+
+def make_movies(count: int) -> list:
+    rng = random.Random(count)
+    created_at = datetime.now(timezone.utc).isoformat()
+    return [
+        {
+            'id': f'{i:08d}-0000-4000-8000-000000000000',
+            'tmdb_id': rng.randint(1, 10 ** 6),
+            'title': f'Movie {i}',
+            'symbol': f'MOV{i}'[:6],
+            'poster': f'https://image.tmdb.org/t/p/w500/poster{i}.jpg',
+            'backdrop': None,
+            'release_date': '2025-01-01',
+            'synopsis': 'An exciting Bollywood movie with songs, drama and a twist. ' * 3,
+            'cast': ['Lead Actor', 'Lead Actress', 'Supporting Actor', 'Villain'],
+            'genres': ['Drama', 'Romance'],
+            'current_price': round(rng.uniform(50, 500), 2),
+            'initial_price': round(rng.uniform(50, 500), 2),
+            'total_shares': rng.randint(10000, 100000),
+            'available_shares': rng.randint(0, 10000),
+            'volume': rng.randint(0, 10 ** 6),
+            'change': round(rng.uniform(-5, 5), 2),
+            'change_percent': round(rng.uniform(-2, 2), 2),
+            'created_at': created_at,
+        }
+        for i in range(count)
+    ]
+
+
+def time_call(fn, repeat: int) -> float:
+    """Best-of-repeat wall time in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"FastJSONResponse backend: {'orjson' if orjson else 'json (orjson not installed)'}")
+    print(f"{'movies':>7} {'default ms':>11} {'fast ms':>9} {'speedup':>8} {'bytes':>9} {'gzip bytes':>11} {'gzip ms':>8}")
+    for size in args.sizes:
+        movies = make_movies(size)
+        default = time_call(lambda: JSONResponse(jsonable_encoder(movies)), args.repeat)
+        fast = time_call(lambda: FastJSONResponse(movies), args.repeat)
+        body = FastJSONResponse(movies).body
+        compressed = gzip.compress(body, compresslevel=6)
+        gzip_ms = time_call(lambda: gzip.compress(body, compresslevel=6), args.repeat)
+        print(f"{size:>7} {default:>11.2f} {fast:>9.2f} {default / fast:>7.1f}x "
+              f"{len(body):>9} {len(compressed):>11} {gzip_ms:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
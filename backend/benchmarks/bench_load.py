@@ -0,0 +1,339 @@
+"""End-to-end load benchmark for the trading API.
+
+Seeds movies and users, then drives a weighted mix of requests through
+the real FastAPI app (routing, auth, middleware) over httpx's ASGI
+transport and reports throughput and p50/p95/p99 latency per route.
+Results are written as JSON so runs can be diffed between commits:
+
+    python benchmarks/bench_load.py --requests 5000 --output before.json
+    python benchmarks/bench_load.py --requests 5000 --compare before.json
+    python benchmarks/bench_load.py --mix order=50,portfolio=50 --concurrency 64
+    python benchmarks/bench_load.py --mix batch=1 --batch-size 50
+
+Password hashing uses --bcrypt-rounds (4 by default) so register and
+login measure the request path rather than the configured work factor.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+from _support import BACKEND_DIR, add_database_arguments, load_server, percentile
+
+PASSWORD = 'load-password'
+
+DEFAULT_MIX = 'order=30,limit=5,portfolio=15,movies=15,movie=5,trending=10,stats=10,login=7,register=3'
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+async def seed(server, movies: int, users: int, rng: random.Random) -> tuple:
+    movie_docs = [
+        {
+            'id': f'movie-{i}',
+            'tmdb_id': None,
+            'title': f'Load Movie {i}',
+            'symbol': f'LD{i}',
+            'current_price': round(rng.uniform(80, 400), 2),
+            'total_shares': 1000000,
+            'available_shares': 1000000,
+            'volume': 0,
+            'change': 0.0,
+            'change_percent': 0.0,
+        }
+        for i in range(movies)
+    ]
+    for movie in movie_docs:
+        movie['initial_price'] = movie['current_price']
+    await server.db.movies.insert_many(movie_docs)
+
+    password_hash = server._hash_password(PASSWORD)
+    await server.db.users.insert_many([
+        {'id': f'user-{i}', 'email': f'user{i}@bench.example.com', 'name': f'User {i}',
+         'password_hash': password_hash, 'balance': 10 ** 9}
+        for i in range(users)
+    ])
+    tokens = [server.create_token(f'user-{i}', f'user{i}@bench.example.com') for i in range(users)]
+    return [movie['id'] for movie in movie_docs], tokens
+
+
+async def start_market(server, simulator: bool):
+    """The parts of startup_event the routes depend on"""
+    tasks = [
+        asyncio.create_task(server.process_order_events()),
+        asyncio.create_task(server.flush_transactions()),
+    ]
+    await server.renew_order_book_leases()
+    tasks.append(asyncio.create_task(server.match_routed_orders()))
+    await server.load_market_board()
+    await server.reconcile_market_stats()
+    await server.load_net_worth_board()
+    await server.init_price_history()
+    if simulator:
+        tasks.append(asyncio.create_task(server.simulate_price_updates()))
+    return tasks
+
+
+class LoadState:
+    def __init__(self, movie_ids: list, tokens: list, rng: random.Random, batch_size: int):
+        self.movie_ids = movie_ids
+        self.tokens = tokens
+        self.rng = rng
+        self.holdings = defaultdict(dict)  # user index -> {movie id: shares bought}
+        self.registered = 0
+        self.batch_size = batch_size
+
+    def user(self) -> tuple:
+        index = self.rng.randrange(len(self.tokens))
+        return index, {'Authorization': f'Bearer {self.tokens[index]}'}
+
+    def movie(self) -> str:
+        return self.rng.choice(self.movie_ids)
+
+
+# Each scenario issues one request and returns (route label, response)
+
+async def order(client, state):
+    index, headers = state.user()
+    held = state.holdings[index]
+    if held and state.rng.random() < 0.4:
+        movie_id, action = state.rng.choice(sorted(held)), 'sell'
+        quantity = state.rng.randint(1, held[movie_id])
+        # Claimed before the request so concurrent sells never oversell
+        held[movie_id] -= quantity
+        if not held[movie_id]:
+            del held[movie_id]
+    else:
+        movie_id, action, quantity = state.movie(), 'buy', state.rng.randint(1, 5)
+    response = await client.post('/api/trade/order', headers=headers, json={
+        'movie_id': movie_id, 'action': action, 'quantity': quantity
+    })
+    if response.status_code == 200 and action == 'buy':
+        held[movie_id] = held.get(movie_id, 0) + quantity
+    return 'POST /api/trade/order (market)', response
+
+
+async def limit(client, state):
+    _, headers = state.user()
+    movie_id = state.movie()
+    price = state.rng.uniform(80, 400)
+    response = await client.post('/api/trade/order', headers=headers, json={
+        'movie_id': movie_id, 'action': 'buy', 'quantity': state.rng.randint(1, 5),
+        'order_type': 'limit', 'price': round(price, 2)
+    })
+    return 'POST /api/trade/order (limit)', response
+
+
+async def batch(client, state):
+    index, headers = state.user()
+    held = state.holdings[index]
+    orders = []
+    for _ in range(state.batch_size):
+        if held and state.rng.random() < 0.4:
+            movie_id = state.rng.choice(sorted(held))
+            quantity = state.rng.randint(1, held[movie_id])
+            held[movie_id] -= quantity
+            if not held[movie_id]:
+                del held[movie_id]
+            orders.append({'movie_id': movie_id, 'action': 'sell', 'quantity': quantity})
+        else:
+            orders.append({'movie_id': state.movie(), 'action': 'buy', 'quantity': state.rng.randint(1, 5)})
+    response = await client.post('/api/trade/orders/batch', headers=headers, json={'orders': orders})
+    if response.status_code == 200:
+        for order, result in zip(orders, response.json()['results']):
+            if order['action'] == 'buy' and result['status'] == 'filled':
+                held[order['movie_id']] = held.get(order['movie_id'], 0) + order['quantity']
+    return 'POST /api/trade/orders/batch', response
+
+
+async def portfolio(client, state):
+    _, headers = state.user()
+    return 'GET /api/portfolio', await client.get('/api/portfolio', headers=headers)
+
+
+async def movies(client, state):
+    return 'GET /api/movies', await client.get('/api/movies', params={'limit': 50})
+
+
+async def movie(client, state):
+    return 'GET /api/movies/{id}', await client.get(f'/api/movies/{state.movie()}')
+
+
+async def trending(client, state):
+    return 'GET /api/market/trending', await client.get('/api/market/trending')
+
+
+async def stats(client, state):
+    return 'GET /api/market/stats', await client.get('/api/market/stats')
+
+
+async def leaderboard(client, state):
+    return 'GET /api/leaderboard', await client.get('/api/leaderboard', params={'limit': 50})
+
+
+async def rank(client, state):
+    _, headers = state.user()
+    return 'GET /api/leaderboard/me', await client.get('/api/leaderboard/me', headers=headers)
+
+
+async def login(client, state):
+    index = state.rng.randrange(len(state.tokens))
+    response = await client.post('/api/auth/login', json={
+        'email': f'user{index}@bench.example.com', 'password': PASSWORD
+    })
+    return 'POST /api/auth/login', response
+
+
+async def register(client, state):
+    state.registered += 1
+    response = await client.post('/api/auth/register', json={
+        'email': f'new{state.registered}-{state.rng.randrange(10 ** 9)}@bench.example.com',
+        'name': 'New User', 'password': PASSWORD
+    })
+    return 'POST /api/auth/register', response
+
+
+SCENARIOS = {
+    'order': order, 'limit': limit, 'batch': batch, 'portfolio': portfolio, 'movies': movies, 'movie': movie,
+    'trending': trending, 'stats': stats, 'leaderboard': leaderboard, 'rank': rank,
+    'login': login, 'register': register,
+}
+
+
+async def drive(client, state, weights: dict, requests: int, concurrency: int) -> tuple:
+    names = list(weights)
+    plan = state.rng.choices(names, weights=[weights[name] for name in names], k=requests)
+    samples = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    queue = iter(plan)
+
+    async def worker():
+        for name in queue:
+            started = time.perf_counter()
+            route, response = await SCENARIOS[name](client, state)
+            samples[route].append((time.perf_counter() - started) * 1000)
+            statuses[route][response.status_code] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, statuses, time.perf_counter() - started
+
+
+def summarize(timings: list, statuses: dict, elapsed: float) -> dict:
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'errors': sum(count for status, count in statuses.items() if status >= 400),
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'throughput_rps': round(len(timings) / elapsed, 1),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(timings[-1], 3),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def print_report(report: dict, baseline: dict = None):
+    header = f"{'route':<34} {'reqs':>6} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    if baseline:
+        header += f" {'p95 vs base':>12}"
+    print(header)
+    rows = sorted(report['routes'].items()) + [('TOTAL', report['total'])]
+    for route, row in rows:
+        line = (f"{route:<34} {row['requests']:>6} {row['errors']:>5} {row['throughput_rps']:>8.1f} "
+                f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+        base = (baseline or {}).get('routes', {}).get(route) if route != 'TOTAL' else (baseline or {}).get('total')
+        if base and base['p95_ms']:
+            line += f" {(row['p95_ms'] / base['p95_ms'] - 1) * 100:>+11.1f}%"
+        print(line)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--movies', type=int, default=200)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight at once')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Scenario weights (default {DEFAULT_MIX})')
+    parser.add_argument('--batch-size', type=int, default=20, help='Orders per request in the batch scenario')
+    parser.add_argument('--bcrypt-rounds', type=int, default=4)
+    parser.add_argument('--simulator', action='store_true', help='Run the price simulator during the load')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON report here ("-" for stdout)')
+    parser.add_argument('--compare', help='Baseline JSON report to compare p95 latency against')
+    args = parser.parse_args()
+    weights = parse_mix(args.mix)
+
+    rng = random.Random(args.seed)
+    server = await load_server(args)
+    server.BCRYPT_ROUNDS = args.bcrypt_rounds
+    movie_ids, tokens = await seed(server, args.movies, args.users, rng)
+    tasks = await start_market(server, args.simulator)
+
+    state = LoadState(movie_ids, tokens, rng, args.batch_size)
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        # Warm up routing, dependency caches and the response cache
+        await drive(client, state, weights, min(args.requests // 10, 200), args.concurrency)
+        samples, statuses, elapsed = await drive(client, state, weights, args.requests, args.concurrency)
+
+    for task in tasks:
+        task.cancel()
+    server.auth_executor.shutdown(wait=False)
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'database': 'mongodb' if args.mongo_url else 'memory',
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'elapsed_s': round(elapsed, 3),
+        'routes': {route: summarize(timings, statuses[route], elapsed) for route, timings in samples.items()},
+        'total': summarize(
+            [t for timings in samples.values() for t in timings],
+            {status: sum(counts.get(status, 0) for counts in statuses.values())
+             for status in {s for counts in statuses.values() for s in counts}},
+            elapsed
+        ),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(report, baseline)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""GET /api/movies latency while a burst of logins is being verified.
+
+A reader task keeps calling get_movies while many users log in at once.
+With --inline, bcrypt runs on the event loop the way it used to, for a
+before/after comparison.
+
+    python benchmarks/bench_login_storm.py --logins 200
+    python benchmarks/bench_login_storm.py --logins 200 --inline
+"""
+import argparse
+import asyncio
+import time
+
+from _support import add_database_arguments, load_server, percentile
+
+PASSWORD = 'storm-password'
+
+
+async def seed(server, users: int, movies: int):
+    password_hash = server._hash_password(PASSWORD)
+    await server.db.users.insert_many([
+        {'id': f'user-{i}', 'email': f'user{i}@bench.example.com', 'name': f'User {i}',
+         'password_hash': password_hash, 'balance': 100000.0}
+        for i in range(users)
+    ])
+    await server.db.movies.insert_many([
+        {'id': f'movie-{i}', 'title': f'Movie {i}', 'symbol': f'MOV{i}', 'current_price': 100.0,
+         'initial_price': 100.0, 'total_shares': 1000, 'available_shares': 1000}
+        for i in range(movies)
+    ])
+
+
+async def read_movies(server, stop: asyncio.Event, timings: list, interval: float = 0.01):
+    """Issue requests on a fixed schedule; latency counts from the scheduled
+    arrival, so time spent waiting for a blocked event loop is included"""
+    arrival = time.perf_counter()
+    while not stop.is_set():
+        arrival += interval
+        await asyncio.sleep(max(arrival - time.perf_counter(), 0))
+        await server.get_movies()
+        timings.append((time.perf_counter() - arrival) * 1000)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--movies', type=int, default=50)
+    parser.add_argument('--inline', action='store_true', help='Verify passwords on the event loop')
+    args = parser.parse_args()
+
+    server = await load_server(args)
+    await seed(server, args.logins, args.movies)
+
+    if args.inline:
+        async def verify_inline(password, hashed):
+            return server._verify_password(password, hashed)
+        server.verify_password = verify_inline
+
+    stop = asyncio.Event()
+    timings = []
+    reader = asyncio.create_task(read_movies(server, stop, timings))
+    await asyncio.sleep(0.2)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        server.login(server.UserLogin(email=f'user{i}@bench.example.com', password=PASSWORD))
+        for i in range(args.logins)
+    ))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await reader
+
+    timings.sort()
+    mode = 'inline' if args.inline else f'executor ({server.AUTH_EXECUTOR_WORKERS} workers)'
+    print(f"bcrypt: {mode}, rounds {server.BCRYPT_ROUNDS}")
+    print(f"{args.logins} logins in {elapsed:.2f}s")
+    print(f"/api/movies during storm: {len(timings)} requests  "
+          f"p50 {percentile(timings, 50):.1f} ms  p99 {percentile(timings, 99):.1f} ms  max {timings[-1]:.1f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""Latency benchmark for GET /api/portfolio against holding count.
+
+Seeds one user per holding count and times get_portfolio for each.
+
+    python benchmarks/bench_portfolio.py --holdings 10 100 1000
+    python benchmarks/bench_portfolio.py --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import time
+
+from _support import add_database_arguments, load_server, percentile
+
+
+async def seed(db, holdings: int):
+    await db.movies.insert_many([
+        {
+            'id': f'movie-{i}',
+            'title': f'Movie {i}',
+            'symbol': f'MOV{i}',
+            'current_price': 100.0 + i % 50,
+            'initial_price': 100.0,
+            'total_shares': 100000,
+            'available_shares': 100000,
+            'volume': 0,
+            'change': 0.0,
+            'change_percent': 0.0,
+        }
+        for i in range(holdings)
+    ])
+
+
+async def seed_user(db, user_id: str, holdings: int):
+    await db.users.insert_one({'id': user_id, 'email': f'{user_id}@bench.local', 'name': user_id, 'balance': 100000.0})
+    await db.portfolio.insert_many([
+        {
+            'id': f'{user_id}-{i}',
+            'user_id': user_id,
+            'movie_id': f'movie-{i}',
+            'movie_title': f'Movie {i}',
+            'movie_symbol': f'MOV{i}',
+            'quantity': 10,
+            'avg_price': 95.0,
+        }
+        for i in range(holdings)
+    ])
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--holdings', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--requests', type=int, default=50, help='Requests per holding count')
+    args = parser.parse_args()
+
+    server = await load_server(args)
+    await seed(server.db, max(args.holdings))
+
+    print(f"{'holdings':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+    for holdings in args.holdings:
+        user_id = f'user-{holdings}'
+        await seed_user(server.db, user_id, holdings)
+        current_user = await server.db.users.find_one({'id': user_id}, {'_id': 0})
+
+        timings = []
+        for _ in range(args.requests):
+            started = time.perf_counter()
+            result = await server.get_portfolio(current_user)
+            timings.append((time.perf_counter() - started) * 1000)
+        assert len(result['portfolio']) == holdings, 'holdings were truncated'
+
+        timings.sort()
+        print(f"{holdings:>9} {percentile(timings, 50):>9.2f} {percentile(timings, 95):>9.2f} {timings[-1]:>9.2f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""Compare price-impact and walk models by replaying order flow offline.
+
+Generates synthetic flow (popularity-skewed movies, log-normal sizes) or
+loads the recorded transactions from a MongoDB, then runs it through
+every requested impact x walk combination with price_models.replay().
+Mongo is only read, never written.
+
+    python benchmarks/bench_price_models.py --trades 1000000 --ticks 1000
+    python benchmarks/bench_price_models.py --impact linear sqrt --walk none uniform ou
+    python benchmarks/bench_price_models.py --recorded --mongo-url mongodb://localhost:27017 --db-name test_database
+"""
+import argparse
+import time
+from datetime import datetime
+
+import numpy as np
+
+import _support  # noqa: F401 - puts backend/ on sys.path
+from price_models import IMPACT_MODELS, WALK_MODELS, impact_model, replay, walk_model
+
+
+def synthetic_flow(rng: np.random.Generator, movies: int, trades: int, ticks: int, buy_share: float) -> dict:
+    # Listing prices and floats drawn like /api/movies/sync does
+    initial_prices = np.round(rng.uniform(50, 500, movies), 2)
+    return {
+        'initial_prices': initial_prices,
+        'prices': initial_prices.copy(),
+        'total_shares': rng.integers(10000, 100001, movies).astype(np.float64),
+        'movies': (rng.zipf(1.5, trades) - 1) % movies,
+        'quantities': np.minimum(rng.lognormal(3, 1.5, trades).astype(np.int64) + 1, 10000),
+        'buys': rng.random(trades) < buy_share,
+        'ticks': np.sort(rng.integers(0, ticks, trades)),
+    }
+
+
+def recorded_flow(mongo_url: str, db_name: str, tick_seconds: float) -> dict:
+    """Every stored transaction, replayed from each movie's listing price"""
+    from pymongo import MongoClient
+
+    db = MongoClient(mongo_url)[db_name]
+    movies = list(db.movies.find({}, {'_id': 0, 'id': 1, 'initial_price': 1, 'total_shares': 1}))
+    index = {movie['id']: i for i, movie in enumerate(movies)}
+    transactions = [
+        doc for doc in db.transactions.find(
+            {}, {'_id': 0, 'movie_id': 1, 'type': 1, 'quantity': 1, 'timestamp': 1}
+        ).sort('timestamp', 1)
+        if doc['movie_id'] in index
+    ]
+    if not transactions:
+        raise SystemExit(f'No transactions for listed movies in {db_name}')
+    initial_prices = np.array([movie['initial_price'] for movie in movies], dtype=np.float64)
+    started = datetime.fromisoformat(transactions[0]['timestamp'])
+    return {
+        'initial_prices': initial_prices,
+        'prices': initial_prices.copy(),
+        'total_shares': np.array([movie['total_shares'] for movie in movies], dtype=np.float64),
+        'movies': np.array([index[doc['movie_id']] for doc in transactions]),
+        'quantities': np.array([doc['quantity'] for doc in transactions]),
+        'buys': np.array([doc['type'] == 'BUY' for doc in transactions]),
+        'ticks': np.array([
+            int((datetime.fromisoformat(doc['timestamp']) - started).total_seconds() // tick_seconds)
+            for doc in transactions
+        ]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--impact', nargs='+', default=list(IMPACT_MODELS), choices=list(IMPACT_MODELS))
+    parser.add_argument('--walk', nargs='+', default=['none', *WALK_MODELS], choices=['none', *WALK_MODELS])
+    parser.add_argument('--trades', type=int, default=1000000)
+    parser.add_argument('--movies', type=int, default=2000)
+    parser.add_argument('--ticks', type=int, default=1000, help='Simulator ticks the flow is spread over')
+    parser.add_argument('--buy-share', type=float, default=0.55, help='Fraction of synthetic trades that buy')
+    parser.add_argument('--volatility', type=float, default=2.0, help='PRICE_VOLATILITY_PERCENT')
+    parser.add_argument('--reversion', type=float, default=0.01, help='PRICE_MEAN_REVERSION')
+    parser.add_argument('--tick-seconds', type=float, default=30.0, help='PRICE_TICK_SECONDS, for recorded flow')
+    parser.add_argument('--recorded', action='store_true', help='Replay the transactions stored in MongoDB')
+    parser.add_argument('--mongo-url', default='mongodb://localhost:27017')
+    parser.add_argument('--db-name', default='test_database')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.recorded:
+        flow = recorded_flow(args.mongo_url, args.db_name, args.tick_seconds)
+    else:
+        flow = synthetic_flow(np.random.default_rng(args.seed), args.movies, args.trades, args.ticks, args.buy_share)
+    print(f"{len(flow['movies'])} trades on {len(flow['prices'])} movies over {int(flow['ticks'][-1]) + 1} ticks")
+
+    print(f"{'impact':>7} {'walk':>8} {'seconds':>8} {'trades/s':>10} {'|move| p50':>11} {'|move| p99':>11} "
+          f"{'floored':>8} {'tick vol%':>10} {'|drift|%':>9}")
+    for impact_name in args.impact:
+        for walk_name in args.walk:
+            walk = None if walk_name == 'none' else walk_model(walk_name, args.volatility, args.reversion)
+            started = time.perf_counter()
+            result = replay(
+                impact_model(impact_name), flow['prices'], flow['initial_prices'], flow['total_shares'],
+                flow['movies'], flow['quantities'], flow['buys'], flow['ticks'], walk,
+                np.random.default_rng(args.seed)
+            )
+            elapsed = time.perf_counter() - started
+
+            moves = np.abs(result['move_percent'])
+            # Per-tick returns exist only when the walk steps the whole market
+            if result['closes'] is not None and result['closes'].shape[1] > 1:
+                tick_volatility = float(np.diff(np.log(result['closes']), axis=1).std() * 100)
+            else:
+                tick_volatility = float('nan')
+            drift = float(np.abs(np.log(result['prices'] / flow['initial_prices'])).mean() * 100)
+            print(f"{impact_name:>7} {walk_name:>8} {elapsed:>8.2f} {len(moves) / elapsed:>10.0f} "
+                  f"{np.percentile(moves, 50):>11.4f} {np.percentile(moves, 99):>11.4f} "
+                  f"{result['floored']:>8} {tick_volatility:>10.3f} {drift:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
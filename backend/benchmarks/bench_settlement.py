@@ -0,0 +1,125 @@
+"""Concurrency stress benchmark for trade settlement.
+
+Many users buy and sell the same movie at once. Afterwards the run checks
+that no balance went negative, the float was never oversold, and shares
+and cash were conserved.
+
+    python benchmarks/bench_settlement.py --users 200 --orders 20
+    python benchmarks/bench_settlement.py --mongo-url mongodb://localhost:27017
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+
+from fastapi import HTTPException
+
+from _support import add_database_arguments, load_server
+
+STARTING_BALANCE = 5000.0
+
+
+async def seed(db, users: int, total_shares: int):
+    await db.movies.insert_one({
+        'id': 'bench-movie',
+        'title': 'Benchmark',
+        'symbol': 'BENCH',
+        'current_price': 100.0,
+        'initial_price': 100.0,
+        'total_shares': total_shares,
+        'available_shares': total_shares,
+        'volume': 0,
+        'change': 0.0,
+        'change_percent': 0.0,
+    })
+    await db.users.insert_many([
+        {'id': f'user-{i}', 'email': f'user{i}@bench.local', 'name': f'User {i}', 'balance': STARTING_BALANCE}
+        for i in range(users)
+    ])
+
+
+async def trader(server, user_id: str, orders: int, max_quantity: int, stats: dict):
+    rng = random.Random(user_id)
+    user = {'id': user_id}
+    for _ in range(orders):
+        movie = await server.db.movies.find_one({'id': 'bench-movie'})
+        order = server.TradeOrder(
+            movie_id='bench-movie',
+            action='buy' if rng.random() < 0.7 else 'sell',
+            quantity=rng.randint(1, max_quantity),
+        )
+        try:
+            if order.action == 'buy':
+                await server.settle_market_buy(user_id, movie, order.quantity)
+            else:
+                await server.settle_market_sell(user_id, movie, order.quantity)
+            stats['filled'] += 1
+        except HTTPException:
+            stats['rejected'] += 1
+        # Move the price between trades so buyers race on changing costs
+        await server.update_movie_price('bench-movie', order.quantity, order.action)
+
+
+async def check_invariants(db, users: int, total_shares: int) -> list:
+    errors = []
+    movie = await db.movies.find_one({'id': 'bench-movie'})
+    holdings = await db.portfolio.find({'movie_id': 'bench-movie'}).to_list(None)
+    held = sum(h['quantity'] for h in holdings)
+
+    if movie['available_shares'] < 0:
+        errors.append(f"float oversold: available_shares={movie['available_shares']}")
+    if held + movie['available_shares'] != total_shares:
+        errors.append(f"shares not conserved: held={held} available={movie['available_shares']}")
+    if any(h['quantity'] < 0 for h in holdings):
+        errors.append('negative holding')
+    if len({h['user_id'] for h in holdings}) != len(holdings):
+        errors.append('duplicate holding documents')
+
+    balances = await db.users.find({}, {'balance': 1}).to_list(None)
+    if any(u['balance'] < -1e-6 for u in balances):
+        errors.append('negative balance')
+
+    transactions = await db.transactions.find({}, {'type': 1, 'amount': 1}).to_list(None)
+    net_spent = sum(t['amount'] if t['type'] == 'BUY' else -t['amount'] for t in transactions)
+    cash = sum(u['balance'] for u in balances)
+    if abs(users * STARTING_BALANCE - net_spent - cash) > 0.01:
+        errors.append(f"cash not conserved: drift={users * STARTING_BALANCE - net_spent - cash:.4f}")
+    return errors
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--orders', type=int, default=20, help='Orders per user')
+    parser.add_argument('--max-quantity', type=int, default=10)
+    parser.add_argument('--total-shares', type=int, default=2000,
+                        help='Kept small so the float runs out under load')
+    args = parser.parse_args()
+
+    server = await load_server(args)
+    await seed(server.db, args.users, args.total_shares)
+
+    stats = {'filled': 0, 'rejected': 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        trader(server, f'user-{i}', args.orders, args.max_quantity, stats)
+        for i in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+
+    await server.transaction_ledger.flush(server.db.transactions)
+    errors = await check_invariants(server.db, args.users, args.total_shares)
+    total = stats['filled'] + stats['rejected']
+    print(f"orders: {total}  filled: {stats['filled']}  rejected: {stats['rejected']}")
+    print(f"elapsed: {elapsed:.2f}s  throughput: {total / elapsed:.0f} orders/s")
+    for error in errors:
+        print(f"INVARIANT VIOLATED: {error}")
+    if errors:
+        sys.exit(1)
+    print('invariants: ok')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
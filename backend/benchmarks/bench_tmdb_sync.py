@@ -0,0 +1,108 @@
+"""End-to-end benchmark of POST /api/movies/sync against a local TMDb stub.
+
+The stub serves discover pages and movie details with artificial latency
+and answers a share of requests with 429 + Retry-After, so the run
+exercises pooling, bounded fan-out and rate-limit retries.
+
+    python benchmarks/bench_tmdb_sync.py --pages 5 --latency-ms 50
+    python benchmarks/bench_tmdb_sync.py --rate-limit 0.2 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from _support import add_database_arguments, load_server
+from tmdb_client import TMDbClient
+
+PER_PAGE = 20
+
+
+def make_handler(latency: float, rate_limit: float, stats: dict):
+    class StubTMDbHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status: int, body: dict, headers: dict = None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            stats['requests'] += 1
+            time.sleep(latency)
+            if random.random() < rate_limit:
+                stats['rate_limited'] += 1
+                self.send_json(429, {'status_message': 'Rate limited'}, {'Retry-After': '0.05'})
+                return
+
+            url = urlparse(self.path)
+            if url.path == '/discover/movie':
+                page = int(parse_qs(url.query).get('page', ['1'])[0])
+                first = (page - 1) * PER_PAGE
+                self.send_json(200, {'page': page, 'results': [
+                    {'id': tmdb_id, 'title': f'Stub Movie {tmdb_id}', 'overview': '', 'release_date': '2025-01-01'}
+                    for tmdb_id in range(first, first + PER_PAGE)
+                ]})
+            elif url.path.startswith('/movie/'):
+                tmdb_id = int(url.path.rsplit('/', 1)[1])
+                self.send_json(200, {
+                    'id': tmdb_id,
+                    'genres': [{'name': 'Drama'}],
+                    'credits': {'cast': [{'name': f'Actor {i}'} for i in range(8)]}
+                })
+            else:
+                self.send_json(404, {'status_message': 'Not found'})
+
+    return StubTMDbHandler
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_arguments(parser)
+    parser.add_argument('--pages', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--rate-limit', type=float, default=0.1, help='Share of requests answered with 429')
+    args = parser.parse_args()
+
+    stats = {'requests': 0, 'rate_limited': 0}
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(args.latency_ms / 1000, args.rate_limit, stats))
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+
+    server = await load_server(args)
+    server.TMDB_API_KEY = 'stub'
+    server.TMDB_SYNC_PAGES = args.pages
+    server.tmdb_client = TMDbClient(
+        'stub', f'http://127.0.0.1:{stub.server_port}', max_concurrency=args.concurrency, max_retries=5
+    )
+
+    try:
+        started = time.perf_counter()
+        result = await server.sync_movies()
+        first = time.perf_counter() - started
+
+        started = time.perf_counter()
+        again = await server.sync_movies()
+        second = time.perf_counter() - started
+    finally:
+        await server.tmdb_client.close()
+        stub.shutdown()
+
+    movies = await server.db.movies.count_documents({})
+    print(f"first sync:  {result['message']} in {first:.2f}s")
+    print(f"second sync: {again['message']} in {second:.2f}s")
+    print(f"stub requests: {stats['requests']}  rate limited: {stats['rate_limited']}  movies stored: {movies}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
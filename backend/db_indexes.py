@@ -0,0 +1,186 @@
+"""Index declarations for every collection, plus a query-plan audit.
+
+server.py calls ensure_indexes() at startup. The audit runs explain() on
+the lookup shapes server.py issues and reports any that still fall back
+to a collection scan. Run it by hand with
+
+    python db_indexes.py
+
+which creates the indexes and exits non-zero if any query plan contains
+COLLSCAN. Setting INDEX_AUDIT_ON_STARTUP=1 makes the server refuse to
+start in the same situation.
+
+The declared unique indexes are not optional: settlement turns a failed
+guard into an upsert that must collide with one, so the server always
+refuses to start without them (missing_unique_indexes()).
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+INDEXES = {
+    'users': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        IndexModel([('email', ASCENDING)], unique=True),
+    ],
+    'movies': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        # Not unique: movies seeded by populate_movies.py have tmdb_id None
+        IndexModel([('tmdb_id', ASCENDING)]),
+    ],
+    'portfolio': [
+        IndexModel([('user_id', ASCENDING), ('movie_id', ASCENDING)], unique=True),
+    ],
+    'transactions': [
+        IndexModel([('user_id', ASCENDING), ('timestamp', DESCENDING), ('id', DESCENDING)]),
+        # Unique so replaying the write-ahead log after a crash cannot duplicate
+        IndexModel([('id', ASCENDING)], unique=True),
+        # Archive rollover walks old transactions in timestamp order
+        IndexModel([('timestamp', ASCENDING)]),
+    ],
+    'orders': [
+        IndexModel([('id', ASCENDING)], unique=True),
+        # Order book owners sweep their shards' movie_id ranges by status
+        IndexModel([('status', ASCENDING), ('movie_id', ASCENDING)]),
+        IndexModel([('user_id', ASCENDING), ('status', ASCENDING)]),
+        IndexModel([('cancel_requested', ASCENDING), ('movie_id', ASCENDING)], sparse=True),
+    ],
+    'price_candles': [
+        IndexModel([('movie_id', ASCENDING), ('interval', ASCENDING), ('start', ASCENDING)], unique=True),
+    ],
+    # Presence documents of lease holders that exited without cleaning up
+    'simulator_workers': [
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=3600),
+    ],
+    'order_book_workers': [
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=3600),
+    ],
+    # Cross-worker price fan-out; readers only look back a few seconds
+    'price_ticks': [
+        IndexModel([('at', ASCENDING)], expireAfterSeconds=300),
+    ],
+}
+
+# (collection, filter, sort) for every indexed lookup in server.py. Full
+# catalogue reads (simulator ticks, board loads) scan by design and are
+# not listed.
+AUDITED_QUERIES = [
+    ('users', {'id': 'audit'}, None),
+    ('users', {'email': 'audit@example.com'}, None),
+    ('users', {'id': 'audit', 'balance': {'$gte': 1.0}}, None),
+    ('movies', {'id': 'audit'}, None),
+    ('movies', {'id': {'$in': ['audit-1', 'audit-2']}}, None),
+    ('movies', {'id': 'audit', 'available_shares': {'$gte': 1}}, None),
+    ('movies', {'tmdb_id': {'$in': [1, 2]}}, None),
+    ('portfolio', {'user_id': 'audit'}, None),
+    ('portfolio', {'user_id': 'audit', 'movie_id': 'audit'}, None),
+    ('portfolio', {'user_id': 'audit', 'movie_id': 'audit', 'quantity': {'$lte': 0}}, None),
+    ('transactions', {'user_id': 'audit'}, [('timestamp', DESCENDING), ('id', DESCENDING)]),
+    ('transactions', {'user_id': 'audit', '$or': [
+        {'timestamp': {'$lt': '2024-01-01T00:00:00+00:00'}},
+        {'timestamp': '2024-01-01T00:00:00+00:00', 'id': {'$lt': 'audit'}},
+    ]}, [('timestamp', DESCENDING), ('id', DESCENDING)]),
+    ('transactions', {'timestamp': {'$lt': '2024-01-01T00:00:00+00:00'}}, [('timestamp', ASCENDING)]),
+    ('transactions', {'id': {'$in': ['audit-1', 'audit-2']}}, None),
+    ('movies', {'id': {'$gt': 'audit'}}, [('id', ASCENDING)]),
+    ('orders', {'id': 'audit'}, None),
+    ('orders', {'status': 'open'}, None),
+    ('orders', {'status': 'pending', 'movie_id': {'$gte': '20', '$lt': '40'}}, [('created_at', ASCENDING)]),
+    ('orders', {'status': 'new', 'movie_id': {'$gte': '20', '$lt': '40'},
+                'created_at': {'$lt': '2024-01-01T00:00:00+00:00'}}, None),
+    ('orders', {'cancel_requested': True, 'movie_id': {'$gte': '20', '$lt': '40'},
+                'status': {'$in': ['pending', 'matching', 'open']}}, None),
+    ('orders', {'movie_id': 'audit', 'status': 'open'}, None),
+    ('orders', {'user_id': 'audit', 'status': {'$in': ['pending', 'matching', 'open']}}, [('created_at', ASCENDING)]),
+    ('price_candles', {'movie_id': 'audit', 'interval': '1h',
+                       'start': {'$gte': datetime(2024, 1, 1, tzinfo=timezone.utc)}}, [('start', DESCENDING)]),
+    ('price_ticks', {'at': {'$gt': datetime(2024, 1, 1, tzinfo=timezone.utc)}}, [('at', ASCENDING)]),
+    ('price_candles', {'movie_id': {'$in': ['audit-1', 'audit-2']}, 'interval': '1d',
+                       'start': {'$gte': datetime(2024, 1, 1, tzinfo=timezone.utc)}}, None),
+]
+
+
+async def ensure_indexes(db):
+    """Create every declared index; existing ones are left alone"""
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # Typically duplicates blocking a unique index; the checks below
+            # refuse to run without it
+            logging.error(f"Could not create indexes on {collection}: {str(e)}")
+
+
+async def missing_unique_indexes(db) -> List[str]:
+    """Every declared unique index the database does not have"""
+    missing = []
+    for collection, indexes in INDEXES.items():
+        existing = {
+            tuple(map(tuple, info['key'])) for info in (await db[collection].index_information()).values()
+            if info.get('unique')
+        }
+        for index in indexes:
+            key = tuple(index.document['key'].items())
+            if index.document.get('unique') and key not in existing:
+                missing.append(f"{collection} {[field for field, _ in key]}")
+    return missing
+
+
+def plan_stages(plan) -> List[str]:
+    """Every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+async def audit_query_plans(db) -> List[str]:
+    """Return a description of every audited query whose plan is a COLLSCAN"""
+    failures = []
+    for collection, query, sort in AUDITED_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained = await cursor.explain()
+        stages = plan_stages(explained.get('queryPlanner', {}).get('winningPlan', {}))
+        if 'COLLSCAN' in stages:
+            failures.append(f"{collection}.find({query}){f'.sort({sort})' if sort else ''}: {' <- '.join(stages)}")
+    return failures
+
+
+async def main():
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        await ensure_indexes(db)
+        failures = [f"missing unique index: {index}" for index in await missing_unique_indexes(db)]
+        failures += [f"COLLSCAN: {failure}" for failure in await audit_query_plans(db)]
+    finally:
+        client.close()
+
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+    print(f"All {len(AUDITED_QUERIES)} audited queries use an index")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
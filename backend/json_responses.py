@@ -0,0 +1,121 @@
+"""Fast JSON responses and size-gated compression.
+
+FastJSONResponse renders with orjson when it is installed (falling back
+to the standard library), and handlers return it directly so FastAPI
+skips its jsonable_encoder walk over large lists of plain dicts.
+
+CompressionMiddleware compresses responses above a size threshold,
+preferring brotli when the package is installed and the client accepts
+it. A body sent in several chunks is buffered up to buffer_limit and
+compressed whole. Streaming responses (SSE, NDJSON) pass through
+untouched so events are never held back in a compressor buffer.
+"""
+import gzip
+import json
+from typing import Any
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional encoding
+    brotli = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    accepted = {part.split(';')[0].strip().lower() for part in accept_encoding.split(',')}
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return ''
+
+
+# Content types whose chunks must reach the client as they are produced
+STREAMING_TYPES = ('text/event-stream', 'application/x-ndjson')
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4,
+                 buffer_limit: int = 4 * 1024 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.buffer_limit = buffer_limit
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == 'br':
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start: dict = {}
+        chunks = []
+        buffered = 0
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start, buffered, passthrough
+            if message['type'] == 'http.response.start':
+                start = message
+                return
+            if message['type'] != 'http.response.body' or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start['headers'])
+            chunks.append(message.get('body', b''))
+            buffered += len(chunks[-1])
+            more_body = message.get('more_body', False)
+            streaming = headers.get('content-type', '').split(';')[0].strip() in STREAMING_TYPES
+            if (streaming or 'content-encoding' in headers or buffered > self.buffer_limit
+                    or (not more_body and buffered < self.minimum_size)):
+                # Streaming, already encoded, too large to hold or too small:
+                # send what was held as-is and pass the rest through
+                passthrough = True
+                await send(start)
+                await send({'type': 'http.response.body', 'body': b''.join(chunks), 'more_body': more_body})
+                chunks.clear()
+                return
+            if more_body:
+                return
+
+            body = self.compress(b''.join(chunks), encoding)
+            chunks.clear()
+            headers['Content-Encoding'] = encoding
+            # The compressed bytes differ from what a strong ETag names
+            if 'etag' in headers and not headers['etag'].startswith('W/'):
+                headers['ETag'] = 'W/' + headers['etag']
+            headers['Content-Length'] = str(len(body))
+            headers.add_vary_header('Accept-Encoding')
+            await send(start)
+            await send({'type': 'http.response.body', 'body': body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,146 @@
+"""In-memory market leaderboards behind /api/market/trending.
+
+Movies are kept in sorted (value, id) lists per ranked field, so the top
+or bottom K can be read off either end without touching the database.
+Single-movie updates (trades) move one entry; large batches (simulator
+ticks) are cheaper to re-sort in one go. The board also keeps a running
+market cap for /api/market/stats, recomputed by every load() from the
+same snapshot; the server also resets it from a $group aggregation on
+its refresh schedule.
+"""
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Fields kept per movie and returned by the trending endpoint
+BOARD_FIELDS = (
+    'id', 'tmdb_id', 'title', 'symbol', 'poster',
+    'current_price', 'initial_price', 'change', 'change_percent', 'volume',
+    'total_shares',
+)
+
+# Batches touching more than this share of the catalogue are re-sorted
+REBUILD_FRACTION = 0.05
+
+
+class Leaderboard:
+    """Movie ids sorted ascending by one numeric field"""
+
+    def __init__(self, field: str):
+        self.field = field
+        self._entries: List[Tuple[float, str]] = []
+
+    def rebuild(self, movies: Dict[str, dict]):
+        self._entries = sorted((movie[self.field], movie_id) for movie_id, movie in movies.items())
+
+    def add(self, value: float, movie_id: str):
+        insort(self._entries, (value, movie_id))
+
+    def remove(self, value: float, movie_id: str):
+        index = bisect_left(self._entries, (value, movie_id))
+        if index < len(self._entries) and self._entries[index] == (value, movie_id):
+            del self._entries[index]
+
+    def lowest(self, k: int, below: Optional[float] = None) -> List[str]:
+        ids = []
+        for value, movie_id in self._entries[:k]:
+            if below is not None and value >= below:
+                break
+            ids.append(movie_id)
+        return ids
+
+    def highest(self, k: int, above: Optional[float] = None) -> List[str]:
+        ids = []
+        for value, movie_id in reversed(self._entries[-k:] if k else []):
+            if above is not None and value <= above:
+                break
+            ids.append(movie_id)
+        return ids
+
+
+class MarketBoard:
+    def __init__(self):
+        self._movies: Dict[str, dict] = {}
+        self._by_change = Leaderboard('change_percent')
+        self._by_volume = Leaderboard('volume')
+        self.version = 0
+        self.market_cap = 0.0
+        self._cache: Dict[int, dict] = {}
+
+    def __len__(self) -> int:
+        return len(self._movies)
+
+    def _changed(self):
+        self.version += 1
+        self._cache.clear()
+
+    @staticmethod
+    def _summary(movie: dict) -> dict:
+        summary = {field: movie.get(field) for field in BOARD_FIELDS}
+        summary['change'] = summary['change'] or 0.0
+        summary['change_percent'] = summary['change_percent'] or 0.0
+        summary['volume'] = summary['volume'] or 0
+        summary['total_shares'] = summary['total_shares'] or 0
+        return summary
+
+    def load(self, movies: Iterable[dict]):
+        """Replace the board with a fresh snapshot of the catalogue"""
+        self._movies = {movie['id']: self._summary(movie) for movie in movies}
+        self.market_cap = sum(movie['current_price'] * movie['total_shares'] for movie in self._movies.values())
+        self._by_change.rebuild(self._movies)
+        self._by_volume.rebuild(self._movies)
+        self._changed()
+
+    def add_movie(self, movie: dict):
+        if movie['id'] in self._movies:
+            return
+        summary = self._summary(movie)
+        self._movies[movie['id']] = summary
+        self._by_change.add(summary['change_percent'], summary['id'])
+        self._by_volume.add(summary['volume'], summary['id'])
+        self.market_cap += summary['current_price'] * summary['total_shares']
+        self._changed()
+
+    def apply_prices(self, deltas: List[dict]):
+        """Apply {id, price, change, change_percent} deltas"""
+        updates = [delta for delta in deltas if delta['id'] in self._movies]
+        if not updates:
+            return
+
+        rebuild = len(updates) > len(self._movies) * REBUILD_FRACTION
+        for delta in updates:
+            movie = self._movies[delta['id']]
+            if not rebuild:
+                self._by_change.remove(movie['change_percent'], movie['id'])
+            self.market_cap += (delta['price'] - movie['current_price']) * movie['total_shares']
+            movie['current_price'] = delta['price']
+            movie['change'] = delta['change']
+            movie['change_percent'] = delta['change_percent']
+            if not rebuild:
+                self._by_change.add(movie['change_percent'], movie['id'])
+
+        if rebuild:
+            self._by_change.rebuild(self._movies)
+        self._changed()
+
+    def add_volume(self, movie_id: str, quantity: int):
+        movie = self._movies.get(movie_id)
+        if movie is None:
+            return
+        self._by_volume.remove(movie['volume'], movie_id)
+        movie['volume'] += quantity
+        self._by_volume.add(movie['volume'], movie_id)
+        self._changed()
+
+    def trending(self, k: int = 10) -> dict:
+        """Top K gainers, losers and volume leaders, cached until the next change"""
+        cached = self._cache.get(k)
+        if cached:
+            return cached
+
+        payload = {
+            'gainers': [dict(self._movies[i]) for i in self._by_change.highest(k, above=0)],
+            'losers': [dict(self._movies[i]) for i in self._by_change.lowest(k, below=0)],
+            'volume_leaders': [dict(self._movies[i]) for i in self._by_volume.highest(k)]
+        }
+        self._cache[k] = payload
+        return payload
@@ -0,0 +1,1166 @@
+"""In-process stand-in for MongoDB, selected with STORAGE=memory.
+
+MemoryClient implements the part of Motor's client, database, collection
+and cursor API that the backend uses: filters, updates (including
+pipeline updates and $expr guards), upserts, bulk writes, sorts,
+projections and the aggregation stages server.py runs. Documents live in
+a dict per collection. Each declared index keeps a hash map from its
+leading field's value to documents, and a sorted view of its full
+compound key that is rebuilt lazily. Equality and $in lookups, prefix
+and range scans and sorted pages on indexed fields therefore never scan
+the collection. Unique
+indexes raise the same DuplicateKeyError and BulkWriteError (code 11000)
+that MongoDB does, which the guarded upserts rely on. Documents are
+copied on every read and write. Datetimes are stored the way BSON stores
+them: naive UTC with millisecond precision.
+
+Nothing is persisted, and every process has its own data, so it suits a
+single worker: load tests, CI benchmarks, and measuring handler cost
+without database round-trips. Each operation is still reported to the
+client's command listeners, so /api/metrics keeps counting round-trips.
+"""
+import asyncio
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from itertools import count, product
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+MISSING = object()
+
+# Documents handed out per getMore, as MongoDB does after the first batch
+CURSOR_BATCH_SIZE = 101
+
+# Sorts after every sort_key(), to bound key prefixes in index scans
+KEY_MAX = (11,)
+
+
+class CommandEvent(NamedTuple):
+    """The fields of a pymongo command event that CommandTracker reads"""
+    command_name: str
+    duration_micros: int
+
+
+# ---- values ----
+
+def to_bson(value):
+    """Copy a value as MongoDB would store it"""
+    if isinstance(value, dict):
+        return {key: to_bson(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_bson(item) for item in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+
+def copy_value(value):
+    if isinstance(value, dict):
+        return {key: copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [copy_value(item) for item in value]
+    return value
+
+
+def get_path(doc: dict, path: str):
+    if '.' not in path:
+        return doc.get(path, MISSING)
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return MISSING
+    return value
+
+
+def set_path(doc: dict, path: str, value) -> bool:
+    """Set a dotted field, creating parents; returns whether it changed"""
+    *parents, name = path.split('.')
+    for part in parents:
+        child = doc.get(part)
+        if not isinstance(child, dict):
+            child = doc[part] = {}
+        doc = child
+    if name in doc and type(doc[name]) is type(value) and doc[name] == value:
+        return False
+    doc[name] = value
+    return True
+
+
+def unset_path(doc: dict, path: str) -> bool:
+    *parents, name = path.split('.')
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return False
+    return doc.pop(name, MISSING) is not MISSING
+
+
+def type_rank(value) -> int:
+    """BSON comparison order of a value's type"""
+    if value is None or value is MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+
+def sort_key(value) -> tuple:
+    rank = type_rank(value)
+    if rank == 1:
+        return rank, 0
+    if rank in (4, 5, 10):
+        return rank, repr(value)
+    return rank, value
+
+
+def equal(value, target) -> bool:
+    if type(value) is type(target):
+        return value == target
+    if value is MISSING:
+        return target is None
+    if isinstance(value, list) and not isinstance(target, list):
+        return any(equal(item, target) for item in value)
+    return type_rank(value) == type_rank(target) and value == target
+
+
+def compare(value, operator: str, target) -> bool:
+    """$gt/$gte/$lt/$lte: only values of the same type bracket compare"""
+    if isinstance(value, list):
+        return any(compare(item, operator, target) for item in value)
+    if value is MISSING or type_rank(value) != type_rank(target) or type_rank(value) in (4, 5):
+        return False
+    if operator == '$gt':
+        return value > target
+    if operator == '$gte':
+        return value >= target
+    if operator == '$lt':
+        return value < target
+    return value <= target
+
+
+def hashable(value):
+    """Index key of a value; None for values that cannot be indexed"""
+    if value is MISSING:
+        return None
+    if isinstance(value, (dict, list)):
+        raise TypeError('unindexable')
+    return value
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return tuple((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+# ---- queries ----
+
+def is_operator_dict(condition) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(key.startswith('$') for key in condition)
+
+
+def matcher(query: dict) -> Callable[[dict], bool]:
+    """Compile a filter into a predicate over documents"""
+    tests = []
+    for key, condition in query.items():
+        if key in ('$or', '$and', '$nor'):
+            clauses = [matcher(clause) for clause in condition]
+            if key == '$or':
+                tests.append(lambda doc, clauses=clauses: any(clause(doc) for clause in clauses))
+            elif key == '$and':
+                tests.append(lambda doc, clauses=clauses: all(clause(doc) for clause in clauses))
+            else:
+                tests.append(lambda doc, clauses=clauses: not any(clause(doc) for clause in clauses))
+        elif key == '$expr':
+            tests.append(lambda doc, expression=condition: truthy(evaluate(expression, doc)))
+        elif key.startswith('$'):
+            raise OperationFailure(f"unknown top level operator: {key}", 2)
+        else:
+            test = condition_matcher(condition)
+            tests.append(lambda doc, key=key, test=test: test(get_path(doc, key)))
+    if len(tests) == 1:
+        return tests[0]
+    return lambda doc: all(test(doc) for test in tests)
+
+
+def in_matcher(targets: list) -> Callable[[Any], bool]:
+    """$in against a hashed set of its scalar values"""
+    scalars: Dict[Any, list] = {}
+    others = []
+    for target in targets:
+        if isinstance(target, (dict, list)):
+            others.append(target)
+        else:
+            scalars.setdefault(target, []).append(target)
+
+    def test(value):
+        if isinstance(value, list):
+            return any(test(item) for item in value) or any(equal(value, target) for target in others)
+        if value is MISSING:
+            value = None
+        if not isinstance(value, dict):
+            bucket = scalars.get(value)
+            if bucket and any(equal(value, target) for target in bucket):
+                return True
+        return any(equal(value, target) for target in others)
+    return test
+
+
+def condition_matcher(condition) -> Callable[[Any], bool]:
+    if not is_operator_dict(condition):
+        return lambda value: equal(value, condition)
+    tests = []
+    for operator, target in condition.items():
+        if operator == '$eq':
+            tests.append(lambda value, target=target: equal(value, target))
+        elif operator == '$ne':
+            tests.append(lambda value, target=target: not equal(value, target))
+        elif operator in ('$gt', '$gte', '$lt', '$lte'):
+            tests.append(lambda value, operator=operator, target=target: compare(value, operator, target))
+        elif operator == '$in':
+            tests.append(in_matcher(target))
+        elif operator == '$nin':
+            test = in_matcher(target)
+            tests.append(lambda value, test=test: not test(value))
+        elif operator == '$exists':
+            tests.append(lambda value, exists=bool(target): (value is not MISSING) == exists)
+        elif operator == '$not':
+            test = condition_matcher(target)
+            tests.append(lambda value, test=test: not test(value))
+        else:
+            raise OperationFailure(f"unknown operator: {operator}", 2)
+    if len(tests) == 1:
+        return tests[0]
+    return lambda value: all(test(value) for test in tests)
+
+
+# ---- aggregation expressions ----
+
+def truthy(value) -> bool:
+    if value is None or value is MISSING or value is False:
+        return False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value != 0
+    return True
+
+
+def evaluate(expression, doc: dict):
+    if isinstance(expression, str) and expression.startswith('$') and not expression.startswith('$$'):
+        value = get_path(doc, expression[1:])
+        return None if value is MISSING else value
+    if isinstance(expression, list):
+        return [evaluate(item, doc) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) != 1 or not next(iter(expression)).startswith('$'):
+        return {key: evaluate(item, doc) for key, item in expression.items()}
+
+    operator, arguments = next(iter(expression.items()))
+    if operator == '$literal':
+        return arguments
+    if operator == '$cond':
+        if isinstance(arguments, dict):
+            arguments = [arguments['if'], arguments['then'], arguments['else']]
+        condition, then, otherwise = arguments
+        return evaluate(then if truthy(evaluate(condition, doc)) else otherwise, doc)
+    values = evaluate(arguments if isinstance(arguments, list) else [arguments], doc)
+
+    if operator == '$ifNull':
+        return next((value for value in values if value is not None), None)
+    if operator in ('$max', '$min'):
+        present = [value for value in values if value is not None]
+        if not present:
+            return None
+        return (max if operator == '$max' else min)(present, key=sort_key)
+    if operator in ('$add', '$subtract', '$multiply', '$divide'):
+        if any(value is None for value in values):
+            return None
+        if operator == '$add':
+            return sum(values)
+        if operator == '$multiply':
+            product = 1
+            for value in values:
+                product *= value
+            return product
+        left, right = values
+        if operator == '$subtract':
+            return left - right
+        if right == 0:
+            raise OperationFailure("can't $divide by zero", 2)
+        return left / right
+    if operator == '$round':
+        value, places = (values + [0])[:2]
+        return None if value is None else round(value, places)
+    if operator in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte'):
+        left, right = (sort_key(value) for value in values)
+        return {
+            '$eq': left == right, '$ne': left != right, '$gt': left > right,
+            '$gte': left >= right, '$lt': left < right, '$lte': left <= right,
+        }[operator]
+    if operator == '$and':
+        return all(truthy(value) for value in values)
+    if operator == '$or':
+        return any(truthy(value) for value in values)
+    if operator == '$not':
+        return not truthy(values[0])
+    raise OperationFailure(f"Unrecognized expression '{operator}'", 168)
+
+
+# ---- updates ----
+
+def apply_update(doc: dict, update, inserting: bool) -> bool:
+    """Apply an update document or pipeline in place; returns whether doc changed"""
+    changed = False
+    if isinstance(update, list):
+        for stage in update:
+            (name, spec), = stage.items()
+            if name in ('$set', '$addFields'):
+                values = {path: evaluate(expression, doc) for path, expression in spec.items()}
+                for path, value in values.items():
+                    changed |= set_path(doc, path, to_bson(value))
+            elif name == '$unset':
+                for path in [spec] if isinstance(spec, str) else spec:
+                    changed |= unset_path(doc, path)
+            else:
+                raise OperationFailure(f"{name} is not allowed to be used within an update", 72)
+        return changed
+
+    if not update or not all(key.startswith('$') for key in update):
+        raise ValueError('update only works with $ operators')
+    for operator, fields in update.items():
+        for path, argument in fields.items():
+            argument = to_bson(argument)
+            current = get_path(doc, path)
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                changed |= set_path(doc, path, argument)
+            elif operator == '$setOnInsert':
+                continue
+            elif operator == '$unset':
+                changed |= unset_path(doc, path)
+            elif operator in ('$inc', '$mul'):
+                if current is not MISSING and type_rank(current) != 2:
+                    raise OperationFailure(f"Cannot apply {operator} to a value of non-numeric type", 14)
+                if operator == '$inc':
+                    value = argument if current is MISSING else current + argument
+                else:
+                    value = 0 if current is MISSING else current * argument
+                changed |= set_path(doc, path, value)
+            elif operator in ('$min', '$max'):
+                if current is MISSING or (
+                    sort_key(argument) < sort_key(current) if operator == '$min' else sort_key(argument) > sort_key(current)
+                ):
+                    changed |= set_path(doc, path, argument)
+            elif operator == '$push':
+                if current is MISSING:
+                    current = []
+                elif not isinstance(current, list):
+                    raise OperationFailure(f"The field '{path}' must be an array", 2)
+                items = argument['$each'] if isinstance(argument, dict) and '$each' in argument else [argument]
+                changed |= set_path(doc, path, current + items)
+            elif operator == '$pull':
+                if current is MISSING:
+                    continue
+                if not isinstance(current, list):
+                    raise OperationFailure("Cannot apply $pull to a non-array value", 2)
+                test = condition_matcher(argument)
+                changed |= set_path(doc, path, [item for item in current if not test(item)])
+            else:
+                raise OperationFailure(f"Unknown modifier: {operator}", 9)
+    return changed
+
+
+def upsert_seed(query: dict) -> dict:
+    """The document an upsert starts from: the query's equality conditions"""
+    doc = {}
+    for key, condition in query.items():
+        if key == '$and':
+            for clause in condition:
+                doc.update(upsert_seed(clause))
+        elif key.startswith('$'):
+            continue
+        elif not is_operator_dict(condition):
+            set_path(doc, key, to_bson(condition))
+        elif '$eq' in condition:
+            set_path(doc, key, to_bson(condition['$eq']))
+    return doc
+
+
+def projector(projection):
+    """A function copying the projected part of a document"""
+    if projection is None:
+        return copy_value
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    keep_id = bool(projection.get('_id', 1))
+    fields = {field: value for field, value in projection.items() if field != '_id'}
+    if any(not isinstance(value, (bool, int)) for value in fields.values()):
+        raise OperationFailure('Only inclusion and exclusion projections are supported', 2)
+
+    if any(fields.values()):
+        included = list(fields)
+
+        def project(doc):
+            result = {'_id': doc['_id']} if keep_id and '_id' in doc else {}
+            for field in included:
+                value = get_path(doc, field)
+                if value is not MISSING:
+                    set_path(result, field, copy_value(value))
+            return result
+        return project
+
+    excluded = set(fields)
+    if not keep_id:
+        excluded.add('_id')
+
+    def project(doc):
+        return {key: copy_value(value) for key, value in doc.items() if key not in excluded}
+    return project
+
+
+def sort_spec(key_or_list, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction or 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return [(key, value) for key, value in key_or_list]
+
+
+def sort_documents(docs: list, spec: List[Tuple[str, int]], key=lambda doc: doc):
+    for field, direction in reversed(spec):
+        docs.sort(key=lambda item: sort_key(get_path(key(item), field)), reverse=direction < 0)
+
+
+# ---- indexes ----
+
+class Index:
+    """A hash map on the leading field, a lazily sorted view of the full key
+    for prefix and range scans, and, when unique, the owner of each key"""
+
+    def __init__(self, name: str, fields: List[str], unique: bool):
+        self.name = name
+        self.fields = fields
+        self.unique = unique
+        self.leading: Dict[Any, Set[int]] = {}
+        self.keys: Dict[tuple, int] = {}
+        # Documents whose leading value is an array or object; while there
+        # are any the index is not used to answer queries
+        self.unindexable: Set[int] = set()
+        self._sort_keys: Dict[int, tuple] = {}
+        self._sorted_keys: Optional[list] = None
+        self._sorted_seqs: Optional[list] = None
+
+    def full_key(self, doc: dict) -> tuple:
+        # Missing fields index as null, as in MongoDB
+        values = (get_path(doc, field) for field in self.fields)
+        return tuple(None if value is MISSING else freeze(value) for value in values)
+
+    def conflict(self, doc: dict, seq: Optional[int]) -> Optional[int]:
+        if not self.unique:
+            return None
+        owner = self.keys.get(self.full_key(doc))
+        return owner if owner is not None and owner != seq else None
+
+    def add(self, doc: dict, seq: int):
+        try:
+            value = hashable(get_path(doc, self.fields[0]))
+        except TypeError:
+            self.unindexable.add(seq)
+        else:
+            self.leading.setdefault(value, set()).add(seq)
+            self._sort_keys[seq] = tuple(sort_key(get_path(doc, field)) for field in self.fields)
+        if self.unique:
+            self.keys[self.full_key(doc)] = seq
+        self._sorted_keys = self._sorted_seqs = None
+
+    def remove(self, doc: dict, seq: int):
+        if seq in self.unindexable:
+            self.unindexable.discard(seq)
+        else:
+            value = hashable(get_path(doc, self.fields[0]))
+            bucket = self.leading.get(value)
+            if bucket is not None:
+                bucket.discard(seq)
+                if not bucket:
+                    del self.leading[value]
+            self._sort_keys.pop(seq, None)
+        key = self.full_key(doc)
+        if self.unique and self.keys.get(key) == seq:
+            del self.keys[key]
+        self._sorted_keys = self._sorted_seqs = None
+
+    def affected(self, old: dict, new: dict) -> bool:
+        return any(get_path(old, field) != get_path(new, field) for field in self.fields)
+
+    def usable(self) -> bool:
+        return not self.unindexable
+
+    def lookup(self, values: Iterable) -> Set[int]:
+        found = set()
+        for value in values:
+            found |= self.leading.get(value, set())
+        return found
+
+    def scan(self, prefixes: List[tuple], bounds: Optional[dict], reverse: bool) -> List[int]:
+        """Documents in key order whose leading fields equal one of the
+        prefixes, narrowed by a range on the field after them"""
+        if self._sorted_keys is None:
+            entries = sorted((key, seq) for seq, key in self._sort_keys.items())
+            self._sorted_keys = [key for key, _ in entries]
+            self._sorted_seqs = [seq for _, seq in entries]
+        keys = self._sorted_keys
+        seqs = []
+        for prefix in prefixes:
+            prefix = tuple(sort_key(value) for value in prefix)
+            start, end = bisect_left(keys, prefix), bisect_left(keys, prefix + (KEY_MAX,))
+            for operator, target in (bounds or {}).items():
+                key = prefix + (sort_key(target),)
+                if operator == '$gt':
+                    start = max(start, bisect_left(keys, key + (KEY_MAX,)))
+                elif operator == '$gte':
+                    start = max(start, bisect_left(keys, key))
+                elif operator == '$lt':
+                    end = min(end, bisect_left(keys, key))
+                elif operator == '$lte':
+                    end = min(end, bisect_left(keys, key + (KEY_MAX,)))
+            seqs.extend(self._sorted_seqs[start:end])
+        return seqs[::-1] if reverse else seqs
+
+    def information(self) -> dict:
+        info = {'key': [(field, 1) for field in self.fields], 'v': 2}
+        if self.unique:
+            info['unique'] = True
+        return info
+
+
+def equality_values(condition) -> Optional[list]:
+    """The values an indexed field must equal under a condition, if it pins them"""
+    try:
+        if not isinstance(condition, dict):
+            return None if isinstance(condition, list) else [hashable(condition)]
+        if '$eq' in condition and not isinstance(condition['$eq'], list):
+            return [hashable(condition['$eq'])]
+        if '$in' in condition and not any(isinstance(value, list) for value in condition['$in']):
+            return [hashable(value) for value in condition['$in']]
+    except TypeError:
+        pass
+    return None
+
+
+def range_condition(condition) -> Optional[dict]:
+    if not is_operator_dict(condition):
+        return None
+    bounds = {operator: target for operator, target in condition.items()
+              if operator in ('$gt', '$gte', '$lt', '$lte')}
+    if not bounds or len({type_rank(target) for target in bounds.values()}) != 1:
+        return None
+    return bounds
+
+
+# ---- collection ----
+
+class MemoryCollection:
+    def __init__(self, database: 'MemoryDatabase', name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+        self._docs: Dict[int, dict] = {}
+        self._sequence = count()
+        self._indexes: Dict[str, Index] = {'_id_': Index('_id_', ['_id'], True)}
+
+    def __repr__(self):
+        return f'MemoryCollection({self.full_name!r})'
+
+    # -- planning --
+
+    def _plan(self, query: dict, spec: Optional[List[Tuple[str, int]]]) -> Tuple[List[int], bool, str]:
+        """(candidate documents, already in sort order, index used), from the
+        index whose leading fields the query pins down the furthest"""
+        best, best_score = None, 0
+        for index in self._indexes.values():
+            if not index.usable():
+                continue
+            pinned = []
+            for field in index.fields:
+                values = equality_values(query[field]) if field in query else None
+                if values is None:
+                    break
+                pinned.append(values)
+            bounds = None
+            if len(pinned) < len(index.fields) and index.fields[len(pinned)] in query:
+                bounds = range_condition(query[index.fields[len(pinned)]])
+            exact = index.unique and len(pinned) == len(index.fields)
+            score = len(pinned) + (0.5 if bounds else 0) + (1 if exact else 0)
+            if score > best_score:
+                best, best_score, best_pinned, best_bounds = index, score, pinned, bounds
+
+        if best is None:
+            if spec and len(spec) == 1:
+                for index in self._indexes.values():
+                    if index.usable() and index.fields[0] == spec[0][0]:
+                        return index.scan([()], None, spec[0][1] < 0), True, index.name
+            return list(self._docs), not spec, None
+
+        index, pinned, bounds = best, best_pinned, best_bounds
+        if index.unique and len(pinned) == len(index.fields):
+            owners = (index.keys.get(tuple(freeze(value) for value in key)) for key in product(*pinned))
+            return sorted(seq for seq in owners if seq is not None), not spec, index.name
+        if len(pinned) == 1 and bounds is None:
+            # Hash lookup: no sorted view to rebuild on busy collections
+            return sorted(index.lookup(pinned[0])), not spec, index.name
+        prefixes = list(product(*pinned))
+        # A single prefix scanned in (reverse) key order satisfies a sort on
+        # the fields that follow it
+        follows = bool(spec) and len(prefixes) == 1 and (
+            [field for field, _ in spec] == index.fields[len(pinned):len(pinned) + len(spec)]
+            and len({direction for _, direction in spec}) == 1
+        )
+        reverse = follows and spec[0][1] < 0
+        return index.scan(prefixes, bounds, reverse), not spec or follows, index.name
+
+    def _select(self, query: Optional[dict], spec=None, skip: int = 0, limit: int = 0) -> Iterator[int]:
+        """Matching documents in result order, lazily when no sort is needed"""
+        query = to_bson(query or {})
+        candidates, ordered, _ = self._plan(query, spec)
+        matches = matcher(query) if query else lambda doc: True
+        if not ordered:
+            found = [seq for seq in candidates if seq in self._docs and matches(self._docs[seq])]
+            sort_documents(found, spec, key=self._docs.__getitem__)
+            candidates = found
+        produced = 0
+        for seq in candidates:
+            doc = self._docs.get(seq)
+            if doc is None or (ordered and not matches(doc)):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            yield seq
+            produced += 1
+            if limit and produced >= limit:
+                return
+
+    def _first(self, query: Optional[dict], sort=None) -> Optional[int]:
+        return next(self._select(query, sort_spec(sort) if sort else None, limit=1), None)
+
+    # -- writes --
+
+    def _check_unique(self, doc: dict, seq: Optional[int], indexes: Iterable[Index]):
+        for index in indexes:
+            owner = index.conflict(doc, seq)
+            if owner is not None:
+                key = ', '.join(f'{field}: {get_path(doc, field)!r}' for field in index.fields)
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.full_name} index: {index.name} dup key: {{ {key} }}",
+                    11000, {'index': 0, 'code': 11000, 'keyPattern': {field: 1 for field in index.fields}}
+                )
+
+    def _insert(self, doc: dict) -> Any:
+        doc = to_bson(doc)
+        doc.setdefault('_id', ObjectId())
+        self._check_unique(doc, None, self._indexes.values())
+        seq = next(self._sequence)
+        self._docs[seq] = doc
+        for index in self._indexes.values():
+            index.add(doc, seq)
+        self.database.created.add(self.name)
+        return doc['_id']
+
+    def _replace(self, seq: int, new: dict):
+        old = self._docs[seq]
+        if new.get('_id', MISSING) != old['_id']:
+            raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'", 66)
+        affected = [index for index in self._indexes.values() if index.affected(old, new)]
+        self._check_unique(new, seq, affected)
+        for index in affected:
+            index.remove(old, seq)
+        self._docs[seq] = new
+        for index in affected:
+            index.add(new, seq)
+
+    def _delete(self, seq: int):
+        doc = self._docs.pop(seq)
+        for index in self._indexes.values():
+            index.remove(doc, seq)
+
+    def _update(self, query: dict, update, upsert: bool, multi: bool, replacement: bool = False) -> dict:
+        """Raw result of an update: n matched, nModified, and the upserted _id"""
+        targets = list(self._select(query, limit=0 if multi else 1))
+        modified = 0
+        for seq in targets:
+            new = copy_value(self._docs[seq])
+            if replacement:
+                new = {'_id': new['_id'], **to_bson(update)}
+                changed = new != self._docs[seq]
+            else:
+                changed = apply_update(new, update, False)
+            if changed:
+                self._replace(seq, new)
+                modified += 1
+        if targets or not upsert:
+            return {'n': len(targets), 'nModified': modified}
+
+        doc = upsert_seed(to_bson(query))
+        if replacement:
+            doc = {**({'_id': doc['_id']} if '_id' in doc else {}), **to_bson(update)}
+        else:
+            apply_update(doc, update, True)
+        return {'n': 1, 'nModified': 0, 'upserted': self._insert(doc)}
+
+    async def _command(self, command_name: str, operation, *args, **kwargs):
+        """Yield to the loop like a round-trip would, then run and report the operation"""
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        try:
+            return operation(*args, **kwargs)
+        finally:
+            self.database.client.report(command_name, time.perf_counter() - started)
+
+    async def insert_one(self, document: dict) -> InsertOneResult:
+        document.setdefault('_id', ObjectId())
+        inserted_id = await self._command('insert', self._insert, document)
+        return InsertOneResult(inserted_id, True)
+
+    async def insert_many(self, documents: Iterable[dict], ordered: bool = True) -> InsertManyResult:
+        documents = list(documents)
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+        await self._command('insert', self._bulk, [('insert', (document,)) for document in documents], ordered)
+        return InsertManyResult([document['_id'] for document in documents], True)
+
+    async def update_one(self, filter: dict, update, upsert: bool = False) -> UpdateResult:
+        return UpdateResult(await self._command('update', self._update, filter, update, upsert, False), True)
+
+    async def update_many(self, filter: dict, update, upsert: bool = False) -> UpdateResult:
+        return UpdateResult(await self._command('update', self._update, filter, update, upsert, True), True)
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False) -> UpdateResult:
+        return UpdateResult(
+            await self._command('update', self._update, filter, replacement, upsert, False, True), True
+        )
+
+    def _delete_matching(self, query: dict, multi: bool) -> dict:
+        targets = list(self._select(query, limit=0 if multi else 1))
+        for seq in targets:
+            self._delete(seq)
+        return {'n': len(targets)}
+
+    async def delete_one(self, filter: dict) -> DeleteResult:
+        return DeleteResult(await self._command('delete', self._delete_matching, filter, False), True)
+
+    async def delete_many(self, filter: dict) -> DeleteResult:
+        return DeleteResult(await self._command('delete', self._delete_matching, filter, True), True)
+
+    def _find_and_modify(self, query, update, projection, sort, upsert, return_document, remove) -> Optional[dict]:
+        seq = self._first(query, sort)
+        if seq is None:
+            if not upsert or remove:
+                return None
+            upserted = self._update(query, update, True, False)['upserted']
+            if return_document != ReturnDocument.AFTER:
+                return None
+            seq = self._first({'_id': upserted})
+        before = self._docs[seq]
+        if remove:
+            self._delete(seq)
+            return projector(projection)(before)
+        new = copy_value(before)
+        if apply_update(new, update, False):
+            self._replace(seq, new)
+        return projector(projection)(self._docs[seq] if return_document == ReturnDocument.AFTER else before)
+
+    async def find_one_and_update(self, filter: dict, update, projection=None, sort=None, upsert: bool = False,
+                                  return_document: bool = ReturnDocument.BEFORE) -> Optional[dict]:
+        return await self._command(
+            'findAndModify', self._find_and_modify, filter, update, projection, sort, upsert, return_document, False
+        )
+
+    async def find_one_and_delete(self, filter: dict, projection=None, sort=None) -> Optional[dict]:
+        return await self._command(
+            'findAndModify', self._find_and_modify, filter, None, projection, sort, False, False, True
+        )
+
+    def _bulk(self, requests: List[Tuple[str, tuple]], ordered: bool) -> dict:
+        result = {
+            'writeErrors': [], 'writeConcernErrors': [], 'nInserted': 0, 'nUpserted': 0,
+            'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': []
+        }
+        for index, (kind, arguments) in enumerate(requests):
+            try:
+                if kind == 'insert':
+                    self._insert(*arguments)
+                    result['nInserted'] += 1
+                elif kind == 'delete':
+                    result['nRemoved'] += self._delete_matching(*arguments)['n']
+                else:
+                    raw = self._update(*arguments)
+                    if 'upserted' in raw:
+                        result['nUpserted'] += 1
+                        result['upserted'].append({'index': index, '_id': raw['upserted']})
+                    else:
+                        result['nMatched'] += raw['n']
+                        result['nModified'] += raw['nModified']
+            except OperationFailure as e:
+                result['writeErrors'].append({'index': index, 'code': e.code, 'errmsg': str(e), 'op': arguments[0]})
+                if ordered:
+                    break
+        if result['writeErrors']:
+            raise BulkWriteError(result)
+        return result
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        collected = BulkRequests()
+        for request in requests:
+            request._add_to_bulk(collected)
+        return BulkWriteResult(await self._command('bulkWrite', self._bulk, collected.requests, ordered), True)
+
+    # -- reads --
+
+    def find(self, filter: Optional[dict] = None, projection=None, sort=None, skip: int = 0,
+             limit: int = 0) -> 'MemoryCursor':
+        cursor = MemoryCursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    async def find_one(self, filter: Optional[dict] = None, projection=None, sort=None) -> Optional[dict]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        return await self.find(filter, projection, sort=sort).limit(1).next_or_none()
+
+    def _count(self, query: dict, skip: int, limit: int) -> int:
+        if not query and not skip and not limit:
+            return len(self._docs)
+        return sum(1 for _ in self._select(query, skip=skip, limit=limit))
+
+    async def count_documents(self, filter: dict, skip: int = 0, limit: int = 0) -> int:
+        return await self._command('count', self._count, filter, skip, limit)
+
+    async def estimated_document_count(self) -> int:
+        return await self._command('count', len, self._docs)
+
+    def _distinct(self, key: str, query: Optional[dict]) -> list:
+        seen = {}
+        for seq in self._select(query):
+            value = get_path(self._docs[seq], key)
+            for item in value if isinstance(value, list) else [value]:
+                if item is not MISSING:
+                    seen.setdefault(freeze(item), item)
+        return [copy_value(value) for value in seen.values()]
+
+    async def distinct(self, key: str, filter: Optional[dict] = None) -> list:
+        return await self._command('distinct', self._distinct, key, filter)
+
+    def aggregate(self, pipeline: List[dict]) -> 'MemoryCursor':
+        return MemoryCursor(self, pipeline=pipeline)
+
+    # -- indexes --
+
+    def _create_index(self, keys, unique: bool = False, name: Optional[str] = None, **options) -> str:
+        spec = sort_spec(keys)
+        name = name or '_'.join(f'{field}_{direction}' for field, direction in spec)
+        if name in self._indexes:
+            return name
+        index = Index(name, [field for field, _ in spec], unique)
+        for seq, doc in self._docs.items():
+            if index.conflict(doc, seq) is not None:
+                raise OperationFailure(f"E11000 duplicate key error collection: {self.full_name} index: {name}", 11000)
+            index.add(doc, seq)
+        self._indexes[name] = index
+        self.database.created.add(self.name)
+        return name
+
+    async def create_index(self, keys, **options) -> str:
+        return await self._command('createIndexes', self._create_index, keys, **options)
+
+    async def create_indexes(self, indexes: list) -> List[str]:
+        names = []
+        for model in indexes:
+            document = dict(model.document)
+            names.append(await self.create_index(list(document.pop('key').items()), **document))
+        return names
+
+    async def index_information(self) -> dict:
+        return {name: index.information() for name, index in self._indexes.items()}
+
+    async def drop(self):
+        await self.database.drop_collection(self.name)
+
+
+class BulkRequests:
+    """Receives pymongo write models through their _add_to_bulk() hook"""
+
+    def __init__(self):
+        self.requests: List[Tuple[str, tuple]] = []
+
+    def add_insert(self, document: dict):
+        document.setdefault('_id', ObjectId())
+        self.requests.append(('insert', (document,)))
+
+    def add_update(self, selector: dict, update, multi: bool, upsert: bool, **options):
+        self.requests.append(('update', (selector, update, upsert, multi)))
+
+    def add_replace(self, selector: dict, replacement: dict, upsert: bool, **options):
+        self.requests.append(('update', (selector, replacement, upsert, False, True)))
+
+    def add_delete(self, selector: dict, limit: int, **options):
+        self.requests.append(('delete', (selector, limit != 1)))
+
+
+# ---- cursors ----
+
+def run_pipeline(collection: MemoryCollection, pipeline: List[dict]) -> List[dict]:
+    stages = list(pipeline)
+    query = stages.pop(0)['$match'] if stages and '$match' in stages[0] else {}
+    docs = [collection._docs[seq] for seq in collection._select(query)]
+    copied = False
+    for stage in stages:
+        (name, spec), = stage.items()
+        if name == '$match':
+            matches = matcher(to_bson(spec))
+            docs = [doc for doc in docs if matches(doc)]
+        elif name == '$group':
+            docs = group(docs, spec)
+            copied = True
+        elif name == '$sort':
+            docs = list(docs)
+            sort_documents(docs, sort_spec(spec))
+        elif name == '$skip':
+            docs = docs[spec:]
+        elif name == '$limit':
+            docs = docs[:spec]
+        elif name == '$count':
+            docs = [{spec: len(docs)}]
+            copied = True
+        elif name == '$project':
+            if any(not isinstance(value, (bool, int)) for field, value in spec.items() if field != '_id'):
+                docs = [
+                    {**({'_id': doc.get('_id')} if spec.get('_id', 1) else {}),
+                     **{field: evaluate(expression, doc) for field, expression in spec.items() if field != '_id'}}
+                    for doc in docs
+                ]
+            else:
+                docs = [projector(spec)(doc) for doc in docs]
+            copied = True
+        else:
+            raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'", 40324)
+    return docs if copied else [copy_value(doc) for doc in docs]
+
+
+def group(docs: List[dict], spec: dict) -> List[dict]:
+    groups: Dict[Any, dict] = {}
+    values: Dict[Any, Dict[str, list]] = {}
+    accumulators = {field: next(iter(accumulator.items())) for field, accumulator in spec.items() if field != '_id'}
+    for doc in docs:
+        key = evaluate(spec['_id'], doc)
+        frozen = freeze(key)
+        if frozen not in groups:
+            groups[frozen] = {'_id': key}
+            values[frozen] = {field: [] for field in accumulators}
+        for field, (_, expression) in accumulators.items():
+            values[frozen][field].append(evaluate(expression, doc))
+
+    for frozen, result in groups.items():
+        for field, (operator, _) in accumulators.items():
+            collected = values[frozen][field]
+            numbers = [value for value in collected if type_rank(value) == 2]
+            present = [value for value in collected if value is not None]
+            if operator == '$sum':
+                result[field] = sum(numbers)
+            elif operator == '$avg':
+                result[field] = sum(numbers) / len(numbers) if numbers else None
+            elif operator in ('$min', '$max'):
+                result[field] = (min if operator == '$min' else max)(present, key=sort_key) if present else None
+            elif operator == '$first':
+                result[field] = collected[0]
+            elif operator == '$last':
+                result[field] = collected[-1]
+            elif operator == '$push':
+                result[field] = collected
+            else:
+                raise OperationFailure(f"unknown group operator '{operator}'", 15952)
+    return list(groups.values())
+
+
+class MemoryCursor:
+    """A find() or aggregate() cursor; results are produced on first fetch"""
+
+    def __init__(self, collection: MemoryCollection, filter: Optional[dict] = None, projection=None,
+                 pipeline: Optional[List[dict]] = None):
+        self.collection = collection
+        self._filter = filter
+        self._project = projector(projection)
+        self._pipeline = pipeline
+        self._sort: Optional[List[Tuple[str, int]]] = None
+        self._skip = 0
+        self._limit = 0
+        self._results: Optional[Iterator[dict]] = None
+        self._fetched = 0
+
+    def sort(self, key_or_list, direction=None) -> 'MemoryCursor':
+        self._sort = sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip: int) -> 'MemoryCursor':
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> 'MemoryCursor':
+        self._limit = abs(limit)
+        return self
+
+    def batch_size(self, batch_size: int) -> 'MemoryCursor':
+        return self
+
+    def _open(self):
+        collection = self.collection
+        if self._pipeline is not None:
+            self._results = iter(run_pipeline(collection, self._pipeline))
+        else:
+            seqs = collection._select(self._filter, self._sort, self._skip, self._limit)
+            self._results = (self._project(collection._docs[seq]) for seq in seqs)
+
+    def _take(self, length: Optional[int]) -> List[dict]:
+        if self._results is None:
+            self._open()
+        taken = []
+        for doc in self._results:
+            taken.append(doc)
+            if length is not None and len(taken) >= length:
+                break
+        return taken
+
+    async def _fetch(self, length: Optional[int]) -> List[dict]:
+        if self._pipeline is not None:
+            name = 'aggregate' if self._results is None else 'getMore'
+        else:
+            name = 'find' if self._results is None else 'getMore'
+        return await self.collection._command(name, self._take, length)
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        return await self._fetch(length or None)
+
+    async def next_or_none(self) -> Optional[dict]:
+        docs = await self._fetch(1)
+        return docs[0] if docs else None
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            batch = await self._fetch(CURSOR_BATCH_SIZE)
+            for doc in batch:
+                yield doc
+            if len(batch) < CURSOR_BATCH_SIZE:
+                return
+
+    async def explain(self) -> dict:
+        query = to_bson(self._filter or {})
+        _, ordered, index = self.collection._plan(query, self._sort)
+        stage = {'stage': 'COLLSCAN'} if index is None else {
+            'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': index}
+        }
+        if not ordered:
+            stage = {'stage': 'SORT', 'inputStage': stage}
+        return {'queryPlanner': {'winningPlan': stage}}
+
+    def close(self):
+        self._results = iter(())
+
+
+# ---- client and database ----
+
+class MemoryDatabase:
+    def __init__(self, client: 'MemoryClient', name: str):
+        self.client = client
+        self.name = name
+        self._collections: Dict[str, MemoryCollection] = {}
+        # Collections that exist as far as MongoDB semantics go: written to or created
+        self.created: Set[str] = set()
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = MemoryCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str) -> MemoryCollection:
+        return self[name]
+
+    async def create_collection(self, name: str, **options) -> MemoryCollection:
+        """Options such as timeseries are accepted and ignored"""
+        if name in self.created:
+            raise CollectionInvalid(f"collection {name} already exists")
+        self.created.add(name)
+        return self[name]
+
+    async def list_collection_names(self) -> List[str]:
+        return sorted(self.created)
+
+    async def drop_collection(self, name: str):
+        self._collections.pop(name, None)
+        self.created.discard(name)
+
+
+class MemoryClient:
+    def __init__(self, event_listeners: Iterable = ()):
+        self._listeners = list(event_listeners)
+        self._databases: Dict[str, MemoryDatabase] = {}
+
+    def __getitem__(self, name: str) -> MemoryDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = MemoryDatabase(self, name)
+        return database
+
+    def __getattr__(self, name: str) -> MemoryDatabase:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str) -> MemoryDatabase:
+        return self[name]
+
+    def report(self, command_name: str, seconds: float):
+        event = CommandEvent(command_name, int(seconds * 1e6))
+        for listener in self._listeners:
+            listener.succeeded(event)
+
+    async def drop_database(self, name_or_database):
+        name = getattr(name_or_database, 'name', name_or_database)
+        self._databases.pop(name, None)
+
+    def close(self):
+        pass
@@ -0,0 +1,248 @@
+"""In-memory net worth of every user, ranked for /api/leaderboard.
+
+Holdings are kept as parallel (user, movie, quantity) arrays, so
+re-marking everyone against new prices is one bincount over them. Cash
+is the user's balance plus funds reserved by open limit buys: placing or
+cancelling an order moves money between the two, so only trades change
+a user's net worth. Trades update one user and move one entry in the
+ranking. Price changes are only recorded; the publisher calls reprice()
+once per simulator tick (and server.py on a short interval for trade
+moves), which re-marks everyone in one vectorized pass, so readers never
+pay for it. Only the users whose net worth changed then move in the
+ranking, or it is rebuilt once when many did. The ranking is a
+SortedList of (negated net worth, user), so moving a user and finding a
+rank are O(log n).
+
+Each worker keeps its own board. Like MarketBoard, it is reloaded from
+the database on a schedule to pick up trades made by other workers.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sortedcontainers import SortedList
+
+# reprice() moves users one at a time while fewer than this fraction of
+# them changed; past it, rebuilding the ranking is cheaper
+INCREMENTAL_REPRICE_FRACTION = 0.05
+
+
+class NetWorthBoard:
+    def __init__(self):
+        self._index: Dict[str, int] = {}
+        self._user_ids: List[str] = []
+        self._names: List[str] = []
+        self._cash = np.zeros(0)
+        self._movie_index: Dict[str, int] = {}
+        self._prices = np.zeros(0)
+        # Holdings in parallel arrays; the first _size entries are live.
+        # Loaded holdings are sorted by user, so user u's are the slice
+        # _starts[u]:_starts[u + 1]; ones opened since are appended and
+        # found through _opened.
+        self._holding_user = np.zeros(0, dtype=np.int64)
+        self._holding_movie = np.zeros(0, dtype=np.int64)
+        self._quantity = np.zeros(0)
+        self._size = 0
+        self._starts = np.zeros(1, dtype=np.int64)
+        self._opened: Dict[Tuple[int, int], int] = {}
+        self._opened_by_user: Dict[int, List[int]] = {}
+        self._worth = np.zeros(0)
+        # (negated net worth, user) ascending
+        self._ranking = SortedList()
+        # Prices changed since the last reprice()
+        self._repriced = True
+
+    def __len__(self) -> int:
+        return len(self._user_ids)
+
+    def load(self, users: Iterable[dict], holdings: Iterable[dict], prices: Dict[str, float],
+             reserved: Optional[Dict[str, float]] = None):
+        """Replace the board from {id, name, balance} users, {user_id, movie_id,
+        quantity} holdings and funds reserved by open buys per user"""
+        reserved = reserved or {}
+        self._index = {}
+        self._user_ids = []
+        self._names = []
+        cash = []
+        for user in users:
+            self._index[user['id']] = len(self._user_ids)
+            self._user_ids.append(user['id'])
+            self._names.append(user.get('name', ''))
+            cash.append(user.get('balance', 0.0) + reserved.get(user['id'], 0.0))
+        self._cash = np.array(cash, dtype=np.float64)
+
+        self._movie_index = {movie_id: i for i, movie_id in enumerate(prices)}
+        self._prices = np.fromiter(prices.values(), dtype=np.float64, count=len(prices))
+
+        holdings = list(holdings)
+        count = len(holdings)
+        holding_user = np.fromiter((self._index.get(h['user_id'], -1) for h in holdings), dtype=np.int64, count=count)
+        holding_movie = np.fromiter(
+            (self._movie_index.get(h['movie_id'], -1) for h in holdings), dtype=np.int64, count=count
+        )
+        quantity = np.fromiter((h['quantity'] for h in holdings), dtype=np.float64, count=count)
+        for i in np.flatnonzero(holding_movie < 0):
+            holding_movie[i] = self._movie(holdings[i]['movie_id'])
+
+        # Drop holdings of unknown users and emptied ones, then group by user
+        live = np.flatnonzero((holding_user >= 0) & (quantity != 0))
+        by_user = live[np.argsort(holding_user[live], kind='stable')]
+        self._holding_user = holding_user[by_user]
+        self._holding_movie = holding_movie[by_user]
+        self._quantity = quantity[by_user]
+        self._size = len(by_user)
+        self._starts = np.searchsorted(self._holding_user, np.arange(len(self._user_ids) + 1))
+        self._opened = {}
+        self._opened_by_user = {}
+        self.remark()
+
+    def replace(self, other: 'NetWorthBoard'):
+        """Take over a board loaded off the event loop"""
+        self.__dict__.update(other.__dict__)
+
+    def add_user(self, user_id: str, name: str, cash: float):
+        if user_id in self._index:
+            return
+        user = len(self._user_ids)
+        self._index[user_id] = user
+        self._user_ids.append(user_id)
+        self._names.append(name)
+        self._cash = np.append(self._cash, cash)
+        self._worth = np.append(self._worth, cash)
+        self._insert(user)
+
+    def _movie(self, movie_id: str) -> int:
+        movie = self._movie_index.get(movie_id)
+        if movie is None:
+            # Listed after the last load; priced by the next set_prices()
+            movie = self._movie_index[movie_id] = len(self._prices)
+            self._prices = np.append(self._prices, 0.0)
+        return movie
+
+    def _user_positions(self, user: int) -> np.ndarray:
+        loaded = np.arange(*self._starts[user:user + 2]) if user + 1 < len(self._starts) else []
+        return np.concatenate([loaded, self._opened_by_user.get(user, [])]).astype(np.int64)
+
+    def _position(self, user: int, movie: int) -> Optional[int]:
+        if user + 1 < len(self._starts):
+            start, end = self._starts[user:user + 2]
+            found = np.flatnonzero(self._holding_movie[start:end] == movie)
+            if found.size:
+                return int(start + found[0])
+        return self._opened.get((user, movie))
+
+    def _adjust_holding(self, user: int, movie_id: str, quantity: float) -> int:
+        movie = self._movie(movie_id)
+        position = self._position(user, movie)
+        if position is None:
+            if self._size == len(self._quantity):
+                capacity = max(16, 2 * self._size)
+                self._holding_user = np.resize(self._holding_user, capacity)
+                self._holding_movie = np.resize(self._holding_movie, capacity)
+                self._quantity = np.resize(self._quantity, capacity)
+            position = self._size
+            self._size += 1
+            self._holding_user[position] = user
+            self._holding_movie[position] = movie
+            self._quantity[position] = 0.0
+            self._opened[(user, movie)] = position
+            self._opened_by_user.setdefault(user, []).append(position)
+        self._quantity[position] += quantity
+        return movie
+
+    def apply_transactions(self, transactions: Iterable[dict]):
+        """Apply settled BUY/SELL transaction documents"""
+        touched = set()
+        for transaction in transactions:
+            user = self._index.get(transaction['user_id'])
+            if user is None:
+                continue  # registered on another worker since the last load
+            sign = 1 if transaction['type'] == 'BUY' else -1
+            self._cash[user] -= sign * transaction['amount']
+            movie = self._adjust_holding(user, transaction['movie_id'], sign * transaction['quantity'])
+            if not self._prices[movie]:
+                self._prices[movie] = transaction['price']
+            touched.add(user)
+        for user in touched:
+            self._remove(user)
+            positions = self._user_positions(user)
+            self._worth[user] = self._cash[user] + float(
+                np.dot(self._quantity[positions], self._prices[self._holding_movie[positions]])
+            )
+            self._insert(user)
+
+    def set_prices(self, deltas: Iterable[dict]):
+        """Record {id, price} deltas; ranks move on the next reprice()"""
+        for delta in deltas:
+            movie = self._movie_index.get(delta['id'])
+            if movie is not None and self._prices[movie] != delta['price']:
+                self._prices[movie] = delta['price']
+                self._repriced = False
+
+    def reprice(self):
+        """Re-mark everyone at the recorded prices, moving the users whose net worth changed"""
+        if self._repriced:
+            return
+        self._repriced = True
+        worth = self._marked_worth()
+        moved = np.flatnonzero(worth != self._worth)
+        if len(moved) > INCREMENTAL_REPRICE_FRACTION * len(worth):
+            self._worth = worth
+            self._rank_all()
+            return
+        for user in moved.tolist():
+            self._remove(user)
+            self._worth[user] = worth[user]
+            self._insert(user)
+
+    def remark(self):
+        """Recompute every user's net worth at current prices and re-rank"""
+        self._worth = self._marked_worth()
+        self._rank_all()
+        self._repriced = True
+
+    def _marked_worth(self) -> np.ndarray:
+        size = self._size
+        values = self._quantity[:size] * self._prices[self._holding_movie[:size]]
+        return self._cash + np.bincount(self._holding_user[:size], weights=values, minlength=len(self._cash))
+
+    def _rank_all(self):
+        order = np.argsort(-self._worth, kind='stable')
+        self._ranking = SortedList(zip((-self._worth[order]).tolist(), order.tolist()))
+
+    def _key(self, user: int) -> Tuple[float, int]:
+        return float(-self._worth[user]), user
+
+    def _remove(self, user: int):
+        self._ranking.remove(self._key(user))
+
+    def _insert(self, user: int):
+        self._ranking.add(self._key(user))
+
+    def _rank_of(self, negated_worth: float) -> int:
+        """1 + the number of users with a strictly higher net worth"""
+        return self._ranking.bisect_left((negated_worth, -1)) + 1
+
+    def _entry(self, user: int, rank: int) -> dict:
+        positions = self._user_positions(user)
+        return {
+            'rank': rank,
+            'user_id': self._user_ids[user],
+            'name': self._names[user],
+            'net_worth': round(float(self._worth[user]), 2),
+            'cash': round(float(self._cash[user]), 2),
+            'holdings_value': round(float(self._worth[user] - self._cash[user]), 2),
+            'holdings': int(np.count_nonzero(self._quantity[positions])),
+        }
+
+    def page(self, offset: int, limit: int) -> List[dict]:
+        """Users ranked offset+1 .. offset+limit; tied users share a rank"""
+        return [
+            self._entry(user, self._rank_of(negated_worth))
+            for negated_worth, user in self._ranking.islice(offset, offset + limit)
+        ]
+
+    def rank(self, user_id: str) -> Optional[dict]:
+        user = self._index.get(user_id)
+        if user is None:
+            return None
+        return self._entry(user, self._rank_of(float(-self._worth[user])))
@@ -0,0 +1,293 @@
+"""In-memory limit order books with price-time priority.
+
+Everything in here is synchronous and never touches the database, so a
+submit or cancel costs microseconds. Persisting the resulting fills and
+resting orders is the caller's job (see the order writer in server.py).
+"""
+from bisect import bisect_left, insort
+from collections import deque
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Deque, Dict, List, Optional
+
+# Prices are kept as integer ticks (paise) so book levels never suffer
+# from float comparison issues.
+TICKS_PER_UNIT = 100
+
+
+def to_ticks(price: float) -> int:
+    return int(round(price * TICKS_PER_UNIT))
+
+
+def from_ticks(ticks: int) -> float:
+    return ticks / TICKS_PER_UNIT
+
+
+@dataclass
+class LimitOrder:
+    id: str
+    user_id: str
+    movie_id: str
+    side: str  # 'buy' or 'sell'
+    price_ticks: int
+    quantity: int
+    remaining: int = -1
+    created_at: str = ''
+    seq: int = 0
+
+    def __post_init__(self):
+        if self.remaining < 0:
+            self.remaining = self.quantity
+
+    @property
+    def price(self) -> float:
+        return from_ticks(self.price_ticks)
+
+    @property
+    def filled(self) -> int:
+        return self.quantity - self.remaining
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'movie_id': self.movie_id,
+            'action': self.side,
+            'price': self.price,
+            'quantity': self.quantity,
+            'remaining_quantity': self.remaining,
+            'filled_quantity': self.filled,
+            'created_at': self.created_at,
+        }
+
+
+@dataclass
+class Fill:
+    movie_id: str
+    price_ticks: int
+    quantity: int
+    taker_side: str
+    buy_order_id: str
+    buy_user_id: str
+    buy_limit_ticks: int
+    sell_order_id: str
+    sell_user_id: str
+
+    @property
+    def price(self) -> float:
+        return from_ticks(self.price_ticks)
+
+    def to_dict(self) -> dict:
+        return {
+            'movie_id': self.movie_id,
+            'price': self.price,
+            'quantity': self.quantity,
+            'taker_side': self.taker_side,
+            'buy_order_id': self.buy_order_id,
+            'sell_order_id': self.sell_order_id,
+        }
+
+
+@dataclass
+class MatchResult:
+    order: LimitOrder
+    fills: List[Fill] = field(default_factory=list)
+    # Resting orders of the same user removed by self-trade prevention
+    cancelled: List[LimitOrder] = field(default_factory=list)
+    rested: bool = False
+
+
+class OrderBook:
+    """Bid/ask ladder for a single movie."""
+
+    def __init__(self, movie_id: str):
+        self.movie_id = movie_id
+        # Ascending price lists; best bid is the last bid, best ask the first ask
+        self._bid_prices: List[int] = []
+        self._ask_prices: List[int] = []
+        self._bids: Dict[int, Deque[LimitOrder]] = {}
+        self._asks: Dict[int, Deque[LimitOrder]] = {}
+        self._level_qty: Dict[tuple, int] = {}
+        self.orders: Dict[str, LimitOrder] = {}
+
+    def _side(self, side: str):
+        if side == 'buy':
+            return self._bid_prices, self._bids
+        return self._ask_prices, self._asks
+
+    def best_bid(self) -> Optional[int]:
+        return self._bid_prices[-1] if self._bid_prices else None
+
+    def best_ask(self) -> Optional[int]:
+        return self._ask_prices[0] if self._ask_prices else None
+
+    def _rest(self, order: LimitOrder):
+        prices, levels = self._side(order.side)
+        level = levels.get(order.price_ticks)
+        if level is None:
+            level = levels[order.price_ticks] = deque()
+            insort(prices, order.price_ticks)
+        level.append(order)
+        key = (order.side, order.price_ticks)
+        self._level_qty[key] = self._level_qty.get(key, 0) + order.remaining
+        self.orders[order.id] = order
+
+    def _remove_level_if_empty(self, side: str, price_ticks: int):
+        prices, levels = self._side(side)
+        if not levels[price_ticks]:
+            del levels[price_ticks]
+            prices.pop(bisect_left(prices, price_ticks))
+            self._level_qty.pop((side, price_ticks), None)
+
+    def _reduce(self, order: LimitOrder, quantity: int):
+        order.remaining -= quantity
+        self._level_qty[(order.side, order.price_ticks)] -= quantity
+
+    def submit(self, order: LimitOrder) -> MatchResult:
+        """Match an incoming limit order, resting any unfilled remainder"""
+        result = MatchResult(order=order)
+        contra_side = 'sell' if order.side == 'buy' else 'buy'
+        contra_prices, contra_levels = self._side(contra_side)
+
+        while order.remaining > 0 and contra_prices:
+            best = contra_prices[0] if order.side == 'buy' else contra_prices[-1]
+            crosses = best <= order.price_ticks if order.side == 'buy' else best >= order.price_ticks
+            if not crosses:
+                break
+
+            level = contra_levels[best]
+            while order.remaining > 0 and level:
+                maker = level[0]
+                if maker.user_id == order.user_id:
+                    # Self-trade prevention: pull the older resting order
+                    level.popleft()
+                    self._level_qty[(maker.side, maker.price_ticks)] -= maker.remaining
+                    del self.orders[maker.id]
+                    result.cancelled.append(maker)
+                    continue
+
+                quantity = min(order.remaining, maker.remaining)
+                buy, sell = (order, maker) if order.side == 'buy' else (maker, order)
+                result.fills.append(Fill(
+                    movie_id=self.movie_id,
+                    price_ticks=maker.price_ticks,
+                    quantity=quantity,
+                    taker_side=order.side,
+                    buy_order_id=buy.id,
+                    buy_user_id=buy.user_id,
+                    buy_limit_ticks=buy.price_ticks,
+                    sell_order_id=sell.id,
+                    sell_user_id=sell.user_id,
+                ))
+                order.remaining -= quantity
+                self._reduce(maker, quantity)
+                if maker.remaining == 0:
+                    level.popleft()
+                    del self.orders[maker.id]
+
+            self._remove_level_if_empty(contra_side, best)
+
+        if order.remaining > 0:
+            self._rest(order)
+            result.rested = True
+        return result
+
+    def cancel(self, order_id: str) -> Optional[LimitOrder]:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        _, levels = self._side(order.side)
+        levels[order.price_ticks].remove(order)
+        self._level_qty[(order.side, order.price_ticks)] -= order.remaining
+        self._remove_level_if_empty(order.side, order.price_ticks)
+        return order
+
+    def depth(self, levels: int = 10) -> dict:
+        bids = [
+            {
+                'price': from_ticks(p),
+                'quantity': self._level_qty[('buy', p)],
+                'orders': len(self._bids[p]),
+            }
+            for p in reversed(self._bid_prices[-levels:])
+        ]
+        asks = [
+            {
+                'price': from_ticks(p),
+                'quantity': self._level_qty[('sell', p)],
+                'orders': len(self._asks[p]),
+            }
+            for p in self._ask_prices[:levels]
+        ]
+        return {'bids': bids, 'asks': asks}
+
+
+class MatchingEngine:
+    """Registry of per-movie order books with an order-id index"""
+
+    def __init__(self):
+        self.books: Dict[str, OrderBook] = {}
+        self._order_movie: Dict[str, str] = {}
+        self._seq = count(1)
+
+    def book(self, movie_id: str) -> OrderBook:
+        book = self.books.get(movie_id)
+        if book is None:
+            book = self.books[movie_id] = OrderBook(movie_id)
+        return book
+
+    def submit(self, order: LimitOrder) -> MatchResult:
+        if not order.seq:
+            order.seq = next(self._seq)
+        result = self.book(order.movie_id).submit(order)
+        for fill in result.fills:
+            maker_id = fill.sell_order_id if fill.taker_side == 'buy' else fill.buy_order_id
+            if maker_id not in self.books[order.movie_id].orders:
+                self._order_movie.pop(maker_id, None)
+        for cancelled in result.cancelled:
+            self._order_movie.pop(cancelled.id, None)
+        if result.rested:
+            self._order_movie[order.id] = order.movie_id
+        return result
+
+    def cancel(self, order_id: str) -> Optional[LimitOrder]:
+        movie_id = self._order_movie.pop(order_id, None)
+        if movie_id is None:
+            return None
+        return self.books[movie_id].cancel(order_id)
+
+    def get_order(self, order_id: str) -> Optional[LimitOrder]:
+        movie_id = self._order_movie.get(order_id)
+        if movie_id is None:
+            return None
+        return self.books[movie_id].orders.get(order_id)
+
+    def open_orders(self, user_id: str) -> List[LimitOrder]:
+        orders = [
+            order
+            for book in self.books.values()
+            for order in book.orders.values()
+            if order.user_id == user_id
+        ]
+        return sorted(orders, key=lambda o: o.seq)
+
+    def depth(self, movie_id: str, levels: int = 10) -> dict:
+        book = self.books.get(movie_id)
+        if book is None:
+            return {'bids': [], 'asks': []}
+        return book.depth(levels)
+
+    def drop(self, movie_ids: List[str]):
+        """Forget the books of movies another worker now matches"""
+        for movie_id in movie_ids:
+            book = self.books.pop(movie_id, None)
+            if book is not None:
+                for order_id in book.orders:
+                    self._order_movie.pop(order_id, None)
+
+    def restore(self, orders: List[LimitOrder]):
+        """Rebuild the books from persisted resting orders, oldest first"""
+        for order in sorted(orders, key=lambda o: (o.created_at, o.seq)):
+            order.seq = next(self._seq)
+            self.book(order.movie_id)._rest(order)
+            self._order_movie[order.id] = order.movie_id
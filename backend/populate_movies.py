@@ -1,7 +1,14 @@
+import argparse
 import asyncio
+import csv
+import json
+import re
 import sys
 import os
+import time
 from motor.motor_asyncio import AsyncIOMotorClient
+from memory_store import MemoryClient
+from pymongo import UpdateOne
 from dotenv import load_dotenv
 from pathlib import Path
 import uuid
@@ -13,10 +20,15 @@ from bs4 import BeautifulSoup
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection; STORAGE=memory writes to an in-process store that
+# is discarded on exit, for timing the loader without a database
+if os.environ.get('STORAGE', 'mongo') == 'memory':
+    client = MemoryClient()
+    db = client[os.environ.get('DB_NAME', 'bollywood_sensex')]
+else:
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url)
+    db = client[os.environ['DB_NAME']]
 
 def scrape_bollywood_hungama():
     """Attempt to scrape movies from Bollywood Hungama"""
@@ -271,80 +283,256 @@ def get_dummy_bollywood_movies():
         }
     ]
 
-async def populate_movies():
-    """Populate the database with Bollywood movies"""
+# ==================== BULK LOADER ====================
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+# Descriptive fields --upsert may overwrite; prices and share counts are never touched
+METADATA_FIELDS = ('poster', 'backdrop', 'release_date', 'synopsis', 'cast', 'genres')
+
+def read_records(path: Path):
+    """Yield raw records from a CSV or JSON Lines file"""
+    if path.suffix.lower() == '.csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                # List columns are pipe separated in CSV
+                for column in ('cast', 'genres'):
+                    if column in row:
+                        row[column] = [value.strip() for value in (row[column] or '').split('|') if value.strip()]
+                yield row
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError as e:
+                        # Passed on so validation counts and skips it
+                        yield e
+
+def synthetic_records(count: int):
+    genres = ['Action', 'Comedy', 'Drama', 'Romance', 'Thriller', 'Horror', 'Biography']
+    for i in range(count):
+        yield {
+            'title': f"Synthetic Movie {i:06d}",
+            'synopsis': f"Synthetic Bollywood movie number {i}.",
+            'cast': ['Star Cast'],
+            'genres': random.sample(genres, 2),
+            'release_date': '2025-12-31'
+        }
+
+def validate_record(record: dict) -> str:
+    """Return an error message, or '' if the record is usable"""
+    if isinstance(record, json.JSONDecodeError):
+        return f"invalid JSON ({record.msg})"
+    if not isinstance(record, dict):
+        return 'not a JSON object'
+    title = record.get('title')
+    if not isinstance(title, str) or not title.strip():
+        return 'missing title'
+    release_date = record.get('release_date')
+    if release_date and not DATE_PATTERN.match(str(release_date)):
+        return f"bad release_date {release_date!r}"
+    for column in ('cast', 'genres'):
+        if column in record and not isinstance(record[column], list):
+            return f"{column} must be a list"
+    try:
+        if record.get('initial_price') not in (None, '') and float(record['initial_price']) <= 0:
+            return 'initial_price must be positive'
+        if record.get('total_shares') not in (None, '') and int(record['total_shares']) <= 0:
+            return 'total_shares must be positive'
+    except (TypeError, ValueError):
+        return 'initial_price/total_shares must be numeric'
+    return ''
+
+def derive_symbol(title: str) -> str:
+    return ''.join(c for c in title.upper() if c.isalnum())[:6]
+
+def unique_symbol(base: str, taken: set, next_suffix: dict) -> str:
+    """Suffix a counter until the symbol is free. next_suffix remembers where
+    each base's counter got to, so repeated bases do not rescan from 2."""
+    symbol, suffix = base, next_suffix.get(base, 2)
+    while symbol in taken:
+        symbol = f"{base}{suffix}"
+        suffix += 1
+    next_suffix[base] = suffix
+    taken.add(symbol)
+    return symbol
+
+def build_movie_doc(record: dict, symbol: str) -> dict:
+    # Generate realistic initial prices based on movie type
+    if record.get('initial_price') not in (None, ''):
+        initial_price = round(float(record['initial_price']), 2)
+    else:
+        base_price = random.randint(80, 400)
+        initial_price = round(base_price + random.uniform(-20, 50), 2)
     
-    print("Starting movie population process...")
+    # Generate shares based on popularity
+    if record.get('total_shares') not in (None, ''):
+        total_shares = int(record['total_shares'])
+    else:
+        total_shares = random.randint(50000, 200000)
     
-    # First, try scraping
-    scraped_movies = scrape_bollywood_hungama()
+    title = record['title'].strip()
+    return {
+        'id': str(uuid.uuid4()),
+        'tmdb_id': None,
+        'title': title,
+        'symbol': symbol,
+        'poster': record.get('poster') or None,
+        'backdrop': record.get('backdrop') or None,
+        'release_date': record.get('release_date') or '2024-12-31',
+        'synopsis': record.get('synopsis') or f"An exciting Bollywood movie - {title}",
+        'cast': record.get('cast') or ['Star Cast'],
+        'genres': record.get('genres') or ['Drama'],
+        'current_price': initial_price,
+        'initial_price': initial_price,
+        'total_shares': total_shares,
+        'available_shares': total_shares,
+        'volume': 0,
+        'change': 0.0,
+        'change_percent': 0.0,
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+
+async def prepare_movies(records, upsert: bool):
+    """Validate records and drop duplicates, checking existing rows in one query"""
+    valid, rejected = [], 0
+    for line, record in enumerate(records, start=1):
+        error = validate_record(record)
+        if error:
+            rejected += 1
+            if rejected <= 10:
+                print(f"Skipping record {line}: {error}")
+            continue
+        valid.append(record)
     
-    # Use dummy data if scraping failed
-    if not scraped_movies:
-        print("\nUsing comprehensive dummy data with 30 realistic Bollywood movies...")
-        movies_data = get_dummy_bollywood_movies()
-    else:
-        # If scraping worked, use scraped data
-        movies_data = scraped_movies
+    # One round trip for every existing title and symbol; suffixed symbols
+    # (ABC2, ABC3...) rule out a narrower $in on the derived symbols
+    existing = await db.movies.find({}, {'_id': 0, 'title': 1, 'symbol': 1}).to_list(None)
+    # Lowercased title -> title as stored, which metadata updates match on
+    existing_titles = {movie['title'].lower(): movie['title'] for movie in existing if movie.get('title')}
+    taken_symbols = {movie['symbol'] for movie in existing if movie.get('symbol')}
+    titles = {record['title'].strip().lower() for record in valid}
     
-    # Check if movies already exist
-    existing_count = await db.movies.count_documents({})
-    if existing_count > 0:
-        print(f"\nDatabase already has {existing_count} movies.")
-        response = input("Do you want to clear and re-populate? (yes/no): ")
-        if response.lower() == 'yes':
-            await db.movies.delete_many({})
-            print("Cleared existing movies.")
-        else:
-            print("Keeping existing movies. Exiting.")
-            return
+    movies, duplicates, seen, next_suffix = [], 0, set(), {}
+    for record in valid:
+        title_key = record['title'].strip().lower()
+        if title_key in seen or (title_key in existing_titles and not upsert):
+            duplicates += 1
+            continue
+        if record.get('symbol') and record['symbol'] in taken_symbols and title_key not in existing_titles:
+            duplicates += 1
+            continue
+        seen.add(title_key)
+        if title_key in existing_titles:
+            # Upsert of a known title: only refresh the metadata the file provides
+            movies.append({
+                'title': existing_titles[title_key],
+                **{field: record[field] for field in METADATA_FIELDS if record.get(field)}
+            })
+            continue
+        symbol = unique_symbol(record.get('symbol') or derive_symbol(record['title']), taken_symbols, next_suffix)
+        movies.append(build_movie_doc(record, symbol))
     
-    print(f"\nAdding {len(movies_data)} movies to database...")
+    print(f"{len(valid) + rejected} records: {len(movies)} to write, "
+          f"{duplicates} duplicates, {rejected} invalid, {len(titles & existing_titles.keys())} already in database")
+    return movies
+
+async def write_batch(batch: list, upsert: bool) -> int:
+    if not upsert:
+        result = await db.movies.insert_many(batch, ordered=False)
+        return len(result.inserted_ids)
     
-    added_count = 0
+    # Known titles only carry metadata and never upsert, so a miss cannot
+    # create a movie without an id, symbol or price; new titles are
+    # inserted as full documents
+    new_movies = [movie for movie in batch if 'id' in movie]
+    operations = [
+        UpdateOne({'title': movie['title']}, {'$set': {k: v for k, v in movie.items() if k in METADATA_FIELDS}})
+        for movie in batch if 'id' not in movie and any(k in METADATA_FIELDS for k in movie)
+    ]
+    written = 0
+    if new_movies:
+        written += len((await db.movies.insert_many(new_movies, ordered=False)).inserted_ids)
+    if operations:
+        written += (await db.movies.bulk_write(operations, ordered=False)).modified_count
+    return written
+
+async def load_movies(movies: list, batch_size: int, concurrency: int, upsert: bool):
+    """Write movies in concurrent batches, reporting progress and throughput"""
+    semaphore = asyncio.Semaphore(concurrency)
+    written = 0
+    started = time.perf_counter()
     
-    for movie_data in movies_data:
-        # Create movie symbol from title
-        symbol = ''.join(c for c in movie_data['title'].upper() if c.isalnum())[:6]
-        
-        # Generate realistic initial prices based on movie type
-        base_price = random.randint(80, 400)
-        initial_price = round(base_price + random.uniform(-20, 50), 2)
-        
-        # Generate shares based on popularity
-        total_shares = random.randint(50000, 200000)
-        
-        movie_doc = {
-            'id': str(uuid.uuid4()),
-            'tmdb_id': None,
-            'title': movie_data['title'],
-            'symbol': symbol,
-            'poster': None,  # Can be added later
-            'backdrop': None,
-            'release_date': movie_data.get('release_date', '2024-12-31'),
-            'synopsis': movie_data.get('synopsis', f"An exciting Bollywood movie - {movie_data['title']}"),
-            'cast': movie_data.get('cast', ['Star Cast']),
-            'genres': movie_data.get('genres', ['Drama']),
-            'current_price': initial_price,
-            'initial_price': initial_price,
-            'total_shares': total_shares,
-            'available_shares': total_shares,
-            'volume': 0,
-            'change': 0.0,
-            'change_percent': 0.0,
-            'created_at': datetime.now(timezone.utc).isoformat()
-        }
+    async def run(batch):
+        nonlocal written
+        async with semaphore:
+            # Await before adding: `written += await ...` would add to the
+            # value read before other batches finished
+            count = await write_batch(batch, upsert)
+            written += count
+            elapsed = time.perf_counter() - started
+            print(f"  {written}/{len(movies)} written ({written / elapsed:,.0f} movies/s)")
+    
+    await asyncio.gather(*(
+        run(movies[i:i + batch_size]) for i in range(0, len(movies), batch_size)
+    ))
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Wrote {written} movies in {elapsed:.2f}s ({written / max(elapsed, 1e-9):,.0f} movies/s)")
+    return written
+
+async def populate_movies(args):
+    """Populate the database with Bollywood movies"""
+    
+    print("Starting movie population process...")
+    
+    if args.input:
+        records = list(read_records(Path(args.input)))
+    elif args.synthetic:
+        records = list(synthetic_records(args.synthetic))
+    else:
+        # First, try scraping, off the event loop
+        scraped_movies = await asyncio.to_thread(scrape_bollywood_hungama)
         
-        await db.movies.insert_one(movie_doc)
-        added_count += 1
-        print(f"Added: {movie_data['title']} ({symbol}) - ₹{initial_price}")
+        # Use dummy data if scraping failed
+        if not scraped_movies:
+            print("\nUsing comprehensive dummy data with 30 realistic Bollywood movies...")
+            records = get_dummy_bollywood_movies()
+        else:
+            # If scraping worked, use scraped data
+            records = scraped_movies
+    
+    if args.replace:
+        result = await db.movies.delete_many({})
+        print(f"Cleared {result.deleted_count} existing movies.")
     
-    print(f"\n✅ Successfully added {added_count} movies to the database!")
+    movies = await prepare_movies(records, args.upsert)
+    if not movies:
+        print("Nothing to write.")
+        return
+    
+    await load_movies(movies, args.batch_size, args.concurrency, args.upsert)
     print(f"Total movies in database: {await db.movies.count_documents({})}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Seed the movies collection. Without --input or --synthetic, scrapes "
+                    "Bollywood Hungama and falls back to built-in sample movies."
+    )
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--input', help='CSV or JSON Lines file of movies (CSV lists are pipe separated)')
+    source.add_argument('--synthetic', type=int, metavar='N', help='Generate N synthetic movies')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=4, help='Batches in flight at once')
+    parser.add_argument('--upsert', action='store_true',
+                        help='Update metadata of movies whose title already exists instead of skipping them')
+    parser.add_argument('--replace', action='store_true', help='Delete all existing movies first')
+    return parser.parse_args()
+
 async def main():
+    args = parse_args()
     try:
-        await populate_movies()
+        await populate_movies(args)
     except Exception as e:
         print(f"Error: {str(e)}")
     finally:
@@ -0,0 +1,322 @@
+"""Portfolio analytics replayed from a user's transactions.
+
+summarize() nets the transaction log into one cell per movie and day
+(shares, cash and the last trade price); merge() adds a later netting
+to an earlier one, so a user's settled history can be kept in that form.
+analyze() builds a movies x days position matrix from the cells and a
+matching close-price matrix from the stored 1d candles (with trade
+prices filling days that have no candle), then derives everything from
+array operations: the daily equity curve, realized and unrealized
+P&L, volatility, max drawdown and each movie's contribution. Cash is
+reconstructed backwards from the current balance, so funds reserved by
+open limit buys are missing from every day of the curve.
+
+DailyCloses keeps those daily closes per movie for the whole process.
+A finished day's candle no longer changes, so every user's analytics
+share one copy, and a cold request only reads the days and movies that
+no earlier request has.
+"""
+import math
+import sys
+from datetime import date, datetime, time, timezone
+from operator import itemgetter
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+# Simulated markets trade every day of the year
+TRADING_DAYS_PER_YEAR = 365
+
+TRANSACTION_FIELDS = itemgetter('timestamp', 'movie_id', 'type', 'quantity', 'amount', 'price')
+
+# movie id -> (ordinal of the first day, closes from that day on; NaN where no candle)
+Closes = Dict[str, Tuple[int, np.ndarray]]
+
+
+class DailyCloses:
+    """Daily closes of every movie any analytics request has needed, up to yesterday"""
+
+    def __init__(self, max_movies: int):
+        self.max_movies = max_movies
+        self._closes: Closes = {}
+
+    def __len__(self) -> int:
+        return len(self._closes)
+
+    def clear(self):
+        self._closes.clear()
+
+    async def get(self, db, first_days: Dict[str, int], today: date) -> Closes:
+        """Closes of each movie from its first day through yesterday, reading
+        only the days not cached yet in a single candle query"""
+        last = today.toordinal() - 1
+        missing = {}
+        for movie_id, first in first_days.items():
+            cached = self._closes.get(movie_id)
+            if cached is None:
+                missing[movie_id] = (first, last)
+            else:
+                start, closes = cached
+                end = start + len(closes) - 1
+                if first < start or end < last:
+                    missing[movie_id] = (min(first, end + 1), last)
+
+        if missing:
+            low = min(span[0] for span in missing.values())
+            high = max(span[1] for span in missing.values())
+            candles = await db.price_candles.find(
+                {
+                    'movie_id': {'$in': list(missing)},
+                    'interval': '1d',
+                    'start': {
+                        '$gte': datetime.combine(date.fromordinal(low), time(), timezone.utc),
+                        '$lte': datetime.combine(date.fromordinal(high), time(), timezone.utc)
+                    }
+                },
+                {'_id': 0, 'movie_id': 1, 'start': 1, 'close': 1}
+            ).to_list(None)
+            for movie_id in missing:
+                start = min(first_days[movie_id], self._closes.get(movie_id, (last + 1,))[0])
+                closes = np.full(max(last - start + 1, 0), np.nan)
+                if movie_id in self._closes:
+                    cached_start, cached = self._closes[movie_id]
+                    closes[cached_start - start:cached_start - start + len(cached)] = cached
+                self._closes[movie_id] = (start, closes)
+            for candle in candles:
+                start, closes = self._closes[candle['movie_id']]
+                day = candle['start'].toordinal() - start
+                if 0 <= day < len(closes):
+                    closes[day] = candle['close']
+
+            # Evict the movies cached longest ago, never one this request uses
+            for movie_id in list(self._closes):
+                if len(self._closes) <= self.max_movies:
+                    break
+                if movie_id not in first_days:
+                    del self._closes[movie_id]
+
+        return {movie_id: self._closes[movie_id] for movie_id in first_days}
+
+
+class TradeDays(NamedTuple):
+    """A user's transactions netted to one cell per movie and day"""
+    movie_ids: Tuple[str, ...]
+    rows: np.ndarray  # index into movie_ids
+    days: np.ndarray  # date ordinal
+    quantities: np.ndarray  # net shares bought (negative when sold)
+    cash_flows: np.ndarray  # net cash received (negative when spent)
+    last_prices: np.ndarray  # price of the day's last trade
+    count: int  # transactions netted into the cells
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self[1:6]) + sum(map(sys.getsizeof, self.movie_ids))
+
+    def first_days(self) -> Dict[str, int]:
+        """Ordinal of each movie's first trade"""
+        first = np.full(len(self.movie_ids), np.iinfo(np.int32).max, dtype=np.int32)
+        np.minimum.at(first, self.rows, self.days)
+        return dict(zip(self.movie_ids, first.tolist()))
+
+
+NO_TRADES = TradeDays((), *(np.zeros(0, dtype=dtype) for dtype in (np.int32, np.int32, np.float64, np.float64, np.float64)), 0)
+
+
+def net_trades(movie_ids, rows, days, quantities, cash_flows, prices, count) -> TradeDays:
+    """Sum each movie and day's trades, given in chronological order"""
+    if not len(rows):
+        return NO_TRADES
+    span = int(days.max()) - int(days.min()) + 1
+    cells = rows.astype(np.int64) * span + (days - days.min())
+    unique, inverse = np.unique(cells, return_inverse=True)
+    _, from_end = np.unique(cells[::-1], return_index=True)
+    return TradeDays(
+        tuple(movie_ids),
+        (unique // span).astype(np.int32),
+        (unique % span + days.min()).astype(np.int32),
+        np.bincount(inverse, weights=quantities, minlength=len(unique)),
+        np.bincount(inverse, weights=cash_flows, minlength=len(unique)),
+        prices[len(cells) - 1 - from_end],
+        count,
+    )
+
+
+def summarize(transactions: List[dict]) -> TradeDays:
+    """Net transaction documents, given in any order"""
+    if not transactions:
+        return NO_TRADES
+
+    # One pass over the documents, then everything is columnar
+    stamps, movie_column, types, quantities, amounts, prices = zip(*map(TRANSACTION_FIELDS, transactions))
+    movie_ids = sorted(set(movie_column))
+    row = {movie_id: i for i, movie_id in enumerate(movie_ids)}
+
+    # Timestamps are UTC ISO strings: they sort chronologically and their
+    # first 10 characters are the date, parsed once per distinct day
+    stamps = np.array(stamps)
+    order = np.argsort(stamps, kind='stable')
+    dates, day_index = np.unique(stamps.astype('U10'), return_inverse=True)
+    ordinals = np.array([date.fromisoformat(day).toordinal() for day in dates.tolist()], dtype=np.int32)
+
+    buys = (np.array(types) == 'BUY')[order]
+    quantities = np.array(quantities, dtype=np.float64)[order]
+    amounts = np.array(amounts, dtype=np.float64)[order]
+    return net_trades(
+        movie_ids,
+        np.array([row[movie_id] for movie_id in movie_column], dtype=np.int32)[order],
+        ordinals[day_index.reshape(-1)][order],
+        np.where(buys, quantities, -quantities),
+        np.where(buys, -amounts, amounts),
+        np.array(prices, dtype=np.float64)[order],
+        len(transactions),
+    )
+
+
+def merge(older: TradeDays, newer: TradeDays) -> TradeDays:
+    """Combine two nettings, every trade in `newer` being later than those in `older`"""
+    if not newer.count:
+        return older
+    if not older.count:
+        return newer
+    movie_ids = sorted(set(older.movie_ids) | set(newer.movie_ids))
+    row = {movie_id: i for i, movie_id in enumerate(movie_ids)}
+
+    def remap(trades: TradeDays) -> np.ndarray:
+        return np.array([row[movie_id] for movie_id in trades.movie_ids], dtype=np.int32)[trades.rows]
+
+    return net_trades(
+        movie_ids,
+        np.concatenate([remap(older), remap(newer)]),
+        *(np.concatenate([old, new]) for old, new in zip(older[2:6], newer[2:6])),
+        older.count + newer.count,
+    )
+
+
+def empty_analytics(balance: float) -> dict:
+    return {
+        'equity_curve': [],
+        'realized_pl': 0.0,
+        'unrealized_pl': 0.0,
+        'total_pl': 0.0,
+        'daily_volatility': 0.0,
+        'annualized_volatility': 0.0,
+        'max_drawdown_percent': 0.0,
+        'max_drawdown_peak': None,
+        'max_drawdown_trough': None,
+        'contributions': [],
+        'transactions': 0,
+        'balance': balance,
+    }
+
+
+def forward_fill(prices: np.ndarray) -> np.ndarray:
+    """Carry each row's last known price into the days after it"""
+    days = np.arange(prices.shape[1])
+    known = np.where(np.isnan(prices), 0, days)
+    np.maximum.accumulate(known, axis=1, out=known)
+    return prices[np.arange(prices.shape[0])[:, None], known]
+
+
+def analyze(trades: TradeDays, holdings: List[dict], closes: Closes,
+            movies: Dict[str, dict], balance: float, today: date) -> dict:
+    """Analytics for one user.
+
+    trades: the user's transactions netted per movie and day
+    holdings: the user's portfolio documents (for the average cost basis)
+    closes: daily closes of the traded movies, as DailyCloses.get() returns them
+    movies: movie id -> {current_price, title, symbol}
+    """
+    if not trades.count:
+        return empty_analytics(balance)
+
+    movie_ids = sorted(set(trades.movie_ids) | {h['movie_id'] for h in holdings})
+    row = {movie_id: i for i, movie_id in enumerate(movie_ids)}
+    rows = np.array([row[movie_id] for movie_id in trades.movie_ids], dtype=np.int64)[trades.rows]
+    first_day = int(trades.days.min())
+    day_count = max(today.toordinal(), int(trades.days.max())) - first_day + 1
+    days = trades.days - first_day
+
+    shape = (len(movie_ids), day_count)
+    positions = np.zeros(shape)
+    np.add.at(positions, (rows, days), trades.quantities)
+    np.cumsum(positions, axis=1, out=positions)
+
+    # Close prices: stored candles first, then the day's last trade, and
+    # the live price for today; gaps carry the previous close forward
+    prices = np.full(shape, np.nan)
+    traded = np.full(shape, np.nan)
+    traded[rows, days] = trades.last_prices
+    for movie_id, (start, series) in closes.items():
+        if movie_id not in row:
+            continue
+        low, high = max(start, first_day), min(start + len(series), first_day + day_count)
+        if low < high:
+            prices[row[movie_id], low - first_day:high - first_day] = series[low - start:high - start]
+    prices = np.where(np.isnan(prices), traded, prices)
+    current = np.array([movies.get(movie_id, {}).get('current_price', np.nan) for movie_id in movie_ids])
+    prices[:, -1] = np.where(np.isnan(current), prices[:, -1], current)
+    prices = forward_fill(prices)
+
+    holdings_value = np.where(positions != 0, positions * np.nan_to_num(prices), 0.0).sum(axis=0)
+    daily_flows = np.bincount(days, weights=trades.cash_flows, minlength=day_count)
+    cash = balance - (daily_flows.sum() - np.cumsum(daily_flows))
+    equity = cash + holdings_value
+
+    # Daily returns, skipping days that start from a non-positive equity
+    previous = equity[:-1]
+    valid = previous > 0
+    returns = np.divide(np.diff(equity), previous, out=np.zeros_like(previous), where=valid)[valid]
+    daily_volatility = float(returns.std(ddof=1)) if len(returns) > 1 else 0.0
+
+    peaks = np.maximum.accumulate(equity)
+    drawdowns = np.divide(equity - peaks, peaks, out=np.zeros_like(equity), where=peaks > 0)
+    trough = int(drawdowns.argmin())
+    peak = int(equity[:trough + 1].argmax())
+
+    # Total P&L per movie is exact from cash flows and the final position;
+    # the unrealized part uses the average cost kept on the holding
+    final_prices = np.nan_to_num(prices[:, -1])
+    total_by_movie = np.bincount(rows, weights=trades.cash_flows, minlength=len(movie_ids)) + positions[:, -1] * final_prices
+    unrealized_by_movie = np.zeros(len(movie_ids))
+    for holding in holdings:
+        i = row[holding['movie_id']]
+        unrealized_by_movie[i] = holding['quantity'] * (final_prices[i] - holding['avg_price'])
+    realized_by_movie = total_by_movie - unrealized_by_movie
+    total_pl = float(total_by_movie.sum())
+
+    contributions = [
+        {
+            'movie_id': movie_ids[i],
+            'movie_title': movies.get(movie_ids[i], {}).get('title'),
+            'movie_symbol': movies.get(movie_ids[i], {}).get('symbol'),
+            'realized_pl': round(float(realized_by_movie[i]), 2),
+            'unrealized_pl': round(float(unrealized_by_movie[i]), 2),
+            'total_pl': round(float(total_by_movie[i]), 2),
+            'contribution_percent': round(float(total_by_movie[i] / total_pl * 100), 2) if total_pl else 0.0,
+        }
+        for i in np.argsort(-total_by_movie, kind='stable')
+    ]
+
+    dates = [date.fromordinal(first_day + day).isoformat() for day in range(day_count)]
+    equity_curve = [
+        {'date': day, 'equity': value, 'cash': cash_value, 'holdings_value': held}
+        for day, value, cash_value, held in zip(
+            dates, np.round(equity, 2).tolist(), np.round(cash, 2).tolist(),
+            np.round(holdings_value, 2).tolist()
+        )
+    ]
+
+    return {
+        'equity_curve': equity_curve,
+        'realized_pl': round(float(realized_by_movie.sum()), 2),
+        'unrealized_pl': round(float(unrealized_by_movie.sum()), 2),
+        'total_pl': round(total_pl, 2),
+        'daily_volatility': round(daily_volatility * 100, 4),
+        'annualized_volatility': round(daily_volatility * math.sqrt(TRADING_DAYS_PER_YEAR) * 100, 2),
+        'max_drawdown_percent': round(float(-drawdowns[trough]) * 100, 2),
+        'max_drawdown_peak': dates[peak] if drawdowns[trough] < 0 else None,
+        'max_drawdown_trough': dates[trough] if drawdowns[trough] < 0 else None,
+        'contributions': contributions,
+        'transactions': trades.count,
+        'balance': balance,
+    }
@@ -0,0 +1,87 @@
+"""Price ticks and incrementally built OHLCV candles.
+
+Every price delta is recorded here in memory and folded into the open
+1m/5m/1h/1d candle for its movie. server.py periodically drains the
+buffer: raw ticks are appended to a time-series collection and each
+partial candle is merged into its stored candle with one upsert, so a
+candle range query never has to scan ticks.
+"""
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+# Candle interval name -> length in seconds
+INTERVALS = {'1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+
+CandleKey = Tuple[str, int]  # (interval, bucket start)
+
+
+def bucket_start(timestamp: float, seconds: int) -> int:
+    return int(timestamp // seconds * seconds)
+
+
+def to_datetime(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+def merge_candle(stored: dict, partial: dict) -> dict:
+    """Combine a stored candle with a later partial one for the same bucket"""
+    return {
+        **stored,
+        'high': max(stored['high'], partial['high']),
+        'low': min(stored['low'], partial['low']),
+        'close': partial['close'],
+        'volume': stored['volume'] + partial['volume'],
+    }
+
+
+class PriceHistory:
+    def __init__(self):
+        self._ticks: List[dict] = []
+        # movie_id -> partial candles touched since the last drain
+        self._candles: Dict[str, Dict[CandleKey, dict]] = {}
+
+    @property
+    def pending(self) -> int:
+        return len(self._ticks)
+
+    def record(self, deltas: List[dict], volumes: Optional[Dict[str, int]] = None,
+               timestamp: Optional[float] = None):
+        """Append {id, price, ...} deltas as ticks and fold them into candles"""
+        timestamp = time.time() if timestamp is None else timestamp
+        recorded_at = to_datetime(timestamp)
+        volumes = volumes or {}
+
+        for delta in deltas:
+            movie_id = delta['id']
+            price = delta['price']
+            volume = volumes.get(movie_id, 0)
+            self._ticks.append({'movie_id': movie_id, 'timestamp': recorded_at, 'price': price, 'volume': volume})
+
+            movie_candles = self._candles.setdefault(movie_id, {})
+            for interval, seconds in INTERVALS.items():
+                key = (interval, bucket_start(timestamp, seconds))
+                candle = movie_candles.get(key)
+                if candle is None:
+                    movie_candles[key] = {
+                        'open': price, 'high': price, 'low': price, 'close': price, 'volume': volume
+                    }
+                else:
+                    candle['high'] = max(candle['high'], price)
+                    candle['low'] = min(candle['low'], price)
+                    candle['close'] = price
+                    candle['volume'] += volume
+
+    def drain(self) -> Tuple[List[dict], Dict[str, Dict[CandleKey, dict]]]:
+        """Hand over everything recorded since the last drain"""
+        ticks, candles = self._ticks, self._candles
+        self._ticks, self._candles = [], {}
+        return ticks, candles
+
+    def pending_candles(self, movie_id: str, interval: str) -> Dict[int, dict]:
+        """Unflushed partial candles for one movie, keyed by bucket start"""
+        return {
+            start: candle
+            for (candle_interval, start), candle in self._candles.get(movie_id, {}).items()
+            if candle_interval == interval
+        }
@@ -0,0 +1,198 @@
+"""Pluggable price-impact and random-walk models, plus an offline replay.
+
+An impact model turns a trade's share of the float into the percent it
+moves the price: LinearImpact is the original min(0.5 x volume%, 5%)
+rule, and SquareRootImpact follows the square-root law. A walk model moves
+every price once per simulator tick: UniformWalk is the original uniform
++/- volatility step, and OrnsteinUhlenbeckWalk pulls log(price /
+initial_price) back towards zero. No price ever goes below FLOOR_FRACTION
+of the movie's initial price.
+
+replay() runs a whole order flow through a model with array operations
+and without touching Mongo. A trade's impact depends only on its size, so
+each movie's price path is a cumulative sum of log factors. The floor
+turns that into a reflected walk, which a grouped running maximum solves
+without a per-trade loop.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+# Prices never fall below this share of the initial price
+FLOOR_FRACTION = 0.1
+
+
+class ImpactModel:
+    """Percent a trade moves the price, from the fraction of the float it trades"""
+
+    def percent(self, fraction: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def factors(self, quantities, total_shares, buys) -> np.ndarray:
+        """Multipliers applied to the price by each trade"""
+        percent = self.percent(np.asarray(quantities, dtype=np.float64) / total_shares)
+        return 1 + np.where(buys, percent, -percent) / 100
+
+
+class LinearImpact(ImpactModel):
+    def __init__(self, coefficient: float = 0.5, cap_percent: float = 5.0):
+        self.coefficient = coefficient
+        self.cap_percent = cap_percent
+
+    def percent(self, fraction):
+        return np.minimum(fraction * 100 * self.coefficient, self.cap_percent)
+
+
+class SquareRootImpact(ImpactModel):
+    """Impact grows with the square root of size; the default moves 0.5% on 1% of the float, like LinearImpact"""
+
+    def __init__(self, coefficient: float = 5.0, cap_percent: float = 5.0):
+        self.coefficient = coefficient
+        self.cap_percent = cap_percent
+
+    def percent(self, fraction):
+        return np.minimum(np.sqrt(fraction) * self.coefficient, self.cap_percent)
+
+
+class WalkModel:
+    def step(self, prices: np.ndarray, initial_prices: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """Prices one tick later, before the floor is applied"""
+        raise NotImplementedError
+
+
+class UniformWalk(WalkModel):
+    def __init__(self, volatility_percent: float):
+        self.volatility_percent = volatility_percent
+
+    def step(self, prices, initial_prices, rng):
+        change = rng.uniform(-self.volatility_percent, self.volatility_percent, len(prices))
+        return prices * (1 + change / 100)
+
+
+class OrnsteinUhlenbeckWalk(WalkModel):
+    """Mean-reverting walk of log(price / initial_price).
+
+    Each tick the deviation decays by exp(-reversion) and gets Gaussian
+    noise. The noise has the same standard deviation as a UniformWalk with
+    the same volatility_percent, so short-term moves look alike."""
+
+    def __init__(self, volatility_percent: float, reversion: float):
+        self.sigma = volatility_percent / 100 / math.sqrt(3)
+        self.decay = math.exp(-reversion)
+
+    def step(self, prices, initial_prices, rng):
+        deviation = np.log(prices / initial_prices)
+        return initial_prices * np.exp(deviation * self.decay + rng.normal(0.0, self.sigma, len(prices)))
+
+
+IMPACT_MODELS = {'linear': LinearImpact, 'sqrt': SquareRootImpact}
+WALK_MODELS = ('uniform', 'ou')
+
+
+def impact_model(name: str) -> ImpactModel:
+    if name not in IMPACT_MODELS:
+        raise ValueError(f"Unknown price impact model {name!r}; expected one of {', '.join(IMPACT_MODELS)}")
+    return IMPACT_MODELS[name]()
+
+
+def walk_model(name: str, volatility_percent: float, reversion: float) -> WalkModel:
+    if name == 'uniform':
+        return UniformWalk(volatility_percent)
+    if name == 'ou':
+        return OrnsteinUhlenbeckWalk(volatility_percent, reversion)
+    raise ValueError(f"Unknown price walk model {name!r}; expected one of {', '.join(WALK_MODELS)}")
+
+
+def apply_trades(log_prices: np.ndarray, log_floors: np.ndarray, movies: np.ndarray,
+                 log_factors: np.ndarray) -> tuple:
+    """Run trades (in time order) through per-movie log prices.
+
+    Returns the log price before and after each trade, and updates
+    log_prices in place to each movie's price after its last trade."""
+    if not len(movies):
+        return np.empty(0), np.empty(0)
+    order = np.argsort(movies, kind='stable')
+    grouped = movies[order]
+    steps = log_factors[order]
+    first = np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])
+    group = np.repeat(np.arange(len(first)), np.diff(np.r_[first, len(grouped)]))
+
+    # Unfloored path, then reflected at the floor: after trade k the price
+    # is path[k] + max(0, max over j <= k of (floor - path[j]))
+    totals = np.cumsum(steps)
+    path = log_prices[grouped] + totals - (totals - steps)[first][group]
+    shortfall = log_floors[grouped] - path
+    # Running maximum within each movie: lifting every later movie above
+    # everything before it keeps earlier movies out of its maximum
+    span = float(shortfall.max() - shortfall.min()) + 1 if len(shortfall) else 1.0
+    lifted = shortfall + group * span
+    np.maximum.accumulate(lifted, out=lifted)
+    after = path + np.maximum(lifted - group * span, 0)
+
+    before = np.empty_like(after)
+    before[1:] = after[:-1]
+    before[first] = log_prices[grouped[first]]
+    last = np.r_[first[1:], len(grouped)] - 1
+    log_prices[grouped[last]] = after[last]
+
+    unsorted_before = np.empty_like(before)
+    unsorted_after = np.empty_like(after)
+    unsorted_before[order] = before
+    unsorted_after[order] = after
+    return unsorted_before, unsorted_after
+
+
+def replay(impact: ImpactModel, prices: np.ndarray, initial_prices: np.ndarray, total_shares: np.ndarray,
+           movies: np.ndarray, quantities: np.ndarray, buys: np.ndarray,
+           ticks: Optional[np.ndarray] = None, walk: Optional[WalkModel] = None,
+           rng: Optional[np.random.Generator] = None) -> dict:
+    """Replay an order flow through a model.
+
+    prices, initial_prices, total_shares: one entry per movie
+    movies, quantities, buys: one entry per trade in time order; movies
+    indexes the per-movie arrays
+    ticks: the non-decreasing simulator tick of each trade; with a walk,
+    every movie takes one step at the start of each tick
+
+    Prices are not rounded to cents between trades, unlike the live market.
+    """
+    initial_prices = np.asarray(initial_prices, dtype=np.float64)
+    log_prices = np.log(np.asarray(prices, dtype=np.float64))
+    log_floors = np.log(initial_prices * FLOOR_FRACTION)
+    movies = np.asarray(movies)
+    log_factors = np.log(impact.factors(quantities, np.asarray(total_shares)[movies], buys))
+    before = np.empty(len(movies))
+    after = np.empty(len(movies))
+
+    if walk is None or ticks is None:
+        before[:], after[:] = apply_trades(log_prices, log_floors, movies, log_factors)
+        closes = None
+    else:
+        rng = rng or np.random.default_rng()
+        tick_count = int(ticks[-1]) + 1 if len(ticks) else 0
+        bounds = np.searchsorted(ticks, np.arange(tick_count + 1))
+        closes = np.empty((len(log_prices), tick_count))
+        for tick in range(tick_count):
+            stepped = walk.step(np.exp(log_prices), initial_prices, rng)
+            log_prices = np.maximum(np.log(stepped), log_floors)
+            start, end = bounds[tick], bounds[tick + 1]
+            if end > start:
+                before[start:end], after[start:end] = apply_trades(
+                    log_prices, log_floors, movies[start:end], log_factors[start:end]
+                )
+            closes[:, tick] = log_prices
+        closes = np.exp(closes)
+
+    floored = int(np.count_nonzero(after <= log_floors[movies] + 1e-12))
+    before = np.exp(before)
+    after = np.exp(after)
+    return {
+        'prices': np.exp(log_prices),
+        # Trades fill at the price before their own impact
+        'executed': before,
+        'after': after,
+        'move_percent': (after - before) / before * 100,
+        'floored': floored,
+        'closes': closes,
+    }
@@ -0,0 +1,125 @@
+"""In-process fan-out of price changes to streaming clients.
+
+Publishers (the price simulator and the trade paths in server.py) hand
+over compact deltas; every subscriber gets its own pending buffer keyed
+by movie id. A slow client never blocks a publisher or other clients:
+newer deltas for the same movie overwrite older ones, so a client that
+falls behind simply receives the latest price when it catches up.
+
+Broadcasters only reach the clients of their own process. PriceRelay
+carries deltas between workers: each worker writes the deltas it
+published since its last exchange as one document in price_ticks, and
+reads back the documents other workers wrote, which server.py applies to
+its own boards and broadcaster. Reads overlap the previous window and
+skip documents already seen, so a tick inserted late is not lost.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+def price_delta(movie_id: str, price: float, change: float, change_percent: float) -> dict:
+    return {'id': movie_id, 'price': price, 'change': change, 'change_percent': change_percent}
+
+
+class PriceSubscription:
+    def __init__(self):
+        self._pending: Dict[str, dict] = {}
+        self._ready = asyncio.Event()
+
+    def push(self, deltas: Iterable[dict]):
+        for delta in deltas:
+            self._pending[delta['id']] = delta
+        if self._pending:
+            self._ready.set()
+
+    async def next_batch(self) -> List[dict]:
+        """Wait for at least one delta, then drain everything pending"""
+        await self._ready.wait()
+        self._ready.clear()
+        batch = list(self._pending.values())
+        self._pending = {}
+        return batch
+
+
+class PriceBroadcaster:
+    def __init__(self):
+        self._subscribers: Set[PriceSubscription] = set()
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> PriceSubscription:
+        subscription = PriceSubscription()
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: PriceSubscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, deltas: List[dict]):
+        if not deltas:
+            return
+        for subscription in self._subscribers:
+            subscription.push(deltas)
+
+
+class PriceRelay:
+    def __init__(self, worker_id: str, overlap_seconds: float = 5.0, collection: str = 'price_ticks'):
+        self.worker_id = worker_id
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self.collection = collection
+        self._pending: Dict[str, dict] = {}
+        self._volumes: Dict[str, int] = {}
+        self._last_read = datetime.now(timezone.utc)
+        # tick _id -> when it was first read, pruned once out of the overlap
+        self._seen: Dict[object, datetime] = {}
+
+    def push(self, deltas: Iterable[dict], volumes: Dict[str, int] = None):
+        for delta in deltas:
+            self._pending[delta['id']] = delta
+        for movie_id, quantity in (volumes or {}).items():
+            self._volumes[movie_id] = self._volumes.get(movie_id, 0) + quantity
+
+    async def exchange(self, db) -> Tuple[List[dict], Dict[str, int]]:
+        """Write this worker's pending deltas, then return the latest delta
+        per movie and the summed volumes that other workers wrote"""
+        collection = db[self.collection]
+        if self._pending or self._volumes:
+            deltas, volumes = self._pending, self._volumes
+            self._pending, self._volumes = {}, {}
+            try:
+                await collection.insert_one({
+                    'worker': self.worker_id, 'at': datetime.now(timezone.utc),
+                    'deltas': list(deltas.values()), 'volumes': volumes,
+                })
+            except Exception:
+                # Keep them for the next exchange, under anything newer
+                self._pending = {**deltas, **self._pending}
+                for movie_id, quantity in volumes.items():
+                    self._volumes[movie_id] = self._volumes.get(movie_id, 0) + quantity
+                raise
+
+        now = datetime.now(timezone.utc)
+        ticks = await collection.find(
+            {'at': {'$gt': self._last_read - self.overlap}}, {'_id': 1, 'worker': 1, 'deltas': 1, 'volumes': 1}
+        ).sort('at', 1).to_list(None)
+        self._last_read = now
+        self._seen = {
+            tick_id: read for tick_id, read in self._seen.items() if read > now - 2 * self.overlap
+        }
+
+        latest: Dict[str, dict] = {}
+        volumes: Dict[str, int] = {}
+        for tick in ticks:
+            if tick['_id'] in self._seen:
+                continue
+            self._seen[tick['_id']] = now
+            if tick['worker'] == self.worker_id:
+                continue
+            for delta in tick['deltas']:
+                latest[delta['id']] = delta
+            for movie_id, quantity in tick['volumes'].items():
+                volumes[movie_id] = volumes.get(movie_id, 0) + quantity
+        return list(latest.values()), volumes
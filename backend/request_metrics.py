@@ -0,0 +1,207 @@
+"""Per-route request latency and MongoDB round-trip metrics.
+
+RequestMetricsMiddleware times every HTTP request under its route
+template (/api/movies/{movie_id}, not one series per movie) and adds a
+Server-Timing header. CommandTracker is a pymongo command listener. Motor
+runs each operation on its executor with a copy of the caller's context,
+so the listener can charge every round-trip to the request, or to the
+background job, that issued it. Metrics.render() produces the
+Prometheus text format.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'HTTP requests by route and status', None),
+    'http_request_duration_seconds': ('histogram', 'HTTP request latency by route', LATENCY_BUCKETS),
+    'http_request_mongo_round_trips': ('histogram', 'MongoDB round-trips per HTTP request', ROUND_TRIP_BUCKETS),
+    'mongo_commands_total': ('counter', 'MongoDB commands by issuing route and command', None),
+    'mongo_command_seconds_total': ('counter', 'Time spent in MongoDB commands by issuing route', None),
+    'simulator_tick_seconds': ('histogram', 'Duration of one price simulator tick', LATENCY_BUCKETS),
+    'order_events_dead_lettered_total': ('counter', 'Order book writes moved to order_event_failures', None),
+    'transaction_log_sync_failures_total': ('counter', 'Settled trades whose write-ahead log fsync failed', None),
+}
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class OperationStats:
+    """Round-trips made on behalf of one request or background job"""
+    __slots__ = ('route', 'db_calls', 'db_seconds')
+
+    def __init__(self, route: str):
+        self.route = route
+        self.db_calls = 0
+        self.db_seconds = 0.0
+
+    def server_timing(self, app_seconds: float) -> str:
+        return (f'app;dur={app_seconds * 1000:.1f}, '
+                f'db;dur={self.db_seconds * 1000:.1f};desc="{self.db_calls} round-trips"')
+
+
+current_operation: ContextVar[Optional[OperationStats]] = ContextVar('current_operation', default=None)
+
+
+class Metrics:
+    def __init__(self):
+        # Command listener callbacks run on Motor's executor threads
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(METRICS[name][2])
+            series[key].observe(value)
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, stats: OperationStats):
+        self.inc('http_requests_total', method=method, route=route, status=str(status))
+        self.observe('http_request_duration_seconds', seconds, method=method, route=route)
+        self.observe('http_request_mongo_round_trips', stats.db_calls, method=method, route=route)
+
+    def render(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, _) in METRICS.items():
+                series = self._counters.get(name) if kind == 'counter' else self._histograms.get(name)
+                if not series:
+                    continue
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(series.items()):
+                    if kind == 'counter':
+                        lines.append(f'{name}{format_labels(key)} {value:g}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(value.buckets + (float('inf'),), value.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                        lines.append(f'{name}_bucket{format_labels(key + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(key)} {value.sum:g}')
+                    lines.append(f'{name}_count{format_labels(key)} {value.count}')
+        for name, value in (gauges or {}).items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(key: tuple) -> str:
+    if not key:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in key)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + '}'
+
+
+class CommandTracker(monitoring.CommandListener):
+    """Charges every MongoDB command to the operation in the caller's context"""
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+        # A request's own operations can run on several executor threads
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        seconds = event.duration_micros / 1e6
+        stats = current_operation.get()
+        route = 'background'
+        if stats is not None:
+            with self._lock:
+                stats.db_calls += 1
+                stats.db_seconds += seconds
+            route = stats.route
+        self.metrics.inc('mongo_commands_total', route=route, command=event.command_name)
+        self.metrics.inc('mongo_command_seconds_total', seconds, route=route)
+
+
+@contextmanager
+def track_operation(route: str):
+    """Attribute the round-trips made inside the block to `route`"""
+    stats = OperationStats(route)
+    token = current_operation.set(stats)
+    try:
+        yield stats
+    finally:
+        current_operation.reset(token)
+
+
+def route_label(scope: Scope) -> str:
+    """The matched route template; resolved up front so round-trips made
+    while the request runs (or by middleware serving it) carry the label"""
+    for route in scope['app'].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, 'path', 'unmatched')
+    return 'unmatched'
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app: ASGIApp, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                MutableHeaders(scope=message).append(
+                    'Server-Timing', stats.server_timing(time.perf_counter() - started)
+                )
+            await send(message)
+
+        with track_operation(route_label(scope)) as stats:
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                self.metrics.record_request(
+                    scope['method'], stats.route, status, time.perf_counter() - started, stats
+                )
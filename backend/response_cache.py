@@ -0,0 +1,115 @@
+"""Server-side cache of JSON responses with strong ETags.
+
+Cached bodies are keyed by (generation, path, query). server.py bumps
+generations on every write that can change a cached response (price
+updates, new movies, new users), so stale entries are never read again
+and simply age out of the LRU. Catalogue-wide responses share the market
+generation. A single movie's response (movie_path) is versioned by that
+movie's own generation, so a trade in one movie leaves the others'
+cached. ETags hash the body, so a poll whose data did not change gets a
+304 even across generations.
+"""
+import hashlib
+import re
+from typing import Dict, Iterable, Optional, Pattern, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ttl_cache import TTLCache
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int, ttl: float, movie_path: str = r'(?!)'):
+        self.entries = TTLCache(maxsize, ttl)
+        self.generation = 0
+        # Single-movie paths; group 1 is the movie id
+        self.movie_path: Pattern = re.compile(movie_path)
+        # Moves every movie's generation at once
+        self.movies_generation = 0
+        self.movie_generations: Dict[str, int] = {}
+
+    def bump(self, movie_ids: Optional[Iterable[str]] = None):
+        """Invalidate catalogue-wide responses and those of `movie_ids` (every movie when None)"""
+        self.generation += 1
+        if movie_ids is None:
+            self.movies_generation += 1
+            return
+        for movie_id in movie_ids:
+            self.movie_generations[movie_id] = self.movie_generations.get(movie_id, 0) + 1
+
+    def generation_of(self, path: str) -> Tuple[int, ...]:
+        match = self.movie_path.fullmatch(path)
+        if match is None:
+            return (self.generation,)
+        return self.movies_generation, self.movie_generations.get(match.group(1), 0)
+
+    def stats(self) -> dict:
+        return {**self.entries.stats(), 'generation': self.generation}
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or any(tag.removeprefix('W/') == etag for tag in candidates)
+
+
+class ResponseCacheMiddleware:
+    """Pure ASGI, so uncached responses keep their single body message and
+    the compression middleware outside it still sees one complete body"""
+
+    def __init__(self, app: ASGIApp, cache: ResponseCache, paths: str):
+        self.app = app
+        self.cache = cache
+        self.paths: Pattern = re.compile(paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or scope['method'] != 'GET' or not self.paths.fullmatch(scope['path']):
+            await self.app(scope, receive, send)
+            return
+
+        key = (self.cache.generation_of(scope['path']), scope['path'], scope['query_string'].decode('latin-1'))
+        entry = self.cache.entries.get(key)
+        if entry is None:
+            start: dict = {}
+            chunks = []
+            passthrough = False
+
+            async def capture(message: Message):
+                nonlocal start, passthrough
+                if passthrough:
+                    await send(message)
+                elif message['type'] == 'http.response.start':
+                    start = message
+                    headers = Headers(raw=message['headers'])
+                    if message['status'] != 200 or headers.get('content-type') != 'application/json':
+                        passthrough = True
+                        await send(message)
+                elif message['type'] == 'http.response.body':
+                    chunks.append(message.get('body', b''))
+
+            await self.app(scope, receive, capture)
+            if passthrough:
+                return
+            body = b''.join(chunks)
+            headers = {
+                name: value for name, value in Headers(raw=start['headers']).items()
+                if name not in ('content-length', 'etag')
+            }
+            entry = (body, make_etag(body), headers)
+            # Stored under the generation seen before the handler ran; if a
+            # write bumped it meanwhile, nothing will look this entry up
+            self.cache.entries.set(key, entry)
+
+        body, etag, headers = entry
+        cache_headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag_matches(Headers(scope=scope).get('if-none-match', ''), etag):
+            response = Response(status_code=304, headers=cache_headers)
+        else:
+            response = Response(body, status_code=200, headers={**headers, **cache_headers})
+        await response(scope, receive, send)
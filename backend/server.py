@@ -1,44 +1,200 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import socket
+import json
+import base64
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional, Set
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
-import requests
 from bson import ObjectId
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure, PyMongoError
 import asyncio
 import random
+from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
+import time
+import numpy as np
+from order_book import LimitOrder, MatchResult, MatchingEngine, to_ticks
+from price_stream import PriceBroadcaster, PriceRelay, price_delta
+from market_board import MarketBoard
+from net_worth import NetWorthBoard
+from price_history import INTERVALS, PriceHistory, merge_candle, to_datetime
+from tmdb_client import TMDbClient
+from db_indexes import audit_query_plans, ensure_indexes, missing_unique_indexes
+from memory_store import MemoryClient
+from ttl_cache import TTLCache
+from response_cache import ResponseCache, ResponseCacheMiddleware
+from json_responses import CompressionMiddleware, FastJSONResponse, dumps
+from simulator_leases import ShardLeases, shard_filter
+from request_metrics import CommandTracker, Metrics, RequestMetricsMiddleware, track_operation
+from portfolio_analytics import NO_TRADES, DailyCloses, TradeDays, analyze, merge, summarize
+from price_models import FLOOR_FRACTION, impact_model, walk_model
+from transaction_ledger import TransactionArchive, TransactionLedger, archive_transactions, iter_transactions
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Request latency and MongoDB round-trips per route, served on /api/metrics
+request_metrics = Metrics()
+
+# MongoDB connection. STORAGE=memory serves every collection from an
+# in-process store instead: nothing is persisted and workers share
+# nothing, which suits load tests and benchmarks on a single worker.
+STORAGE = os.environ.get('STORAGE', 'mongo')
+if STORAGE == 'memory':
+    client = MemoryClient(event_listeners=[CommandTracker(request_metrics)])
+    db = client[os.environ.get('DB_NAME', 'bollywood_sensex')]
+else:
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[CommandTracker(request_metrics)])
+    db = client[os.environ['DB_NAME']]
+
+# Fail startup if any indexed lookup would fall back to a collection scan
+INDEX_AUDIT_ON_STARTUP = os.environ.get('INDEX_AUDIT_ON_STARTUP', '').lower() in ('1', 'true', 'yes')
 
 # JWT Configuration
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 24
 
+# bcrypt runs on a small thread pool so hashing never blocks the event
+# loop; passwords hashed at another cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+AUTH_EXECUTOR_WORKERS = int(os.environ.get('AUTH_EXECUTOR_WORKERS', str(min(4, os.cpu_count() or 1))))
+auth_executor = ThreadPoolExecutor(max_workers=AUTH_EXECUTOR_WORKERS, thread_name_prefix='auth')
+
+# Authenticated users are cached by id; balance writes invalidate the entry
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', '10000'))
+USER_CACHE_TTL_SECONDS = float(os.environ.get('USER_CACHE_TTL_SECONDS', '10'))
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL_SECONDS)
+
+# /api/portfolio/analytics results by user id; the user's own trades
+# invalidate the entry and the TTL bounds how stale its prices can be
+ANALYTICS_CACHE_SIZE = int(os.environ.get('ANALYTICS_CACHE_SIZE', '1000'))
+ANALYTICS_CACHE_TTL_SECONDS = float(os.environ.get('ANALYTICS_CACHE_TTL_SECONDS', '60'))
+analytics_cache = TTLCache(ANALYTICS_CACHE_SIZE, ANALYTICS_CACHE_TTL_SECONDS)
+# Past daily closes shared by every user's analytics; bounded by movie count
+ANALYTICS_CLOSES_MAX_MOVIES = int(os.environ.get('ANALYTICS_CLOSES_MAX_MOVIES', '20000'))
+daily_closes = DailyCloses(ANALYTICS_CLOSES_MAX_MOVIES)
+# Each user's settled transactions (older than the margin, so every
+# worker's ledger has flushed them) are kept between analytics requests,
+# netted per movie and day, which then only read the newer tail from
+# MongoDB. Bounded by the bytes of those columns as well as by user count
+ANALYTICS_HISTORY_MARGIN_SECONDS = float(os.environ.get('ANALYTICS_HISTORY_MARGIN_SECONDS', '300'))
+ANALYTICS_HISTORY_TTL_SECONDS = float(os.environ.get('ANALYTICS_HISTORY_TTL_SECONDS', '3600'))
+ANALYTICS_HISTORY_MAX_BYTES = int(os.environ.get('ANALYTICS_HISTORY_MAX_BYTES', str(64 * 1024 * 1024)))
+analytics_history = TTLCache(ANALYTICS_CACHE_SIZE, ANALYTICS_HISTORY_TTL_SECONDS, ANALYTICS_HISTORY_MAX_BYTES)
+
+# Cached JSON bodies for the polled read endpoints, versioned by a market
+# generation bumped on every write they depend on, and a movie's detail by
+# that movie's own. The TTL bounds staleness from writes made by other
+# workers.
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '2000'))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '30'))
+CACHED_PATHS = r'/api/movies(/[^/]+)?|/api/market/(trending|stats)'
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS, movie_path=r'/api/movies/([^/]+)')
+
+# Responses at least this large are gzip/brotli compressed; 0 disables
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get('COMPRESSION_MINIMUM_SIZE', '1024'))
+
 # TMDb API Configuration
 TMDB_API_KEY = os.environ.get('TMDB_API_KEY', '')
-TMDB_BASE_URL = 'https://api.themoviedb.org/3'
+TMDB_BASE_URL = os.environ.get('TMDB_BASE_URL', 'https://api.themoviedb.org/3')
+TMDB_SYNC_PAGES = int(os.environ.get('TMDB_SYNC_PAGES', '5'))
+TMDB_MAX_CONCURRENCY = int(os.environ.get('TMDB_MAX_CONCURRENCY', '8'))
+
+# Shared pooled client for every TMDb call, closed on shutdown
+tmdb_client = TMDbClient(TMDB_API_KEY, TMDB_BASE_URL, max_concurrency=TMDB_MAX_CONCURRENCY)
 
 # Create the main app
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
 
+# Identifies this process in the shard leases it holds
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+# Every movie's limit order book lives on exactly one worker, the holder
+# of the movie's order book shard lease, so a resting order can only be
+# matched once. Any worker accepts an order by writing it to db.orders
+# together with its hold; the owner matches it inline when it took the
+# request itself, otherwise within ORDER_POLL_SECONDS. Fills are persisted
+# in order by process_order_events().
+ORDER_BOOK_SHARDS = int(os.environ.get('ORDER_BOOK_SHARDS', '8'))
+ORDER_BOOK_LEASE_SECONDS = float(os.environ.get('ORDER_BOOK_LEASE_SECONDS', '15'))
+ORDER_POLL_SECONDS = float(os.environ.get('ORDER_POLL_SECONDS', '0.2'))
+# An order still 'new' this long after it was placed lost its worker
+# between writing the order and handing it on, and the owner settles it
+ORDER_RECOVERY_SECONDS = float(os.environ.get('ORDER_RECOVERY_SECONDS', '60'))
+matching_engine = MatchingEngine()
+order_book_leases = ShardLeases(WORKER_ID, ORDER_BOOK_SHARDS, ORDER_BOOK_LEASE_SECONDS, name='order_book')
+# Shards whose books are loaded into matching_engine
+order_book_shards: Set[int] = set()
+order_events: asyncio.Queue = asyncio.Queue()
+
+# Price changes are pushed to /api/stream/prices subscribers
+price_broadcaster = PriceBroadcaster()
+PRICE_STREAM_KEEPALIVE_SECONDS = float(os.environ.get('PRICE_STREAM_KEEPALIVE_SECONDS', '15'))
+# Other workers' price moves reach this worker's subscribers and boards
+# through price_ticks, exchanged this often; off with STORAGE=memory,
+# where there is only one worker
+PRICE_RELAY_SECONDS = float(os.environ.get('PRICE_RELAY_SECONDS', '1'))
+price_relay = PriceRelay(WORKER_ID) if STORAGE != 'memory' and PRICE_RELAY_SECONDS > 0 else None
+
+# Trending leaderboards are served from memory. Other workers' price moves
+# arrive through the price relay; the periodic reconcile resets the market
+# cap and reloads the board only when the catalogue size changed
+market_board = MarketBoard()
+MARKET_BOARD_REFRESH_SECONDS = float(os.environ.get('MARKET_BOARD_REFRESH_SECONDS', '60'))
+
+# Every user's net worth, ranked for /api/leaderboard. Trades update it in
+# place; price changes re-rank it after each simulator tick and at most
+# every NET_WORTH_REPRICE_SECONDS otherwise; the reload picks up other
+# workers' trades.
+net_worth_board = NetWorthBoard()
+NET_WORTH_REFRESH_SECONDS = float(os.environ.get('NET_WORTH_REFRESH_SECONDS', '300'))
+NET_WORTH_REPRICE_SECONDS = float(os.environ.get('NET_WORTH_REPRICE_SECONDS', '1'))
+
+# Market orders move the price through a pluggable impact model: 'linear'
+# (the original rule) or 'sqrt'; see price_models.py
+PRICE_IMPACT_MODEL = os.environ.get('PRICE_IMPACT_MODEL', 'linear')
+price_impact_model = impact_model(PRICE_IMPACT_MODEL)
+
+# Running counters for /api/market/stats; the movie count and market cap
+# live on market_board. All of them are reconciled on the same schedule.
+market_counters = {'total_users': 0, 'total_transactions': 0}
+
+# Price ticks and OHLCV candles are buffered here and written in batches
+price_history = PriceHistory()
+PRICE_HISTORY_FLUSH_SECONDS = float(os.environ.get('PRICE_HISTORY_FLUSH_SECONDS', '5'))
+PRICE_TICK_RETENTION_DAYS = int(os.environ.get('PRICE_TICK_RETENTION_DAYS', '30'))
+
+# Trades are acknowledged once their transactions are fsynced to a local
+# write-ahead log; a background writer batches them into MongoDB
+TRANSACTION_WAL_DIR = Path(os.environ.get('TRANSACTION_WAL_DIR', str(ROOT_DIR / 'data' / 'wal')))
+TRANSACTION_FLUSH_SECONDS = float(os.environ.get('TRANSACTION_FLUSH_SECONDS', '1'))
+TRANSACTION_FLUSH_BATCH_SIZE = int(os.environ.get('TRANSACTION_FLUSH_BATCH_SIZE', '500'))
+transaction_ledger = TransactionLedger(TRANSACTION_WAL_DIR, TRANSACTION_FLUSH_BATCH_SIZE)
+
+# Transactions older than TRANSACTION_ARCHIVE_DAYS move to compressed
+# monthly files (0 disables the rollover). Every worker reads the archive
+# for /api/transactions, so the directory must be shared between them.
+TRANSACTION_ARCHIVE_DIR = Path(os.environ.get('TRANSACTION_ARCHIVE_DIR', str(ROOT_DIR / 'data' / 'archive')))
+TRANSACTION_ARCHIVE_DAYS = int(os.environ.get('TRANSACTION_ARCHIVE_DAYS', '90'))
+TRANSACTION_ARCHIVE_INTERVAL_SECONDS = float(os.environ.get('TRANSACTION_ARCHIVE_INTERVAL_SECONDS', '3600'))
+transaction_archive = TransactionArchive(TRANSACTION_ARCHIVE_DIR)
+
 # ==================== MODELS ====================
 
 class UserRegister(BaseModel):
@@ -85,6 +241,9 @@ class TradeOrder(BaseModel):
     order_type: str = 'market'  # 'market' or 'limit'
     price: Optional[float] = None
 
+class TradeBatch(BaseModel):
+    orders: List[TradeOrder]
+
 class Portfolio(BaseModel):
     model_config = ConfigDict(extra="ignore")
     movie_id: str
@@ -111,12 +270,75 @@ class Transaction(BaseModel):
 
 # ==================== HELPER FUNCTIONS ====================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# Page sizes for list endpoints; NDJSON streams may ask for everything
+MAX_PAGE_SIZE = 1000
+MOVIE_FIELDS = set(Movie.model_fields) | {'symbol'}
+TICKER_FIELDS = ['id', 'symbol', 'title', 'current_price', 'change', 'change_percent']
+
+def encode_cursor(position: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str, *keys: str) -> dict:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        position = None
+    if not isinstance(position, dict) or any(key not in position for key in keys):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position
+
+def page_size(limit: int, stream: bool) -> int:
+    """Clamp a requested page size; 0 means no limit for NDJSON streams"""
+    if stream and limit == 0:
+        return 0
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def movie_projection(fields: Optional[str], view: Optional[str]) -> dict:
+    if view == 'ticker':
+        names = TICKER_FIELDS
+    elif fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = set(names) - MOVIE_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    else:
+        return {'_id': 0}
+    return {'_id': 0, 'id': 1, **{name: 1 for name in names}}
+
+async def take(documents, limit: int):
+    count = 0
+    async for document in documents:
+        yield document
+        count += 1
+        if count == limit:
+            return
+
+def ndjson_response(cursor) -> StreamingResponse:
+    """Stream a Mongo cursor one JSON document per line"""
+    async def lines():
+        async for document in cursor:
+            yield dumps(document) + b'\n'
+    return StreamingResponse(lines(), media_type='application/x-ndjson')
 
-def verify_password(password: str, hashed: str) -> bool:
+def _hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+def _verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(auth_executor, _hash_password, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(auth_executor, _verify_password, password, hashed)
+
+def password_cost(hashed: str) -> int:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return 0
+
 def create_token(user_id: str, email: str) -> str:
     expiration = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     payload = {
@@ -137,96 +359,279 @@ def decode_token(token: str) -> dict:
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     payload = decode_token(token)
-    user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0, 'password_hash': 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+    user = user_cache.get(payload['user_id'])
+    if user is None:
+        generation = user_cache.generation(payload['user_id'])
+        user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0, 'password_hash': 0, 'order_holds': 0})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        user_cache.set(payload['user_id'], user, generation)
+    return dict(user)
 
-async def fetch_bollywood_movies():
+async def fetch_bollywood_movies(pages: Optional[int] = None):
     """Fetch Bollywood movies from TMDb API"""
     if not TMDB_API_KEY:
         return []
     
-    try:
-        # Fetch popular Hindi movies
-        response = requests.get(
-            f"{TMDB_BASE_URL}/discover/movie",
-            params={
-                'api_key': TMDB_API_KEY,
-                'with_original_language': 'hi',
-                'sort_by': 'popularity.desc',
-                'page': 1
-            },
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            return response.json().get('results', [])[:20]
-    except Exception as e:
-        logging.error(f"Error fetching movies from TMDb: {str(e)}")
-    
-    return []
+    # Fetch popular Hindi movies, all discover pages at once
+    return await tmdb_client.discover_hindi(pages or TMDB_SYNC_PAGES)
 
 async def get_movie_details(tmdb_id: int):
     """Fetch detailed movie info from TMDb"""
     if not TMDB_API_KEY:
         return None
     
-    try:
-        response = requests.get(
-            f"{TMDB_BASE_URL}/movie/{tmdb_id}",
-            params={
-                'api_key': TMDB_API_KEY,
-                'append_to_response': 'credits'
-            },
-            timeout=10
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-    except Exception as e:
-        logging.error(f"Error fetching movie details: {str(e)}")
-    
-    return None
+    return await tmdb_client.movie_details(tmdb_id)
 
-async def update_movie_price(movie_id: str, quantity: int, action: str):
-    """Update movie price based on demand-supply logic"""
-    movie = await db.movies.find_one({'id': movie_id})
-    if not movie:
-        return
-    
+def publish_prices(deltas: List[dict], volumes: Optional[Dict[str, int]] = None):
+    """Fan price changes out to the leaderboards, price history and stream subscribers"""
+    response_cache.bump([delta['id'] for delta in deltas])
+    market_board.apply_prices(deltas)
+    net_worth_board.set_prices(deltas)
+    price_history.record(deltas, volumes)
+    price_broadcaster.publish(deltas)
+    if price_relay is not None:
+        price_relay.push(deltas, volumes)
+
+def apply_relayed_prices(deltas: List[dict], volumes: Dict[str, int]):
+    """Price moves published by other workers; their candles are recorded where they happened"""
+    response_cache.bump([delta['id'] for delta in deltas])
+    market_board.apply_prices(deltas)
+    net_worth_board.set_prices(deltas)
+    for movie_id, quantity in volumes.items():
+        market_board.add_volume(movie_id, quantity)
+    price_broadcaster.publish(deltas)
+
+async def relay_prices():
+    """Exchange price moves with the other workers every PRICE_RELAY_SECONDS"""
+    while True:
+        await asyncio.sleep(PRICE_RELAY_SECONDS)
+        try:
+            deltas, volumes = await price_relay.exchange(db)
+        except Exception as e:
+            logging.error(f"Error relaying prices: {str(e)}")
+            continue
+        if deltas or volumes:
+            apply_relayed_prices(deltas, volumes)
+
+def price_impact(movie: dict, quantity: int, action: str) -> tuple:
+    """New (price, change, change_percent) after a trade, by the configured impact model"""
     current_price = movie['current_price']
-    total_shares = movie['total_shares']
-    
-    # Price impact based on trade volume (percentage of total shares)
-    volume_impact = (quantity / total_shares) * 100
-    
-    # Calculate price change (0.1% to 5% based on volume)
-    price_change_percent = min(volume_impact * 0.5, 5.0)
-    
-    if action == 'buy':
-        new_price = current_price * (1 + price_change_percent / 100)
-    else:
-        new_price = current_price * (1 - price_change_percent / 100)
+    factor = float(price_impact_model.factors(quantity, movie['total_shares'], action == 'buy'))
     
     # Ensure price doesn't go below 10% of initial price
-    min_price = movie['initial_price'] * 0.1
-    new_price = max(new_price, min_price)
+    new_price = max(current_price * factor, movie['initial_price'] * FLOOR_FRACTION)
     
     change = new_price - current_price
     change_percent = (change / current_price) * 100
-    
-    await db.movies.update_one(
-        {'id': movie_id},
+    return round(new_price, 2), round(change, 2), round(change_percent, 2)
+
+def compounded_price_update(factor: float, quantity: int) -> list:
+    """Pipeline update that multiplies whatever price is stored by `factor`,
+    so a move written since the price was read is compounded, not lost"""
+    new_price = {'$round': [{'$max': [
+        {'$multiply': ['$current_price', factor]}, {'$multiply': ['$initial_price', FLOOR_FRACTION]}
+    ]}, 2]}
+    change = {'$subtract': [new_price, '$current_price']}
+    return [{'$set': {
+        'current_price': new_price,
+        'change': {'$round': [change, 2]},
+        'change_percent': {'$round': [{'$multiply': [{'$divide': [change, '$current_price']}, 100]}, 2]},
+        'volume': {'$add': [{'$ifNull': ['$volume', 0]}, quantity]}
+    }}]
+
+async def update_movie_price(movie_id: str, quantity: int, action: str, movie: Optional[dict] = None):
+    """Move the price by a trade's impact, starting from `movie` (the price the
+    trade filled at) when given. The write is guarded on that price, so a
+    concurrent move is re-read and compounded instead of overwritten."""
+    for attempt in range(SETTLEMENT_MAX_RETRIES + 1):
+        if movie is None:
+            movie = await db.movies.find_one(
+                {'id': movie_id}, {'_id': 0, 'current_price': 1, 'initial_price': 1, 'total_shares': 1}
+            )
+            if not movie:
+                return
+        
+        new_price, change, change_percent = price_impact(movie, quantity, action)
+        # The last attempt writes unguarded rather than dropping the trade's volume
+        guard = {'id': movie_id}
+        if attempt < SETTLEMENT_MAX_RETRIES:
+            guard['current_price'] = movie['current_price']
+        result = await db.movies.update_one(
+            guard,
+            {
+                '$set': {
+                    'current_price': new_price,
+                    'change': change,
+                    'change_percent': change_percent
+                },
+                '$inc': {'volume': quantity}
+            }
+        )
+        if result.matched_count:
+            break
+        movie = None
+    else:
+        return
+    market_board.add_volume(movie_id, quantity)
+    publish_prices([price_delta(movie_id, new_price, change, change_percent)], {movie_id: quantity})
+
+# ==================== SETTLEMENT ====================
+
+# Every balance, share and holding change below is a single-document
+# conditional update, so concurrent orders can never overdraw a balance
+# or oversell the float. Multi-step trades compensate earlier steps when
+# a later guard fails.
+SETTLEMENT_MAX_RETRIES = int(os.environ.get('SETTLEMENT_MAX_RETRIES', '3'))
+
+def is_transient_error(error: Exception) -> bool:
+    if isinstance(error, (AutoReconnect, DuplicateKeyError)):
+        return True
+    if isinstance(error, OperationFailure):
+        # 112 = WriteConflict
+        return error.code == 112 or error.has_error_label('TransientTransactionError')
+    return False
+
+async def with_retries(operation):
+    """Run a single-document write, retrying transient failures a bounded number of times"""
+    for attempt in range(SETTLEMENT_MAX_RETRIES + 1):
+        try:
+            return await operation()
+        except PyMongoError as e:
+            if attempt == SETTLEMENT_MAX_RETRIES or not is_transient_error(e):
+                raise
+            await asyncio.sleep(0.005 * 2 ** attempt)
+
+async def debit_balance(user_id: str, amount: float) -> bool:
+    result = await with_retries(lambda: db.users.update_one(
+        {'id': user_id, 'balance': {'$gte': amount}},
+        {'$inc': {'balance': -amount}}
+    ))
+    user_cache.invalidate(user_id)
+    return result.modified_count == 1
+
+async def credit_balance(user_id: str, amount: float):
+    await with_retries(lambda: db.users.update_one({'id': user_id}, {'$inc': {'balance': amount}}))
+    user_cache.invalidate(user_id)
+
+async def credit_holding(user_id: str, movie: dict, quantity: int, price: float):
+    """Add shares to a holding, upserting it and re-averaging the cost in one update"""
+    held = {'$ifNull': ['$quantity', 0]}
+    await with_retries(lambda: db.portfolio.update_one(
+        {'user_id': user_id, 'movie_id': movie['id']},
+        [{'$set': {
+            'id': {'$ifNull': ['$id', str(uuid.uuid4())]},
+            'movie_title': movie['title'],
+            'movie_symbol': movie['symbol'],
+            'created_at': {'$ifNull': ['$created_at', datetime.now(timezone.utc).isoformat()]},
+            'quantity': {'$add': [held, quantity]},
+            'avg_price': {'$divide': [
+                {'$add': [{'$multiply': [held, {'$ifNull': ['$avg_price', 0]}]}, price * quantity]},
+                {'$add': [held, quantity]}
+            ]}
+        }}],
+        upsert=True
+    ))
+
+async def debit_holding(user_id: str, movie_id: str, quantity: int) -> bool:
+    """Remove unreserved shares from a holding, deleting it once empty"""
+    result = await with_retries(lambda: db.portfolio.update_one(
         {
-            '$set': {
-                'current_price': round(new_price, 2),
-                'change': round(change, 2),
-                'change_percent': round(change_percent, 2)
-            },
-            '$inc': {'volume': quantity}
-        }
-    )
+            'user_id': user_id,
+            'movie_id': movie_id,
+            '$expr': {'$gte': [
+                {'$subtract': ['$quantity', {'$ifNull': ['$reserved_quantity', 0]}]},
+                quantity
+            ]}
+        },
+        {'$inc': {'quantity': -quantity}}
+    ))
+    if result.modified_count == 0:
+        return False
+    await db.portfolio.delete_one({'user_id': user_id, 'movie_id': movie_id, 'quantity': {'$lte': 0}})
+    return True
+
+def build_transaction(user_id: str, movie: dict, action: str, quantity: int, price: float) -> dict:
+    return {
+        'id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'movie_id': movie['id'],
+        'movie_title': movie['title'],
+        'movie_symbol': movie['symbol'],
+        'type': action.upper(),
+        'quantity': quantity,
+        'price': price,
+        'amount': price * quantity,
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    }
+
+async def settle_market_buy(user_id: str, movie: dict, quantity: int) -> dict:
+    """Buy from the house float at the price current when the shares are taken"""
+    taken = await with_retries(lambda: db.movies.find_one_and_update(
+        {'id': movie['id'], 'available_shares': {'$gte': quantity}},
+        {'$inc': {'available_shares': -quantity}},
+        projection={'_id': 0, 'current_price': 1}
+    ))
+    if taken is None:
+        raise HTTPException(status_code=400, detail="Insufficient shares available")
+    
+    price = taken['current_price']
+    total_cost = price * quantity
+    try:
+        if not await debit_balance(user_id, total_cost):
+            raise HTTPException(status_code=400, detail="Insufficient balance")
+    except Exception:
+        await with_retries(lambda: db.movies.update_one(
+            {'id': movie['id']}, {'$inc': {'available_shares': quantity}}
+        ))
+        raise
+    
+    await credit_holding(user_id, movie, quantity, price)
+    transaction_doc = build_transaction(user_id, movie, 'buy', quantity, price)
+    await record_transactions([transaction_doc])
+    return transaction_doc
+
+async def settle_market_sell(user_id: str, movie: dict, quantity: int) -> dict:
+    """Sell back to the house float at the price current when the shares are returned"""
+    if not await debit_holding(user_id, movie['id'], quantity):
+        raise HTTPException(status_code=400, detail="Insufficient shares to sell")
+    
+    returned = await with_retries(lambda: db.movies.find_one_and_update(
+        {'id': movie['id']},
+        {'$inc': {'available_shares': quantity}},
+        projection={'_id': 0, 'current_price': 1}
+    ))
+    price = returned['current_price'] if returned else movie['current_price']
+    await credit_balance(user_id, price * quantity)
+    
+    transaction_doc = build_transaction(user_id, movie, 'sell', quantity, price)
+    await record_transactions([transaction_doc])
+    return transaction_doc
+
+# ==================== CACHE STATS ====================
+
+@api_router.get("/cache/stats")
+async def get_cache_stats():
+    return {
+        'user_cache': user_cache.stats(),
+        'response_cache': response_cache.stats(),
+        'analytics_cache': analytics_cache.stats(),
+        'analytics_daily_closes_movies': len(daily_closes),
+        'analytics_history': analytics_history.stats()
+    }
+
+# ==================== METRICS ====================
+
+@api_router.get("/metrics")
+async def get_metrics():
+    body = request_metrics.render({
+        'price_stream_subscribers': price_broadcaster.subscriber_count,
+        'order_events_queued': order_events.qsize(),
+        'price_history_pending_candles': price_history.pending,
+        'user_cache_entries': len(user_cache),
+        'transactions_unflushed': len(transaction_ledger),
+    })
+    return PlainTextResponse(body, media_type='text/plain; version=0.0.4')
 
 # ==================== AUTH ROUTES ====================
 
@@ -243,12 +648,15 @@ async def register(user_data: UserRegister):
         'id': user_id,
         'email': user_data.email,
         'name': user_data.name,
-        'password_hash': hash_password(user_data.password),
+        'password_hash': await hash_password(user_data.password),
         'balance': 100000.0,
         'created_at': datetime.now(timezone.utc).isoformat()
     }
     
     await db.users.insert_one(user_doc)
+    market_counters['total_users'] += 1
+    net_worth_board.add_user(user_id, user_data.name, user_doc['balance'])
+    response_cache.bump(movie_ids=())
     
     token = create_token(user_id, user_data.email)
     
@@ -265,9 +673,16 @@ async def register(user_data: UserRegister):
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
     user = await db.users.find_one({'email': credentials.email})
-    if not user or not verify_password(credentials.password, user['password_hash']):
+    if not user or not await verify_password(credentials.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    # Bring the stored hash up to the configured work factor
+    if password_cost(user['password_hash']) != BCRYPT_ROUNDS:
+        await db.users.update_one(
+            {'id': user['id'], 'password_hash': user['password_hash']},
+            {'$set': {'password_hash': await hash_password(credentials.password)}}
+        )
+    
     token = create_token(user['id'], user['email'])
     
     return {
@@ -287,9 +702,28 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 # ==================== MOVIE ROUTES ====================
 
 @api_router.get("/movies")
-async def get_movies(limit: int = 50):
-    movies = await db.movies.find({}, {'_id': 0}).to_list(limit)
-    return movies
+async def get_movies(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    view: Optional[str] = None,
+    format: Optional[str] = None
+):
+    """Movies in id order. The next page's cursor is returned in X-Next-Cursor;
+    format=ndjson streams the result one document per line"""
+    stream = format == 'ndjson'
+    limit = page_size(limit, stream)
+    query = {'id': {'$gt': decode_cursor(cursor, 'id')['id']}} if cursor else {}
+    movies_cursor = db.movies.find(query, movie_projection(fields, view)).sort('id', 1).limit(limit)
+    
+    if stream:
+        return ndjson_response(movies_cursor)
+    
+    movies = await movies_cursor.to_list(limit)
+    headers = {}
+    if len(movies) == limit:
+        headers['X-Next-Cursor'] = encode_cursor({'id': movies[-1]['id']})
+    return FastJSONResponse(movies, headers=headers)
 
 @api_router.get("/movies/{movie_id}")
 async def get_movie(movie_id: str):
@@ -306,17 +740,19 @@ async def sync_movies():
     if not movies_data:
         raise HTTPException(status_code=500, detail="Unable to fetch movies from TMDb")
     
-    synced_count = 0
+    # Skip movies we already have, checked in one query
+    existing = await db.movies.find(
+        {'tmdb_id': {'$in': [movie_data['id'] for movie_data in movies_data]}},
+        {'_id': 0, 'tmdb_id': 1}
+    ).to_list(None)
+    existing_ids = {movie['tmdb_id'] for movie in existing}
+    new_movies = [movie_data for movie_data in movies_data if movie_data['id'] not in existing_ids]
     
-    for movie_data in movies_data:
-        # Check if movie already exists
-        existing = await db.movies.find_one({'tmdb_id': movie_data['id']})
-        if existing:
-            continue
-        
-        # Get detailed info
-        details = await get_movie_details(movie_data['id'])
-        
+    # Get detailed info; tmdb_client bounds the fan-out
+    all_details = await asyncio.gather(*(get_movie_details(movie_data['id']) for movie_data in new_movies))
+    
+    movie_docs = []
+    for movie_data, details in zip(new_movies, all_details):
         # Extract cast
         cast = []
         if details and 'credits' in details:
@@ -334,7 +770,7 @@ async def sync_movies():
         initial_price = round(random.uniform(50, 500), 2)
         total_shares = random.randint(10000, 100000)
         
-        movie_doc = {
+        movie_docs.append({
             'id': str(uuid.uuid4()),
             'tmdb_id': movie_data['id'],
             'title': movie_data['title'],
@@ -353,12 +789,16 @@ async def sync_movies():
             'change': 0.0,
             'change_percent': 0.0,
             'created_at': datetime.now(timezone.utc).isoformat()
-        }
-        
-        await db.movies.insert_one(movie_doc)
-        synced_count += 1
+        })
+    
+    if movie_docs:
+        await db.movies.insert_many(movie_docs)
+        for movie_doc in movie_docs:
+            movie_doc.pop('_id', None)
+            market_board.add_movie(movie_doc)
+        response_cache.bump(movie_ids=())
     
-    return {'message': f'Successfully synced {synced_count} movies'}
+    return {'message': f'Successfully synced {len(movie_docs)} movies'}
 
 # ==================== TRADING ROUTES ====================
 
@@ -369,127 +809,535 @@ async def place_order(order: TradeOrder, current_user: dict = Depends(get_curren
     if not movie:
         raise HTTPException(status_code=404, detail="Movie not found")
     
-    price = movie['current_price'] if order.order_type == 'market' else order.price
-    total_cost = price * order.quantity
+    if order.order_type == 'limit':
+        return await place_limit_order(order, movie, current_user)
+    
+    if order.action not in ('buy', 'sell'):
+        raise HTTPException(status_code=400, detail="Invalid order action")
+    if order.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
     
     if order.action == 'buy':
-        # Check if user has enough balance
-        if current_user['balance'] < total_cost:
-            raise HTTPException(status_code=400, detail="Insufficient balance")
-        
-        # Check if enough shares available
-        if movie['available_shares'] < order.quantity:
-            raise HTTPException(status_code=400, detail="Insufficient shares available")
-        
-        # Update user balance
-        await db.users.update_one(
-            {'id': current_user['id']},
-            {'$inc': {'balance': -total_cost}}
-        )
+        transaction_doc = await settle_market_buy(current_user['id'], movie, order.quantity)
+    else:
+        transaction_doc = await settle_market_sell(current_user['id'], movie, order.quantity)
+    
+    # Update movie price based on trade, from the price it filled at
+    await update_movie_price(
+        order.movie_id, order.quantity, order.action, {**movie, 'current_price': transaction_doc['price']}
+    )
+    
+    return {'message': 'Order placed successfully', 'transaction': transaction_doc}
+
+# ==================== BATCH TRADING ====================
+
+# A run of market orders is planned in memory against one read of the
+# user, the movies and the holdings, then written with one combined write
+# per collection. Every write is guarded, so a concurrent change makes the
+# run re-plan from fresh reads instead of overdrawing anything.
+TRADE_BATCH_MAX_ORDERS = int(os.environ.get('TRADE_BATCH_MAX_ORDERS', '500'))
+
+class SettlementConflict(Exception):
+    pass
+
+def plan_market_run(user_id: str, run: list, balance: float, read_movies: Dict[str, dict],
+                    read_holdings: Dict[str, dict]) -> dict:
+    """Settle (index, order) pairs in sequence on copies of the read state"""
+    movies = {movie_id: dict(movie) for movie_id, movie in read_movies.items()}
+    holdings = {movie_id: dict(holding) for movie_id, holding in read_holdings.items()}
+    start_balance = balance
+    balance_drawdown = 0.0
+    share_drawdown: Dict[str, int] = {}
+    volumes: Dict[str, int] = {}
+    results = {}
+    transactions = []
+    
+    for index, order in run:
+        movie = movies.get(order.movie_id)
+        holding = holdings.get(order.movie_id)
+        error = None
+        if order.action not in ('buy', 'sell'):
+            error = "Invalid order action"
+        elif order.quantity <= 0:
+            error = "Quantity must be positive"
+        elif movie is None:
+            error = "Movie not found"
+        elif order.action == 'buy' and movie['available_shares'] < order.quantity:
+            error = "Insufficient shares available"
+        elif order.action == 'buy' and balance < movie['current_price'] * order.quantity:
+            error = "Insufficient balance"
+        elif order.action == 'sell' and (
+            holding is None or holding['quantity'] - holding.get('reserved_quantity', 0) < order.quantity
+        ):
+            error = "Insufficient shares to sell"
+        if error:
+            results[index] = {'index': index, 'status': 'rejected', 'error': error}
+            continue
         
-        # Update movie shares
-        await db.movies.update_one(
-            {'id': order.movie_id},
-            {'$inc': {'available_shares': -order.quantity}}
+        price = movie['current_price']
+        amount = price * order.quantity
+        if order.action == 'buy':
+            balance -= amount
+            movie['available_shares'] -= order.quantity
+            holding = holdings.setdefault(order.movie_id, {'quantity': 0, 'avg_price': 0.0})
+            holding['avg_price'] = (holding['quantity'] * holding['avg_price'] + amount) / (holding['quantity'] + order.quantity)
+            holding['quantity'] += order.quantity
+        else:
+            balance += amount
+            movie['available_shares'] += order.quantity
+            holding['quantity'] -= order.quantity
+        # The guards must cover the deepest point the run reaches, not just its net
+        balance_drawdown = max(balance_drawdown, start_balance - balance)
+        share_drawdown[movie['id']] = max(
+            share_drawdown.get(movie['id'], 0), read_movies[movie['id']]['available_shares'] - movie['available_shares']
         )
+        volumes[movie['id']] = volumes.get(movie['id'], 0) + order.quantity
+        movie['current_price'], movie['change'], movie['change_percent'] = price_impact(movie, order.quantity, order.action)
         
-        # Update or create portfolio entry
-        portfolio = await db.portfolio.find_one({
-            'user_id': current_user['id'],
-            'movie_id': order.movie_id
-        })
+        transaction_doc = build_transaction(user_id, movie, order.action, order.quantity, price)
+        transactions.append(transaction_doc)
+        results[index] = {'index': index, 'status': 'filled', 'transaction': transaction_doc}
+    
+    return {
+        'results': results,
+        'transactions': transactions,
+        'balance_delta': balance - start_balance,
+        'balance_drawdown': balance_drawdown,
+        'movies': {movie_id: movies[movie_id] for movie_id in volumes},
+        'share_drawdown': share_drawdown,
+        'holdings': {movie_id: holdings[movie_id] for movie_id in volumes},
+        'volumes': volumes
+    }
+
+async def ordered_guarded_write(collection, operations: list) -> tuple:
+    """Run guarded upserts in order and return (applied count, upserted _ids, error).
+    A guard that fails on an existing document turns into an insert that
+    collides with a unique index, so the first failure's index is exact."""
+    if not operations:
+        return 0, [], None
+    try:
+        result = await collection.bulk_write(operations, ordered=True)
+        return len(operations), list(result.upserted_ids.values()), None
+    except BulkWriteError as e:
+        upserted = [upsert['_id'] for upsert in e.details.get('upserted', [])]
+        return e.details['writeErrors'][0]['index'], upserted, e
+
+async def write_market_plan(user_id: str, plan: dict, read_movies: Dict[str, dict], read_holdings: Dict[str, dict]):
+    undo = []  # (collection, operations) reverting each applied write
+    try:
+        delta = plan['balance_delta']
+        result = await with_retries(lambda: db.users.update_one(
+            {'id': user_id, 'balance': {'$gte': plan['balance_drawdown']}},
+            {'$inc': {'balance': delta}}
+        ))
+        user_cache.invalidate(user_id)
+        if result.matched_count == 0:
+            raise SettlementConflict()
+        undo.append((db.users, [UpdateOne({'id': user_id}, {'$inc': {'balance': -delta}})]))
         
-        if portfolio:
-            # Calculate new average price
-            total_quantity = portfolio['quantity'] + order.quantity
-            total_value = (portfolio['quantity'] * portfolio['avg_price']) + total_cost
-            new_avg_price = total_value / total_quantity
-            
-            await db.portfolio.update_one(
-                {'user_id': current_user['id'], 'movie_id': order.movie_id},
-                {
-                    '$set': {'avg_price': round(new_avg_price, 2)},
-                    '$inc': {'quantity': order.quantity}
-                }
+        share_deltas = {
+            movie_id: movie['available_shares'] - read_movies[movie_id]['available_shares']
+            for movie_id, movie in plan['movies'].items()
+        }
+        applied, upserted, error = await ordered_guarded_write(db.movies, [
+            UpdateOne(
+                {'id': movie_id, 'available_shares': {'$gte': plan['share_drawdown'][movie_id]}},
+                {'$inc': {'available_shares': share_delta}},
+                upsert=True
             )
-        else:
-            portfolio_doc = {
-                'id': str(uuid.uuid4()),
-                'user_id': current_user['id'],
-                'movie_id': order.movie_id,
-                'movie_title': movie['title'],
-                'movie_symbol': movie['symbol'],
-                'quantity': order.quantity,
-                'avg_price': price,
-                'created_at': datetime.now(timezone.utc).isoformat()
-            }
-            await db.portfolio.insert_one(portfolio_doc)
-    
-    else:  # sell
-        # Check if user has enough shares
-        portfolio = await db.portfolio.find_one({
-            'user_id': current_user['id'],
-            'movie_id': order.movie_id
-        })
+            for movie_id, share_delta in share_deltas.items()
+        ])
+        undo.append((db.movies, [
+            UpdateOne({'id': movie_id}, {'$inc': {'available_shares': -share_delta}})
+            for movie_id, share_delta in list(share_deltas.items())[:applied]
+        ] + [DeleteOne({'_id': _id}) for _id in upserted]))
+        if error or upserted:
+            # An upsert here means the movie vanished after it was read
+            raise error if error and error.details['writeErrors'][0]['code'] != 11000 else SettlementConflict()
         
-        if not portfolio or portfolio['quantity'] < order.quantity:
-            raise HTTPException(status_code=400, detail="Insufficient shares to sell")
+        now = datetime.now(timezone.utc).isoformat()
+        holding_ops = []
+        for movie_id, holding in plan['holdings'].items():
+            read = read_holdings.get(movie_id)
+            state = {'quantity': holding['quantity'], 'avg_price': holding['avg_price']}
+            if read is None:
+                guard = {'user_id': user_id, 'movie_id': movie_id, 'quantity': {'$exists': False}}
+                movie = plan['movies'][movie_id]
+                state.update(id=str(uuid.uuid4()), movie_title=movie['title'], movie_symbol=movie['symbol'], created_at=now)
+            else:
+                guard = {
+                    'user_id': user_id, 'movie_id': movie_id, 'quantity': read['quantity'],
+                    'reserved_quantity': read.get('reserved_quantity') or {'$in': [None, 0]}
+                }
+            holding_ops.append(UpdateOne(guard, {'$set': state}, upsert=True))
+        applied, upserted, error = await ordered_guarded_write(db.portfolio, holding_ops)
         
-        # Update user balance
-        await db.users.update_one(
-            {'id': current_user['id']},
-            {'$inc': {'balance': total_cost}}
+        # Upserts for holdings that existed when read are holdings that were
+        # emptied meanwhile; remove them rather than resurrect the shares
+        vanished = {
+            doc['movie_id']: doc['_id']
+            for doc in await db.portfolio.find({'_id': {'$in': upserted}}, {'movie_id': 1}).to_list(None)
+            if doc['movie_id'] in read_holdings
+        } if upserted else {}
+        restore = []
+        for movie_id in list(plan['holdings'])[:applied]:
+            holding, read = plan['holdings'][movie_id], read_holdings.get(movie_id)
+            written = {'user_id': user_id, 'movie_id': movie_id, 'quantity': holding['quantity'], 'avg_price': holding['avg_price']}
+            if movie_id in vanished:
+                restore.append(DeleteOne({'_id': vanished[movie_id]}))
+            elif read is None:
+                restore.append(DeleteOne(written))
+            else:
+                restore.append(UpdateOne(written, {'$set': {'quantity': read['quantity'], 'avg_price': read['avg_price']}}))
+        undo.append((db.portfolio, restore))
+        if error or vanished:
+            raise error if error and error.details['writeErrors'][0]['code'] != 11000 else SettlementConflict()
+    except Exception as e:
+        for collection, operations in reversed(undo):
+            if operations:
+                try:
+                    await collection.bulk_write(operations, ordered=False)
+                except PyMongoError as compensation_error:
+                    logging.error(f"Error compensating batch settlement: {str(compensation_error)}")
+        if isinstance(e, PyMongoError) and is_transient_error(e):
+            raise SettlementConflict() from e
+        raise
+    
+    # Committed: everything below is unguarded bookkeeping
+    emptied = [movie_id for movie_id, holding in plan['holdings'].items() if holding['quantity'] <= 0]
+    if emptied:
+        await db.portfolio.delete_many({'user_id': user_id, 'movie_id': {'$in': emptied}, 'quantity': {'$lte': 0}})
+    await record_transactions(plan['transactions'])
+    
+    # The run's net impact is applied as a factor on the price stored now,
+    # in one round trip; never upserted, as a vanished movie stays gone
+    await db.movies.bulk_write([
+        UpdateOne(
+            {'id': movie_id},
+            compounded_price_update(movie['current_price'] / read_movies[movie_id]['current_price'], plan['volumes'][movie_id]),
+            upsert=False
         )
-        
-        # Update movie shares
-        await db.movies.update_one(
-            {'id': order.movie_id},
-            {'$inc': {'available_shares': order.quantity}}
+        for movie_id, movie in plan['movies'].items()
+    ], ordered=False)
+    moved = await db.movies.find(
+        {'id': {'$in': list(plan['movies'])}}, {'_id': 0, 'id': 1, 'current_price': 1, 'change': 1, 'change_percent': 1}
+    ).to_list(None)
+    for movie_id, quantity in plan['volumes'].items():
+        market_board.add_volume(movie_id, quantity)
+    publish_prices([
+        price_delta(movie['id'], movie['current_price'], movie['change'], movie['change_percent'])
+        for movie in moved
+    ], plan['volumes'])
+
+async def settle_market_run(user_id: str, run: list) -> Dict[int, dict]:
+    """Settle consecutive market orders together, re-planning on a lost race"""
+    movie_ids = list({order.movie_id for _, order in run})
+    for attempt in range(SETTLEMENT_MAX_RETRIES + 1):
+        user, movies, holdings = await asyncio.gather(
+            db.users.find_one({'id': user_id}, {'_id': 0, 'balance': 1}),
+            db.movies.find(
+                {'id': {'$in': movie_ids}},
+                {'_id': 0, 'id': 1, 'title': 1, 'symbol': 1, 'current_price': 1,
+                 'initial_price': 1, 'total_shares': 1, 'available_shares': 1}
+            ).to_list(None),
+            db.portfolio.find({'user_id': user_id, 'movie_id': {'$in': movie_ids}}, {'_id': 0}).to_list(None)
         )
+        if user is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        read_movies = {movie['id']: movie for movie in movies}
+        read_holdings = {holding['movie_id']: holding for holding in holdings}
         
-        # Update portfolio
-        new_quantity = portfolio['quantity'] - order.quantity
-        if new_quantity == 0:
-            await db.portfolio.delete_one({'user_id': current_user['id'], 'movie_id': order.movie_id})
-        else:
-            await db.portfolio.update_one(
-                {'user_id': current_user['id'], 'movie_id': order.movie_id},
-                {'$inc': {'quantity': -order.quantity}}
-            )
+        plan = plan_market_run(user_id, run, user['balance'], read_movies, read_holdings)
+        if not plan['transactions']:
+            return plan['results']
+        try:
+            await write_market_plan(user_id, plan, read_movies, read_holdings)
+            return plan['results']
+        except SettlementConflict:
+            await asyncio.sleep(0.005 * 2 ** attempt)
     
-    # Create transaction record
-    transaction_doc = {
-        'id': str(uuid.uuid4()),
-        'user_id': current_user['id'],
-        'movie_id': order.movie_id,
+    return {
+        index: {'index': index, 'status': 'rejected', 'error': "Conflicting concurrent updates, retry the order"}
+        for index, _ in run
+    }
+
+@api_router.post("/trade/orders/batch")
+async def place_order_batch(batch: TradeBatch, current_user: dict = Depends(get_current_user)):
+    """Apply orders in sequence; consecutive market orders settle together"""
+    if not batch.orders:
+        raise HTTPException(status_code=400, detail="No orders")
+    if len(batch.orders) > TRADE_BATCH_MAX_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {TRADE_BATCH_MAX_ORDERS} orders per batch")
+    
+    results = []
+    run = []
+    for index, order in enumerate(batch.orders + [None]):
+        if order is not None and order.order_type != 'limit':
+            run.append((index, order))
+            continue
+        if run:
+            settled = await settle_market_run(current_user['id'], run)
+            results.extend(settled[i] for i, _ in run)
+            run = []
+        if order is None:
+            break
+        
+        # Limit orders go through the book one at a time, between market runs
+        try:
+            movie = await db.movies.find_one({'id': order.movie_id})
+            if not movie:
+                raise HTTPException(status_code=404, detail="Movie not found")
+            placed = await place_limit_order(order, movie, current_user)
+            results.append({'index': index, 'status': placed['order']['status'], **placed})
+        except HTTPException as e:
+            results.append({'index': index, 'status': 'rejected', 'error': e.detail})
+    
+    return {
+        'results': results,
+        'accepted': sum(1 for result in results if result['status'] != 'rejected'),
+        'rejected': sum(1 for result in results if result['status'] == 'rejected')
+    }
+
+# ==================== ORDER BOOK ROUTES ====================
+
+# An order document moves 'new' (written, hold not confirmed) -> 'pending'
+# (held, waiting for its book's owner) -> 'matching' (submitted to the
+# book) -> 'open' or 'filled', or ends 'cancelled' or 'rejected'. An order
+# that filled on submission is 'settling' until its last fill is written;
+# each written fill adds to its filled_quantity, so a shard's next owner
+# can release the part whose fills died with the previous one. The hold
+# and a marker carrying the order id are one update of the user (buys) or
+# holding (sells), so recovery can tell whether an order left 'new' by a
+# crash ever had its hold taken.
+LIVE_ORDER_STATUSES = ['pending', 'matching', 'settling', 'open']
+
+def owns_book(movie_id: str) -> bool:
+    return order_book_leases.shard_of(movie_id) in order_book_shards and order_book_leases.owns(movie_id)
+
+def order_from_document(order: dict) -> LimitOrder:
+    return LimitOrder(
+        id=order['id'],
+        user_id=order['user_id'],
+        movie_id=order['movie_id'],
+        side=order['action'],
+        price_ticks=to_ticks(order['price']),
+        quantity=order['quantity'],
+        remaining=order['remaining_quantity'],
+        created_at=order['created_at']
+    )
+
+def order_holder(order: dict) -> tuple:
+    """The collection and filter of the document an order's hold sits on"""
+    if order['action'] == 'buy':
+        return db.users, {'id': order['user_id']}
+    return db.portfolio, {'user_id': order['user_id'], 'movie_id': order['movie_id']}
+
+async def hold_order(order: dict) -> bool:
+    """Reserve an order's cash or shares and mark the reservation with its id"""
+    collection, holder = order_holder(order)
+    # The marker guard turns a retried hold into a no-op
+    query = {**holder, 'order_holds': {'$ne': order['id']}}
+    if order['action'] == 'buy':
+        # Hold the full limit value; price improvement is refunded on fill
+        hold = to_ticks(order['price']) * order['quantity'] / 100
+        query['balance'] = {'$gte': hold}
+        update = {'$inc': {'balance': -hold}, '$push': {'order_holds': order['id']}}
+    else:
+        query['$expr'] = {'$gte': [
+            {'$subtract': ['$quantity', {'$ifNull': ['$reserved_quantity', 0]}]},
+            order['quantity']
+        ]}
+        update = {'$inc': {'reserved_quantity': order['quantity']}, '$push': {'order_holds': order['id']}}
+    result = await with_retries(lambda: collection.update_one(query, update))
+    user_cache.invalidate(order['user_id'])
+    if result.modified_count == 1:
+        return True
+    return await collection.count_documents({**holder, 'order_holds': order['id']}) == 1
+
+async def release_hold(order: dict, quantity: int):
+    """Return the part of an order's reservation that covers `quantity` shares"""
+    if order['action'] == 'buy':
+        await credit_balance(order['user_id'], to_ticks(order['price']) * quantity / 100)
+    else:
+        collection, holder = order_holder(order)
+        await with_retries(lambda: collection.update_one(holder, {'$inc': {'reserved_quantity': -quantity}}))
+
+async def hand_off_order(order: dict) -> Optional[str]:
+    """Move a held order from 'new' to 'pending' and drop its hold marker.
+
+    Returns the status the order had: 'new' if this call moved it, or
+    'rejected' (None if deleted) when recovery gave it up; anything else
+    means recovery already handed it on."""
+    previous = await db.orders.find_one_and_update(
+        {'id': order['id']},
+        [{'$set': {'status': {'$cond': [{'$eq': ['$status', 'new']}, 'pending', '$status']}}}],
+        projection={'_id': 0, 'status': 1}
+    )
+    collection, holder = order_holder(order)
+    await with_retries(lambda: collection.update_one(holder, {'$pull': {'order_holds': order['id']}}))
+    return previous['status'] if previous else None
+
+def submit_order(order: dict) -> MatchResult:
+    """Match a claimed order against this worker's book and queue the writes"""
+    limit_order = order_from_document(order)
+    match = matching_engine.submit(limit_order)
+    
+    movie_meta = {'id': order['movie_id'], 'title': order['movie_title'], 'symbol': order['movie_symbol']}
+    order_events.put_nowait(('accept', limit_order.to_dict()))
+    for cancelled in match.cancelled:
+        order_events.put_nowait(('cancel', cancelled.to_dict()))
+    for i, fill in enumerate(match.fills):
+        maker_id = fill.sell_order_id if fill.taker_side == 'buy' else fill.buy_order_id
+        maker = matching_engine.get_order(maker_id)
+        # The last fill settles the taker into its final status
+        taker_status = ('open' if match.rested else 'filled') if i == len(match.fills) - 1 else None
+        order_events.put_nowait(('fill', fill, movie_meta, maker.remaining if maker else 0, taker_status))
+    return match
+
+async def claim_and_submit(order: dict) -> Optional[MatchResult]:
+    """Take a pending order off db.orders and match it, if this worker owns its book"""
+    claimed = await db.orders.update_one({'id': order['id'], 'status': 'pending'}, {'$set': {'status': 'matching'}})
+    if claimed.modified_count == 0:
+        return None
+    if not owns_book(order['movie_id']):
+        # The shard moved while the claim was in flight; its new owner takes it
+        await db.orders.update_one({'id': order['id'], 'status': 'matching'}, {'$set': {'status': 'pending'}})
+        return None
+    return submit_order(order)
+
+async def place_limit_order(order: TradeOrder, movie: dict, current_user: dict):
+    """Write the order and its hold, then match it here or leave it to the book's owner"""
+    if order.action not in ('buy', 'sell'):
+        raise HTTPException(status_code=400, detail="Invalid order action")
+    if order.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be positive")
+    if order.price is None or order.price <= 0:
+        raise HTTPException(status_code=400, detail="Limit orders require a positive price")
+    
+    limit_order = LimitOrder(
+        id=str(uuid.uuid4()),
+        user_id=current_user['id'],
+        movie_id=order.movie_id,
+        side=order.action,
+        price_ticks=to_ticks(order.price),
+        quantity=order.quantity,
+        created_at=datetime.now(timezone.utc).isoformat()
+    )
+    order_doc = {
+        **limit_order.to_dict(),
         'movie_title': movie['title'],
         'movie_symbol': movie['symbol'],
-        'type': order.action.upper(),
-        'quantity': order.quantity,
-        'price': price,
-        'amount': total_cost,
-        'timestamp': datetime.now(timezone.utc).isoformat()
+        'status': 'new'
     }
-    await db.transactions.insert_one(transaction_doc)
+    await db.orders.insert_one(dict(order_doc))
     
-    # Update movie price based on trade
-    await update_movie_price(order.movie_id, order.quantity, order.action)
+    if not await hold_order(order_doc):
+        await db.orders.update_one({'id': limit_order.id, 'status': 'new'}, {'$set': {'status': 'rejected'}})
+        detail = "Insufficient balance" if order.action == 'buy' else "Insufficient shares to sell"
+        raise HTTPException(status_code=400, detail=detail)
     
-    return {'message': 'Order placed successfully', 'transaction': transaction_doc}
+    previous = await hand_off_order(order_doc)
+    if previous in (None, 'rejected'):
+        # Recovery gave the order up before its hold landed
+        await release_hold(order_doc, order.quantity)
+        raise HTTPException(status_code=409, detail="Order expired before it was placed, please retry")
+    
+    match = None
+    if previous == 'new' and owns_book(order.movie_id):
+        match = await claim_and_submit({**order_doc, 'status': 'pending'})
+    if match is None:
+        # Matched by the book's owner within ORDER_POLL_SECONDS
+        return {
+            'message': 'Order accepted',
+            'order': {**limit_order.to_dict(), 'status': 'pending', 'average_fill_price': None},
+            'fills': []
+        }
+    
+    filled = match.order
+    filled_value = sum(fill.price * fill.quantity for fill in match.fills)
+    return {
+        'message': 'Order placed successfully',
+        'order': {
+            **filled.to_dict(),
+            'status': 'open' if match.rested else 'filled',
+            'average_fill_price': round(filled_value / filled.filled, 2) if filled.filled else None
+        },
+        'fills': [fill.to_dict() for fill in match.fills]
+    }
+
+@api_router.get("/trade/orders")
+async def get_open_orders(current_user: dict = Depends(get_current_user)):
+    # Read from db.orders: the books of this user's movies may be on other
+    # workers. Remaining quantities lag the book by the queued writes.
+    return await db.orders.find(
+        {'user_id': current_user['id'], 'status': {'$in': LIVE_ORDER_STATUSES}},
+        {'_id': 0, 'movie_title': 0, 'movie_symbol': 0}
+    ).sort('created_at', 1).to_list(None)
+
+@api_router.delete("/trade/orders/{order_id}")
+async def cancel_order(order_id: str, current_user: dict = Depends(get_current_user)):
+    resting = matching_engine.get_order(order_id)
+    if resting and resting.user_id == current_user['id']:
+        matching_engine.cancel(order_id)
+        order_events.put_nowait(('cancel', resting.to_dict()))
+        return {'message': 'Order cancelled', 'order': resting.to_dict()}
+    
+    # The book is on another worker, or the order is not matched yet: flag
+    # it for the owner, which cancels it on its next sweep
+    requested = await db.orders.find_one_and_update(
+        {'id': order_id, 'user_id': current_user['id'], 'status': {'$in': ['new', *LIVE_ORDER_STATUSES]}},
+        {'$set': {'cancel_requested': True}},
+        projection={'_id': 0, 'movie_title': 0, 'movie_symbol': 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not requested:
+        raise HTTPException(status_code=404, detail="Open order not found")
+    return {'message': 'Cancel requested', 'order': requested}
+
+@api_router.get("/movies/{movie_id}/orderbook")
+async def get_order_book(movie_id: str, depth: int = 10):
+    depth = max(1, min(depth, 50))
+    if owns_book(movie_id):
+        return {'movie_id': movie_id, **matching_engine.depth(movie_id, depth)}
+    
+    # Another worker holds the book: aggregate the resting orders it has written
+    levels = await db.orders.aggregate([
+        {'$match': {'movie_id': movie_id, 'status': {'$in': ['settling', 'open']}, 'remaining_quantity': {'$gt': 0}}},
+        {'$group': {
+            '_id': {'action': '$action', 'price': '$price'},
+            'quantity': {'$sum': '$remaining_quantity'},
+            'orders': {'$sum': 1}
+        }}
+    ]).to_list(None)
+    sides = {'buy': [], 'sell': []}
+    for level in levels:
+        sides[level['_id']['action']].append(
+            {'price': level['_id']['price'], 'quantity': level['quantity'], 'orders': level['orders']}
+        )
+    bids = sorted(sides['buy'], key=lambda level: -level['price'])[:depth]
+    asks = sorted(sides['sell'], key=lambda level: level['price'])[:depth]
+    return {'movie_id': movie_id, 'bids': bids, 'asks': asks}
 
 # ==================== PORTFOLIO ROUTES ====================
 
 @api_router.get("/portfolio")
 async def get_portfolio(current_user: dict = Depends(get_current_user)):
-    portfolio_items = await db.portfolio.find({'user_id': current_user['id']}, {'_id': 0}).to_list(100)
+    portfolio_items = await db.portfolio.find({'user_id': current_user['id']}, {'_id': 0, 'order_holds': 0}).to_list(None)
+    
+    # Enrich with current prices from a single $in query
+    movie_ids = [item['movie_id'] for item in portfolio_items]
+    movies = await db.movies.find(
+        {'id': {'$in': movie_ids}},
+        {'_id': 0, 'id': 1, 'current_price': 1, 'change': 1, 'change_percent': 1}
+    ).to_list(None)
+    movies_by_id = {movie['id']: movie for movie in movies}
     
-    # Enrich with current prices
     enriched_portfolio = []
     total_value = 0
     total_pl = 0
     
     for item in portfolio_items:
-        movie = await db.movies.find_one({'id': item['movie_id']})
+        movie = movies_by_id.get(item['movie_id'])
         if movie:
             current_value = item['quantity'] * movie['current_price']
             cost = item['quantity'] * item['avg_price']
@@ -498,6 +1346,7 @@ async def get_portfolio(current_user: dict = Depends(get_current_user)):
             
             enriched_item = {
                 **item,
+                'avg_price': round(item['avg_price'], 2),
                 'current_price': movie['current_price'],
                 'current_value': round(current_value, 2),
                 'pl': round(pl, 2),
@@ -509,123 +1358,882 @@ async def get_portfolio(current_user: dict = Depends(get_current_user)):
             total_value += current_value
             total_pl += pl
     
-    # Get updated user balance
-    user = await db.users.find_one({'id': current_user['id']})
+    # get_current_user has just read the user document, balance included
+    balance = current_user['balance']
     
     return {
         'portfolio': enriched_portfolio,
         'total_value': round(total_value, 2),
         'total_pl': round(total_pl, 2),
-        'balance': user['balance'],
-        'total_assets': round(total_value + user['balance'], 2)
+        'balance': balance,
+        'total_assets': round(total_value + balance, 2)
     }
 
+async def analytics_trades(user_id: str) -> TradeDays:
+    """The user's transactions netted per movie and day, reading only those
+    newer than the settled history kept from the previous request"""
+    settled, history = analytics_history.get(user_id) or (None, NO_TRADES)
+    query = {'user_id': user_id}
+    if settled is not None:
+        query['timestamp'] = {'$gte': settled}
+    transactions_cursor = db.transactions.find(
+        query, {'_id': 0, 'id': 1, 'movie_id': 1, 'type': 1, 'quantity': 1, 'price': 1, 'amount': 1, 'timestamp': 1}
+    ).sort([('timestamp', -1), ('id', -1)])
+    recent = []
+    async for document in iter_transactions(
+        transactions_cursor, transaction_ledger.unflushed(user_id), transaction_archive, user_id, None
+    ):
+        # Everything older is already in the history; stopping here also
+        # keeps a warm read out of the archive
+        if settled is not None and document['timestamp'] < settled:
+            break
+        recent.append(document)
+    
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=ANALYTICS_HISTORY_MARGIN_SECONDS)).isoformat()
+    # recent is newest first: the settling documents are its tail
+    unsettled = next((i for i, doc in enumerate(recent) if doc['timestamp'] < cutoff), len(recent))
+    history = merge(history, summarize(recent[unsettled:]))
+    analytics_history.set(user_id, (cutoff, history), weight=history.nbytes)
+    return merge(history, summarize(recent[:unsettled]))
+
+@api_router.get("/portfolio/analytics")
+async def get_portfolio_analytics(current_user: dict = Depends(get_current_user)):
+    """Daily equity curve, P&L split, volatility and drawdown replayed from the user's transactions"""
+    user_id = current_user['id']
+    cached = analytics_cache.get(user_id)
+    if cached is not None:
+        return FastJSONResponse(cached)
+    generation = analytics_cache.generation(user_id)
+    
+    trades = await analytics_trades(user_id)
+    holdings = await db.portfolio.find(
+        {'user_id': user_id}, {'_id': 0, 'movie_id': 1, 'quantity': 1, 'avg_price': 1}
+    ).to_list(None)
+    
+    movie_ids = list(set(trades.movie_ids) | {h['movie_id'] for h in holdings})
+    movies = await db.movies.find(
+        {'id': {'$in': movie_ids}}, {'_id': 0, 'id': 1, 'title': 1, 'symbol': 1, 'current_price': 1}
+    ).to_list(None)
+    
+    # Closes are only needed from each movie's first trade on
+    today = datetime.now(timezone.utc).date()
+    closes = {}
+    if trades.count:
+        first_days = trades.first_days()
+        earliest = min(first_days.values())
+        first_days = {movie_id: first_days.get(movie_id, earliest) for movie_id in movie_ids}
+        closes = await daily_closes.get(db, first_days, today)
+    
+    analytics = analyze(
+        trades, holdings, closes, {movie['id']: movie for movie in movies}, current_user['balance'], today
+    )
+    analytics_cache.set(user_id, analytics, generation)
+    return FastJSONResponse(analytics)
+
 @api_router.get("/transactions")
-async def get_transactions(current_user: dict = Depends(get_current_user), limit: int = 50):
-    transactions = await db.transactions.find(
-        {'user_id': current_user['id']},
-        {'_id': 0}
-    ).sort('timestamp', -1).to_list(limit)
+async def get_transactions(
+    current_user: dict = Depends(get_current_user),
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    format: Optional[str] = None
+):
+    """Newest first, continuing into the archive once MongoDB runs out.
+    The next page's cursor is returned in X-Next-Cursor"""
+    stream = format == 'ndjson'
+    limit = page_size(limit, stream)
     
-    return transactions
+    # Timestamps are uniform UTC ISO strings, so they sort chronologically;
+    # id breaks ties between transactions written in the same microsecond
+    query = {'user_id': current_user['id']}
+    before = None
+    if cursor:
+        position = decode_cursor(cursor, 'timestamp', 'id')
+        before = (position['timestamp'], position['id'])
+        query['$or'] = [
+            {'timestamp': {'$lt': position['timestamp']}},
+            {'timestamp': position['timestamp'], 'id': {'$lt': position['id']}}
+        ]
+    # Queued documents may already be in MongoDB too, so read enough past
+    # the page that duplicates cannot end it early and skip to the archive
+    pending = transaction_ledger.unflushed(current_user['id'])
+    transactions_cursor = db.transactions.find(query, {'_id': 0}).sort(
+        [('timestamp', -1), ('id', -1)]
+    ).limit(limit + len(pending) if limit else 0)
+    documents = iter_transactions(transactions_cursor, pending, transaction_archive, current_user['id'], before)
+    
+    if stream:
+        return ndjson_response(documents if not limit else take(documents, limit))
+    
+    transactions = [document async for document in take(documents, limit)]
+    headers = {}
+    if len(transactions) == limit:
+        last = transactions[-1]
+        headers['X-Next-Cursor'] = encode_cursor({'timestamp': last['timestamp'], 'id': last['id']})
+    return FastJSONResponse(transactions, headers=headers)
 
 # ==================== MARKET ROUTES ====================
 
 @api_router.get("/market/trending")
 async def get_trending():
-    # Get top gainers
-    gainers = await db.movies.find(
-        {'change_percent': {'$gt': 0}},
-        {'_id': 0}
-    ).sort('change_percent', -1).limit(10).to_list(10)
-    
-    # Get top losers
-    losers = await db.movies.find(
-        {'change_percent': {'$lt': 0}},
-        {'_id': 0}
-    ).sort('change_percent', 1).limit(10).to_list(10)
-    
-    # Get top volume
-    volume_leaders = await db.movies.find(
-        {},
-        {'_id': 0}
-    ).sort('volume', -1).limit(10).to_list(10)
-    
-    return {
-        'gainers': gainers,
-        'losers': losers,
-        'volume_leaders': volume_leaders
-    }
+    # Gainers, losers and volume leaders come straight from the in-memory board
+    return FastJSONResponse(market_board.trending(10))
 
 @api_router.get("/market/stats")
 async def get_market_stats():
-    total_movies = await db.movies.count_documents({})
-    total_users = await db.users.count_documents({})
-    total_transactions = await db.transactions.count_documents({})
-    
-    # Calculate total market cap
-    movies = await db.movies.find({}, {'_id': 0, 'current_price': 1, 'total_shares': 1}).to_list(1000)
-    total_market_cap = sum(m['current_price'] * m['total_shares'] for m in movies)
-    
+    # Maintained on write and reconciled by refresh_market_board()
     return {
-        'total_movies': total_movies,
-        'total_users': total_users,
-        'total_transactions': total_transactions,
-        'total_market_cap': round(total_market_cap, 2)
+        'total_movies': len(market_board),
+        'total_users': market_counters['total_users'],
+        'total_transactions': market_counters['total_transactions'],
+        'total_market_cap': round(market_board.market_cap, 2)
     }
 
+# ==================== LEADERBOARD ====================
+
+@api_router.get("/leaderboard")
+async def get_leaderboard(limit: int = 50, cursor: Optional[str] = None):
+    """Users ranked by net worth (cash, reserved funds and holdings at market).
+    The next page's cursor is returned in X-Next-Cursor"""
+    limit = page_size(limit, False)
+    offset = decode_cursor(cursor, 'offset')['offset'] if cursor else 0
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    entries = net_worth_board.page(offset, limit)
+    headers = {}
+    if len(entries) == limit:
+        headers['X-Next-Cursor'] = encode_cursor({'offset': offset + limit})
+    return FastJSONResponse(entries, headers=headers)
+
+@api_router.get("/leaderboard/me")
+async def get_my_rank(current_user: dict = Depends(get_current_user)):
+    entry = net_worth_board.rank(current_user['id'])
+    if entry is None:
+        # Registered on another worker since the last reload
+        net_worth_board.add_user(current_user['id'], current_user['name'], current_user['balance'])
+        entry = net_worth_board.rank(current_user['id'])
+    return {**entry, 'total_users': len(net_worth_board)}
+
 # ==================== PRICE UPDATE SIMULATION ====================
 
+# Simulator tuning; the defaults reproduce the original +/-2% every 30 seconds
+PRICE_TICK_SECONDS = float(os.environ.get('PRICE_TICK_SECONDS', '30'))
+PRICE_VOLATILITY_PERCENT = float(os.environ.get('PRICE_VOLATILITY_PERCENT', '2'))
+# 'uniform' (the original walk) or 'ou', which pulls prices back towards
+# their listing price by PRICE_MEAN_REVERSION per tick; see price_models.py
+PRICE_WALK_MODEL = os.environ.get('PRICE_WALK_MODEL', 'uniform')
+PRICE_MEAN_REVERSION = float(os.environ.get('PRICE_MEAN_REVERSION', '0.01'))
+price_walk_model = walk_model(PRICE_WALK_MODEL, PRICE_VOLATILITY_PERCENT, PRICE_MEAN_REVERSION)
+PRICE_TICK_BATCH_SIZE = int(os.environ.get('PRICE_TICK_BATCH_SIZE', '5000'))
+
+# Each movie shard is ticked by whichever worker holds its lease, so
+# running several uvicorn workers or nodes never double-walks a movie.
+# Standbys heartbeat three times per TTL, so a dead worker's shards are
+# claimed within TTL + TTL/3 and ticked at once by the new owner. With the
+# TTL defaulting to half the tick interval that is 2/3 of a tick: the
+# dead worker's next tick runs late instead of being skipped.
+SIMULATOR_SHARDS = int(os.environ.get('SIMULATOR_SHARDS', '8'))
+SIMULATOR_LEASE_SECONDS = float(os.environ.get('SIMULATOR_LEASE_SECONDS', str(PRICE_TICK_SECONDS / 2)))
+simulator_leases = ShardLeases(WORKER_ID, SIMULATOR_SHARDS, SIMULATOR_LEASE_SECONDS)
+# Set when this worker gains shards, so it ticks them without sleeping out the interval
+simulator_wakeup = asyncio.Event()
+
+price_rng = np.random.default_rng()
+
+async def apply_random_walk(movies: List[dict]) -> int:
+    """Random-walk one batch of movies as arrays and write it back in one bulk_write"""
+    count = len(movies)
+    prices = np.fromiter((m['current_price'] for m in movies), dtype=np.float64, count=count)
+    initial_prices = np.fromiter((m['initial_price'] for m in movies), dtype=np.float64, count=count)
+    
+    # Random price fluctuation, never below 10% of initial price
+    stepped = price_walk_model.step(prices, initial_prices, price_rng)
+    new_prices = np.round(np.maximum(stepped, initial_prices * FLOOR_FRACTION), 2)
+    changes = np.round(new_prices - prices, 2)
+    change_percents = np.round((new_prices - prices) / prices * 100, 2)
+    
+    operations = [
+        UpdateOne(
+            {'id': movie['id']},
+            {'$set': {'current_price': price, 'change': change, 'change_percent': change_percent}}
+        )
+        for movie, price, change, change_percent in zip(
+            movies, new_prices.tolist(), changes.tolist(), change_percents.tolist()
+        )
+    ]
+    await db.movies.bulk_write(operations, ordered=False)
+    publish_prices([
+        price_delta(movie['id'], price, change, change_percent)
+        for movie, price, change, change_percent in zip(
+            movies, new_prices.tolist(), changes.tolist(), change_percents.tolist()
+        )
+    ])
+    return count
+
+async def run_price_tick(shards: Optional[List[int]] = None) -> dict:
+    """Walk every movie in the given shards (default: all) once, streaming
+    each shard in cursor batches"""
+    started = time.perf_counter()
+    updated = 0
+    filters = [shard_filter(simulator_leases.bounds[shard]) for shard in shards] if shards is not None else [{}]
+    
+    for query in filters:
+        cursor = db.movies.find(
+            query, {'_id': 0, 'id': 1, 'current_price': 1, 'initial_price': 1}
+        ).batch_size(PRICE_TICK_BATCH_SIZE)
+        while True:
+            batch = await cursor.to_list(PRICE_TICK_BATCH_SIZE)
+            if not batch:
+                break
+            updated += await apply_random_walk(batch)
+    
+    duration = time.perf_counter() - started
+    return {'movies': updated, 'duration_ms': round(duration * 1000, 2)}
+
+async def maintain_simulator_leases():
+    """Heartbeat shard leases and log when this worker's share changes"""
+    owned = simulator_leases.owned()
+    while True:
+        try:
+            current = await simulator_leases.heartbeat(db)
+            if current != owned:
+                logging.info(f"Simulator shards held by this worker: {current or 'none'}")
+                if set(current) - set(owned):
+                    simulator_wakeup.set()
+                owned = current
+        except Exception as e:
+            logging.error(f"Error renewing simulator leases: {str(e)}")
+        await asyncio.sleep(SIMULATOR_LEASE_SECONDS / 3)
+
 async def simulate_price_updates():
-    """Background task to simulate market price fluctuations"""
+    """Background task to simulate market price fluctuations on the shards this worker leads"""
     while True:
+        started = time.perf_counter()
         try:
-            movies = await db.movies.find({}, {'_id': 0}).to_list(1000)
-            
-            for movie in movies:
-                # Random price fluctuation (-2% to +2%)
-                change_percent = random.uniform(-2, 2)
-                new_price = movie['current_price'] * (1 + change_percent / 100)
-                
-                # Ensure price doesn't go below 10% of initial price
-                min_price = movie['initial_price'] * 0.1
-                new_price = max(new_price, min_price)
-                
-                change = new_price - movie['current_price']
-                
-                await db.movies.update_one(
-                    {'id': movie['id']},
-                    {
-                        '$set': {
-                            'current_price': round(new_price, 2),
-                            'change': round(change, 2),
-                            'change_percent': round(change_percent, 2)
-                        }
-                    }
-                )
-            
-            await asyncio.sleep(30)  # Update every 30 seconds
+            shards = simulator_leases.owned()
+            if shards:
+                with track_operation('simulator'):
+                    tick = await run_price_tick(shards)
+                net_worth_board.reprice()
+                request_metrics.observe('simulator_tick_seconds', tick['duration_ms'] / 1000)
+                logging.info(f"Price tick updated {tick['movies']} movies in {tick['duration_ms']} ms")
+                if tick['duration_ms'] > PRICE_TICK_SECONDS * 1000:
+                    logging.warning("Price tick took longer than PRICE_TICK_SECONDS")
         except Exception as e:
             logging.error(f"Error in price update simulation: {str(e)}")
-            await asyncio.sleep(30)
+        
+        elapsed = time.perf_counter() - started
+        try:
+            await asyncio.wait_for(simulator_wakeup.wait(), timeout=max(PRICE_TICK_SECONDS - elapsed, 0))
+        except asyncio.TimeoutError:
+            pass
+        simulator_wakeup.clear()
+
+# ==================== MARKET BOARD ====================
+
+async def load_market_board():
+    movies = await db.movies.find({}, {'_id': 0, 'cast': 0, 'synopsis': 0, 'backdrop': 0}).to_list(None)
+    market_board.load(movies)
+
+async def load_net_worth_board():
+    users = await db.users.find({}, {'_id': 0, 'id': 1, 'name': 1, 'balance': 1}).to_list(None)
+    holdings = await db.portfolio.find({}, {'_id': 0, 'user_id': 1, 'movie_id': 1, 'quantity': 1}).to_list(None)
+    movies = await db.movies.find({}, {'_id': 0, 'id': 1, 'current_price': 1}).to_list(None)
+    # Funds held by open limit buys still belong to the user
+    reserved = await db.orders.aggregate([
+        {'$match': {'status': {'$in': ['settling', 'open']}, 'action': 'buy'}},
+        {'$group': {'_id': '$user_id', 'amount': {'$sum': {'$multiply': ['$price', '$remaining_quantity']}}}}
+    ]).to_list(None)
+    # Built on a thread so a large reload never stalls the event loop
+    board = NetWorthBoard()
+    await asyncio.to_thread(
+        board.load, users, holdings, {movie['id']: movie['current_price'] for movie in movies},
+        {entry['_id']: entry['amount'] for entry in reserved}
+    )
+    net_worth_board.replace(board)
+
+async def refresh_net_worth_board():
+    """Periodically reload net worths to pick up trades made by other workers"""
+    while True:
+        await asyncio.sleep(NET_WORTH_REFRESH_SECONDS)
+        try:
+            await load_net_worth_board()
+        except Exception as e:
+            logging.error(f"Error refreshing net worth board: {str(e)}")
+
+async def reprice_net_worth_board():
+    """Re-rank net worths after price moves from trades and other workers"""
+    while True:
+        await asyncio.sleep(NET_WORTH_REPRICE_SECONDS)
+        try:
+            net_worth_board.reprice()
+        except Exception as e:
+            logging.error(f"Error repricing net worth board: {str(e)}")
+
+async def reconcile_market_stats():
+    """Reset the running counters and market cap from the database"""
+    totals = await db.movies.aggregate([
+        {'$group': {
+            '_id': None,
+            'movies': {'$sum': 1},
+            'market_cap': {'$sum': {'$multiply': ['$current_price', '$total_shares']}}
+        }}
+    ]).to_list(1)
+    movies, market_cap = (totals[0]['movies'], totals[0]['market_cap']) if totals else (0, 0.0)
+    if movies != len(market_board):
+        # Listed or removed by another worker or populate_movies.py
+        await load_market_board()
+        response_cache.bump()
+    elif abs(market_cap - market_board.market_cap) > 0.01:
+        logging.info(f"Market cap drifted by {market_cap - market_board.market_cap:.2f}, reconciled")
+        market_board.market_cap = market_cap
+        response_cache.bump(movie_ids=())
+    market_counters['total_users'] = await db.users.count_documents({})
+    market_counters['total_transactions'] = (
+        await db.transactions.count_documents({})
+        + len(transaction_ledger)
+        + await asyncio.to_thread(transaction_archive.count)
+    )
+
+async def refresh_market_board():
+    """Periodically reconcile the market stats with the database"""
+    while True:
+        await asyncio.sleep(MARKET_BOARD_REFRESH_SECONDS)
+        try:
+            await reconcile_market_stats()
+        except Exception as e:
+            logging.error(f"Error refreshing market board: {str(e)}")
+
+# ==================== TRANSACTION LEDGER ====================
+
+async def record_transactions(transaction_docs: List[dict]):
+    """Durably queue settled transactions for the background MongoDB writer"""
+    try:
+        await transaction_ledger.append(transaction_docs)
+    except OSError as e:
+        # The trade has already settled and the documents stay queued, so
+        # the request still succeeds; flushing now makes them durable in Mongo
+        logging.error(f"Error syncing transaction log, flushing early: {str(e)}")
+        request_metrics.inc('transaction_log_sync_failures_total')
+        transaction_ledger.wakeup.set()
+    market_counters['total_transactions'] += len(transaction_docs)
+    net_worth_board.apply_transactions(transaction_docs)
+    for user_id in {doc['user_id'] for doc in transaction_docs}:
+        analytics_cache.invalidate(user_id)
+
+async def flush_transactions():
+    """Background writer; flushes every TRANSACTION_FLUSH_SECONDS, or as soon as a batch is full"""
+    while True:
+        try:
+            await asyncio.wait_for(transaction_ledger.wakeup.wait(), timeout=TRANSACTION_FLUSH_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await transaction_ledger.flush(db.transactions)
+        except Exception as e:
+            logging.error(f"Error flushing transaction ledger: {str(e)}")
+
+async def roll_over_transactions():
+    """Move old transactions into the monthly archive, from the worker holding simulator shard 0"""
+    while True:
+        await asyncio.sleep(TRANSACTION_ARCHIVE_INTERVAL_SECONDS)
+        if 0 not in simulator_leases.owned():
+            continue
+        cutoff = datetime.now(timezone.utc) - timedelta(days=TRANSACTION_ARCHIVE_DAYS)
+        try:
+            moved = await archive_transactions(db.transactions, transaction_archive, cutoff.isoformat())
+            if moved:
+                logging.info(f"Archived {moved} transactions older than {cutoff.date()}")
+        except Exception as e:
+            logging.error(f"Error archiving transactions: {str(e)}")
+
+# ==================== PRICE HISTORY ====================
+
+async def init_price_history():
+    """Create the tick time-series collection"""
+    try:
+        await db.create_collection(
+            'price_ticks',
+            timeseries={'timeField': 'timestamp', 'metaField': 'movie_id', 'granularity': 'seconds'},
+            expireAfterSeconds=PRICE_TICK_RETENTION_DAYS * 86400
+        )
+    except CollectionInvalid:
+        pass  # Already exists
+    except OperationFailure as e:
+        logging.warning(f"Time-series collections unavailable, storing ticks in a plain collection: {str(e)}")
+
+async def flush_price_history():
+    """Write buffered ticks and merge partial candles into stored ones"""
+    ticks, candles = price_history.drain()
+    if ticks:
+        await db.price_ticks.insert_many(ticks, ordered=False)
+    
+    operations = [
+        UpdateOne(
+            {'movie_id': movie_id, 'interval': interval, 'start': to_datetime(start)},
+            [{'$set': {
+                'open': {'$ifNull': ['$open', candle['open']]},
+                'high': {'$max': ['$high', candle['high']]},
+                'low': {'$min': ['$low', candle['low']]},
+                'close': candle['close'],
+                'volume': {'$add': [{'$ifNull': ['$volume', 0]}, candle['volume']]}
+            }}],
+            upsert=True
+        )
+        for movie_id, movie_candles in candles.items()
+        for (interval, start), candle in movie_candles.items()
+    ]
+    if operations:
+        await db.price_candles.bulk_write(operations, ordered=False)
+
+async def persist_price_history():
+    """Background writer flushing price history every PRICE_HISTORY_FLUSH_SECONDS"""
+    while True:
+        await asyncio.sleep(PRICE_HISTORY_FLUSH_SECONDS)
+        try:
+            await flush_price_history()
+        except Exception as e:
+            logging.error(f"Error persisting price history: {str(e)}")
+
+def parse_time(value: Optional[str], name: str) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name} timestamp")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+@api_router.get("/movies/{movie_id}/candles")
+async def get_candles(
+    movie_id: str,
+    interval: str = '1h',
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: int = 500
+):
+    """OHLCV candles for one movie, most recent `limit` within [start, end)"""
+    if interval not in INTERVALS:
+        raise HTTPException(status_code=400, detail=f"Interval must be one of {', '.join(INTERVALS)}")
+    limit = max(1, min(limit, 5000))
+    start_at = parse_time(start, 'start')
+    end_at = parse_time(end, 'end')
+    
+    query = {'movie_id': movie_id, 'interval': interval}
+    if start_at or end_at:
+        query['start'] = {}
+        if start_at:
+            query['start']['$gte'] = start_at
+        if end_at:
+            query['start']['$lt'] = end_at
+    
+    stored = await db.price_candles.find(
+        query, {'_id': 0, 'start': 1, 'open': 1, 'high': 1, 'low': 1, 'close': 1, 'volume': 1}
+    ).sort('start', -1).limit(limit).to_list(limit)
+    
+    candles = {}
+    for candle in stored:
+        opened_at = candle.pop('start').replace(tzinfo=timezone.utc)
+        candles[opened_at] = candle
+    
+    # Fold in partial candles that have not been flushed yet
+    for bucket, partial in price_history.pending_candles(movie_id, interval).items():
+        opened_at = to_datetime(bucket)
+        if (start_at and opened_at < start_at) or (end_at and opened_at >= end_at):
+            continue
+        candles[opened_at] = merge_candle(candles[opened_at], partial) if opened_at in candles else dict(partial)
+    
+    return {
+        'movie_id': movie_id,
+        'interval': interval,
+        'candles': [
+            {'time': opened_at.isoformat(), **candles[opened_at]}
+            for opened_at in sorted(candles)[-limit:]
+        ]
+    }
+
+# ==================== PRICE STREAM ====================
+
+@api_router.get("/stream/prices")
+async def stream_prices(request: Request):
+    """Server-sent events carrying price deltas as they happen"""
+    subscription = price_broadcaster.subscribe()
+    
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    batch = await asyncio.wait_for(
+                        subscription.next_batch(), timeout=PRICE_STREAM_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: prices\ndata: {json.dumps(batch)}\n\n"
+        finally:
+            price_broadcaster.unsubscribe(subscription)
+    
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# ==================== ORDER PERSISTENCE ====================
+
+async def settle_book_fill(fill, movie: dict, maker_remaining: int, taker_status: Optional[str] = None):
+    """Move cash and shares between the two sides of an order book fill"""
+    price = fill.price
+    amount = price * fill.quantity
+    timestamp = datetime.now(timezone.utc).isoformat()
+    
+    # Seller first: unless the reserved shares are still there nothing moves
+    released = await with_retries(lambda: db.portfolio.update_one(
+        {
+            'user_id': fill.sell_user_id,
+            'movie_id': fill.movie_id,
+            'quantity': {'$gte': fill.quantity},
+            'reserved_quantity': {'$gte': fill.quantity}
+        },
+        {'$inc': {'quantity': -fill.quantity, 'reserved_quantity': -fill.quantity}}
+    ))
+    if released.modified_count == 0:
+        raise RuntimeError(f"Seller {fill.sell_user_id} no longer holds {fill.quantity} reserved shares")
+    await db.portfolio.delete_one({
+        'user_id': fill.sell_user_id, 'movie_id': fill.movie_id, 'quantity': {'$lte': 0}
+    })
+    
+    # Buyer: refund any price improvement over the held limit value
+    refund = (fill.buy_limit_ticks - fill.price_ticks) * fill.quantity / 100
+    if refund > 0:
+        await credit_balance(fill.buy_user_id, refund)
+    
+    await credit_holding(fill.buy_user_id, movie, fill.quantity, price)
+    await credit_balance(fill.sell_user_id, amount)
+    
+    await record_transactions([
+        {
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'movie_id': fill.movie_id,
+            'movie_title': movie['title'],
+            'movie_symbol': movie['symbol'],
+            'type': side,
+            'quantity': fill.quantity,
+            'price': price,
+            'amount': amount,
+            'order_id': order_id,
+            'timestamp': timestamp
+        }
+        for user_id, side, order_id in (
+            (fill.buy_user_id, 'BUY', fill.buy_order_id),
+            (fill.sell_user_id, 'SELL', fill.sell_order_id),
+        )
+    ])
+    
+    maker_id, taker_id = (
+        (fill.sell_order_id, fill.buy_order_id) if fill.taker_side == 'buy' else (fill.buy_order_id, fill.sell_order_id)
+    )
+    await with_retries(lambda: db.orders.update_one(
+        {'id': maker_id},
+        {
+            '$set': {'remaining_quantity': maker_remaining, 'status': 'open' if maker_remaining else 'filled'},
+            '$inc': {'filled_quantity': fill.quantity}
+        }
+    ))
+    # A taker cancelled while settling keeps its 'cancelled'
+    await with_retries(lambda: db.orders.update_one({'id': taker_id}, [{'$set': {
+        'filled_quantity': {'$add': ['$filled_quantity', fill.quantity]},
+        'status': {'$cond': [{'$eq': ['$status', 'settling']}, taker_status or 'settling', '$status']}
+    }}]))
+    
+    # The last traded price becomes the market price
+    previous = await db.movies.find_one({'id': fill.movie_id}, {'_id': 0, 'current_price': 1})
+    change = round(price - previous['current_price'], 2) if previous else 0.0
+    change_percent = round(change / previous['current_price'] * 100, 2) if previous else 0.0
+    await db.movies.update_one(
+        {'id': fill.movie_id},
+        {
+            '$set': {
+                'current_price': price,
+                'change': change,
+                'change_percent': change_percent
+            },
+            '$inc': {'volume': fill.quantity}
+        }
+    )
+    market_board.add_volume(fill.movie_id, fill.quantity)
+    publish_prices([price_delta(fill.movie_id, price, change, change_percent)], {fill.movie_id: fill.quantity})
+
+async def accept_order(order: dict):
+    """Record the outcome of matching an order that was just submitted.
+    One that filled stays 'settling' while its fills are written"""
+    if order['filled_quantity']:
+        update = {'status': 'settling', 'remaining_quantity': order['remaining_quantity']}
+    else:
+        update = {'status': 'open' if order['remaining_quantity'] else 'filled', 'remaining_quantity': order['remaining_quantity']}
+    await with_retries(lambda: db.orders.update_one({'id': order['id'], 'status': 'matching'}, {'$set': update}))
+
+async def release_order_hold(order: dict):
+    """Cancel a live order and return the unfilled part of its reservation"""
+    cancelled = await with_retries(lambda: db.orders.update_one(
+        {'id': order['id'], 'status': {'$in': LIVE_ORDER_STATUSES}},
+        {
+            '$set': {'status': 'cancelled', 'remaining_quantity': order['remaining_quantity']},
+            '$unset': {'cancel_requested': ''}
+        }
+    ))
+    # Only the call that cancelled the order gives the hold back
+    if cancelled.modified_count:
+        await release_hold(order, order['remaining_quantity'])
+
+async def dead_letter_order_event(event: tuple, error: Exception):
+    """Park an order event that could not be applied in order_event_failures"""
+    kind = event[0]
+    if kind == 'fill':
+        payload = {'fill': asdict(event[1]), 'movie': event[2], 'maker_remaining': event[3], 'taker_status': event[4]}
+    else:
+        payload = {'order': event[1]}
+    request_metrics.inc('order_events_dead_lettered_total', kind=kind)
+    try:
+        await with_retries(lambda: db.order_event_failures.insert_one({
+            'id': str(uuid.uuid4()),
+            'kind': kind,
+            **payload,
+            'error': str(error),
+            'failed_at': datetime.now(timezone.utc).isoformat()
+        }))
+    except Exception as e:
+        logging.critical(f"Could not dead-letter order event {kind} {payload}: {str(e)}")
+
+async def process_order_events():
+    """Background writer applying matching engine output to MongoDB in order.
+
+    Each write retries transient errors. An event that still fails is moved
+    to order_event_failures for replay instead of being dropped."""
+    while True:
+        event = await order_events.get()
+        try:
+            kind = event[0]
+            if kind == 'accept':
+                await accept_order(event[1])
+            elif kind == 'fill':
+                await settle_book_fill(*event[1:])
+            elif kind == 'cancel':
+                await release_order_hold(event[1])
+        except Exception as e:
+            logging.error(f"Error persisting order event {event[0]}: {str(e)}")
+            await dead_letter_order_event(event, e)
+        finally:
+            order_events.task_done()
+
+async def recover_new_order(order: dict):
+    """Settle an order whose worker stopped between writing it and handing it on"""
+    collection, holder = order_holder(order)
+    if await collection.count_documents({**holder, 'order_holds': order['id']}):
+        # The hold was taken: queue the order as its worker would have
+        await hand_off_order(order)
+    else:
+        await db.orders.update_one({'id': order['id'], 'status': 'new'}, {'$set': {'status': 'rejected'}})
+
+async def sweep_order_shard(shard: int):
+    """Match orders routed here by other workers and serve cancel requests for one shard"""
+    movies = shard_filter(order_book_leases.bounds[shard], 'movie_id')
+    
+    stale = (datetime.now(timezone.utc) - timedelta(seconds=ORDER_RECOVERY_SECONDS)).isoformat()
+    for order in await db.orders.find(
+        {'status': 'new', **movies, 'created_at': {'$lt': stale}}, {'_id': 0}
+    ).to_list(None):
+        await recover_new_order(order)
+    
+    for order in await db.orders.find(
+        {'status': 'pending', **movies}, {'_id': 0}
+    ).sort('created_at', 1).to_list(None):
+        await claim_and_submit(order)
+    
+    for order in await db.orders.find(
+        {'cancel_requested': True, **movies, 'status': {'$in': LIVE_ORDER_STATUSES}}, {'_id': 0}
+    ).to_list(None):
+        resting = matching_engine.get_order(order['id'])
+        if resting is not None:
+            matching_engine.cancel(order['id'])
+            order_events.put_nowait(('cancel', resting.to_dict()))
+        elif order['status'] == 'pending':
+            order_events.put_nowait(('cancel', order))
+        # 'matching': its accept is still queued; the next sweep sees it open
+
+async def match_routed_orders():
+    """Background task sweeping the order book shards this worker owns"""
+    while True:
+        try:
+            for shard in sorted(order_book_shards):
+                if shard in order_book_leases.owned():
+                    await sweep_order_shard(shard)
+        except Exception as e:
+            logging.error(f"Error matching routed orders: {str(e)}")
+        await asyncio.sleep(ORDER_POLL_SECONDS)
+
+async def release_unsettled_orders(movies: dict) -> int:
+    """Release the holds behind fills that a previous owner matched but never wrote.
+
+    Only safe while no fill of these movies can be queued anywhere, as when
+    their shard is being loaded. The lost fills never moved anything, so
+    their makers are still resting; the taker keeps what did settle."""
+    released = 0
+    for order in await db.orders.find({'status': 'settling', **movies}, {'_id': 0}).to_list(None):
+        unsettled = order['quantity'] - order['remaining_quantity'] - order['filled_quantity']
+        if order['remaining_quantity']:
+            status = 'open'
+        else:
+            status = 'filled' if unsettled <= 0 else 'cancelled'
+        updated = await db.orders.update_one({'id': order['id'], 'status': 'settling'}, {'$set': {'status': status}})
+        if updated.modified_count and unsettled > 0:
+            await release_hold(order, unsettled)
+            released += 1
+    return released
+
+async def load_order_book_shard(shard: int):
+    """Take over a shard's books: release holds of lost fills, rest its open
+    orders, then match its unmatched ones"""
+    movies = shard_filter(order_book_leases.bounds[shard], 'movie_id')
+    released = await release_unsettled_orders(movies)
+    if released:
+        logging.warning(f"Order book shard {shard}: released the holds of {released} orders with unwritten fills")
+    resting = await db.orders.find({'status': 'open', **movies}, {'_id': 0}).to_list(None)
+    matching_engine.restore([order_from_document(order) for order in resting])
+    order_book_shards.add(shard)
+    
+    # Left 'matching' by a previous owner that died before persisting the outcome
+    unmatched = await db.orders.find({'status': 'matching', **movies}, {'_id': 0}).sort('created_at', 1).to_list(None)
+    for order in unmatched:
+        submit_order(order)
+    if resting or unmatched:
+        logging.info(f"Order book shard {shard}: restored {len(resting)} resting and rematched {len(unmatched)} orders")
+
+async def hand_back_order_book_shards(shards: List[int]):
+    """Stop matching the given shards and flush their queued writes before
+    another worker can load them"""
+    order_book_shards.difference_update(shards)
+    matching_engine.drop([
+        movie_id for movie_id in list(matching_engine.books)
+        if order_book_leases.shard_of(movie_id) in shards
+    ])
+    await order_events.join()
+
+async def renew_order_book_leases():
+    """Heartbeat the order book leases and load or drop books to match"""
+    owned = set(await order_book_leases.heartbeat(db, before_release=hand_back_order_book_shards))
+    lost = order_book_shards - owned
+    if lost:
+        # Lapsed rather than handed back: nothing left to flush them against
+        await hand_back_order_book_shards(sorted(lost))
+    gained = sorted(owned - order_book_shards)
+    for shard in gained:
+        await load_order_book_shard(shard)
+    if lost or gained:
+        logging.info(f"Order book shards held by this worker: {sorted(order_book_shards) or 'none'}")
+
+async def maintain_order_book_leases():
+    while True:
+        await asyncio.sleep(ORDER_BOOK_LEASE_SECONDS / 3)
+        try:
+            await renew_order_book_leases()
+        except Exception as e:
+            logging.error(f"Error renewing order book leases: {str(e)}")
 
 # ==================== APP SETUP ====================
 
 @app.on_event("startup")
 async def startup_event():
-    # Start price update simulation
+    await ensure_indexes(db)
+    # Guarded upserts rely on these to fail instead of inserting duplicates
+    missing = await missing_unique_indexes(db)
+    if missing:
+        raise RuntimeError(f"Missing unique indexes: {'; '.join(missing)}")
+    if INDEX_AUDIT_ON_STARTUP:
+        failures = await audit_query_plans(db)
+        if failures:
+            raise RuntimeError(f"Queries without an index: {'; '.join(failures)}")
+    
+    # Replay transactions left in the logs of workers that died unflushed.
+    # The ledger must be open before anything below can settle a trade
+    recovered = transaction_ledger.open()
+    if recovered:
+        await transaction_ledger.flush(db.transactions)
+        logging.info(f"Recovered {recovered} transactions from the write-ahead log")
+    asyncio.create_task(flush_transactions())
+    if TRANSACTION_ARCHIVE_DAYS > 0:
+        asyncio.create_task(roll_over_transactions())
+    
+    # Lease order book shards and rebuild their books before matching
+    asyncio.create_task(process_order_events())
+    await renew_order_book_leases()
+    asyncio.create_task(maintain_order_book_leases())
+    asyncio.create_task(match_routed_orders())
+    
+    await load_market_board()
+    await reconcile_market_stats()
+    asyncio.create_task(refresh_market_board())
+    
+    await load_net_worth_board()
+    asyncio.create_task(refresh_net_worth_board())
+    asyncio.create_task(reprice_net_worth_board())
+    
+    await init_price_history()
+    asyncio.create_task(persist_price_history())
+    if price_relay is not None:
+        asyncio.create_task(relay_prices())
+    
+    # Start price update simulation on the shards this worker wins
+    await simulator_leases.heartbeat(db)
+    asyncio.create_task(maintain_simulator_leases())
     asyncio.create_task(simulate_price_updates())
     logging.info("Bollywood Sensex API started")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Stop matching, then flush pending order book writes before closing
+    # the connection and handing the books to the remaining workers
+    order_book_shards.clear()
+    try:
+        await asyncio.wait_for(order_events.join(), timeout=10)
+    except asyncio.TimeoutError:
+        logging.error(f"Shutting down with {order_events.qsize()} unpersisted order events")
+    try:
+        await transaction_ledger.flush(db.transactions)
+    except Exception as e:
+        logging.error(f"Error flushing transaction ledger on shutdown: {str(e)}")
+    transaction_ledger.close()
+    try:
+        await flush_price_history()
+    except Exception as e:
+        logging.error(f"Error flushing price history on shutdown: {str(e)}")
+    try:
+        await simulator_leases.release_all(db)
+    except Exception as e:
+        logging.error(f"Error releasing simulator leases on shutdown: {str(e)}")
+    try:
+        await order_book_leases.release_all(db)
+    except Exception as e:
+        logging.error(f"Error releasing order book leases on shutdown: {str(e)}")
+    await tmdb_client.close()
+    auth_executor.shutdown(wait=False)
     client.close()
 
 app.include_router(api_router)
 
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache, paths=CACHED_PATHS)
+if COMPRESSION_MINIMUM_SIZE > 0:
+    app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE)
+
+app.add_middleware(RequestMetricsMiddleware, metrics=request_metrics)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
+    expose_headers=['X-Next-Cursor', 'ETag', 'Server-Timing'],
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
@@ -636,3 +2244,6 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+
+# httpx logs full request URLs at INFO, which would include the TMDb api_key
+logging.getLogger('httpx').setLevel(logging.WARNING)
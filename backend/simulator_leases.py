@@ -0,0 +1,125 @@
+"""Mongo leases that spread per-movie work across workers.
+
+Movies are split into shards by contiguous ranges of their uuid ids, so
+every shard is a range scan on the id index. Each shard has a lease
+document in <name>_leases, and a worker only works on the shards it
+holds: the price simulator ticks them, and the order book matches their
+limit orders. Workers also heartbeat a presence document in
+<name>_workers so that each one claims a fair share (ceil(shards / live
+workers)) and hands back the rest when another worker joins. A lease
+that is not renewed expires after `ttl` seconds, and the next heartbeat
+of any worker with room picks it up.
+"""
+import math
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+
+def shard_bounds(shards: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    """(lower, upper) id bounds per shard, split on the first two hex digits.
+    The outer bounds are open so ids that are not uuids still land somewhere."""
+    cuts = [format(k * 256 // shards, '02x') for k in range(1, shards)]
+    return list(zip([None] + cuts, cuts + [None]))
+
+
+def shard_filter(bounds: Tuple[Optional[str], Optional[str]], field: str = 'id') -> dict:
+    lower, upper = bounds
+    condition = {}
+    if lower is not None:
+        condition['$gte'] = lower
+    if upper is not None:
+        condition['$lt'] = upper
+    return {field: condition} if condition else {}
+
+
+class ShardLeases:
+    def __init__(self, owner: str, shards: int, ttl: float, name: str = 'simulator'):
+        if not 1 <= shards <= 256:
+            raise ValueError('shards must be between 1 and 256')
+        self.owner = owner
+        self.shards = shards
+        self.ttl = ttl
+        self.bounds = shard_bounds(shards)
+        self._cuts = [lower for lower, _ in self.bounds[1:]]
+        self.leases = f'{name}_leases'
+        self.workers = f'{name}_workers'
+        # shard -> monotonic time our lease runs out, measured from before
+        # the renewal was sent so we always stop ahead of the stored expiry
+        self._deadlines: Dict[int, float] = {}
+
+    def owned(self) -> List[int]:
+        now = time.monotonic()
+        return sorted(shard for shard, deadline in self._deadlines.items() if deadline > now)
+
+    def shard_of(self, key: str) -> int:
+        return bisect_right(self._cuts, key)
+
+    def owns(self, key: str) -> bool:
+        deadline = self._deadlines.get(self.shard_of(key))
+        return deadline is not None and deadline > time.monotonic()
+
+    async def heartbeat(self, db, before_release: Optional[Callable[[List[int]], Awaitable]] = None) -> List[int]:
+        """Renew held leases, rebalance to a fair share, and return the shards held.
+
+        before_release is awaited with the shards about to be handed back,
+        while they are still leased to this worker."""
+        sent = time.monotonic()
+        now = datetime.now(timezone.utc)
+        expires_at = now + timedelta(seconds=self.ttl)
+
+        await db[self.workers].update_one(
+            {'_id': self.owner}, {'$set': {'expires_at': expires_at}}, upsert=True
+        )
+        live_workers = await db[self.workers].count_documents({'expires_at': {'$gt': now}})
+        fair_share = math.ceil(self.shards / max(live_workers, 1))
+
+        held = sorted(self._deadlines)
+        if held[fair_share:] and before_release is not None:
+            await before_release(held[fair_share:])
+        for shard in held[fair_share:]:
+            await self.release(db, shard)
+
+        taken = {
+            lease['_id'] for lease in await db[self.leases].find(
+                {'owner': {'$ne': self.owner}, 'expires_at': {'$gt': now}}, {'_id': 1}
+            ).to_list(None)
+        }
+        for shard in held[:fair_share]:
+            if await self._claim(db, shard, now, expires_at):
+                self._deadlines[shard] = sent + self.ttl
+            else:
+                # Lapsed while we were stalled and another worker took it
+                del self._deadlines[shard]
+        for shard in range(self.shards):
+            if len(self._deadlines) >= fair_share:
+                break
+            if shard not in self._deadlines and shard not in taken:
+                if await self._claim(db, shard, now, expires_at):
+                    self._deadlines[shard] = sent + self.ttl
+        return self.owned()
+
+    async def _claim(self, db, shard: int, now: datetime, expires_at: datetime) -> bool:
+        try:
+            await db[self.leases].update_one(
+                {'_id': shard, '$or': [{'owner': self.owner}, {'expires_at': {'$lte': now}}]},
+                {'$set': {'owner': self.owner, 'expires_at': expires_at}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # The upsert collided with a lease another worker still holds
+            return False
+
+    async def release(self, db, shard: int):
+        self._deadlines.pop(shard, None)
+        await db[self.leases].delete_one({'_id': shard, 'owner': self.owner})
+
+    async def release_all(self, db):
+        """Give every lease back so other workers take over on their next heartbeat"""
+        self._deadlines.clear()
+        await db[self.leases].delete_many({'owner': self.owner})
+        await db[self.workers].delete_one({'_id': self.owner})
@@ -0,0 +1,92 @@
+"""Async TMDb client with a pooled connection and bounded concurrency.
+
+All requests share one httpx.AsyncClient, so connections are reused
+across discover and detail calls. A semaphore caps how many requests
+are in flight, and 429/5xx responses are retried with backoff, honouring
+TMDb's Retry-After header. The base URL is configurable so the whole
+sync path can run against a local stub server.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import httpx
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TMDbClient:
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        max_concurrency: int = 8,
+        max_retries: int = 3,
+        timeout: float = 10.0,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            transport=transport,
+        )
+
+    async def close(self):
+        await self._client.aclose()
+
+    @staticmethod
+    def _retry_delay(response: Optional[httpx.Response], attempt: int) -> float:
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return max(float(retry_after), 0.0)
+                except ValueError:
+                    pass
+        return 0.5 * 2 ** attempt
+
+    async def get(self, path: str, params: Optional[dict] = None) -> Optional[dict]:
+        """GET a TMDb endpoint, returning the JSON body or None on failure"""
+        params = {'api_key': self.api_key, **(params or {})}
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                async with self._semaphore:
+                    response = await self._client.get(path, params=params)
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in RETRY_STATUSES:
+                    logging.error(f"TMDb {path} returned {response.status_code}")
+                    return None
+            except httpx.HTTPError as e:
+                logging.warning(f"TMDb {path} failed: {str(e)}")
+
+            if attempt < self.max_retries:
+                # Sleep outside the semaphore so other calls keep flowing
+                await asyncio.sleep(self._retry_delay(response, attempt))
+
+        logging.error(f"TMDb {path} gave up after {self.max_retries + 1} attempts")
+        return None
+
+    async def discover_hindi(self, pages: int) -> List[dict]:
+        """Popular Hindi movies from the first few discover pages, deduplicated"""
+        results = await asyncio.gather(*(
+            self.get('/discover/movie', {
+                'with_original_language': 'hi',
+                'sort_by': 'popularity.desc',
+                'page': page
+            })
+            for page in range(1, pages + 1)
+        ))
+        movies: Dict[int, dict] = {}
+        for result in results:
+            for movie in (result or {}).get('results', []):
+                movies.setdefault(movie['id'], movie)
+        return list(movies.values())
+
+    async def movie_details(self, tmdb_id: int) -> Optional[dict]:
+        return await self.get(f'/movie/{tmdb_id}', {'append_to_response': 'credits'})
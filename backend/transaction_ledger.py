@@ -0,0 +1,405 @@
+"""Write-behind ledger for trade transactions, plus a cold archive.
+
+Trades append their transaction documents to a local write-ahead log and
+return once it is fsynced. A background task then moves them into Mongo
+with insert_many, in batches. Each flush rotates the log to a new
+segment, and a segment is only deleted once all of its documents are in
+Mongo. Live segments are flock()ed by the worker that owns them, so at
+startup a worker replays only the segments left behind by dead
+processes. transactions.id is unique, so replaying documents that were
+already inserted is harmless.
+
+TransactionArchive keeps transactions that are older than the rollover
+cutoff, one compressed JSON Lines file per month: zstd when the
+zstandard package is installed, gzip otherwise. Each month has a small
+index of its count and per-user frame offsets. iter_transactions()
+pages through the queue, Mongo and the archive as a single newest-first
+sequence.
+"""
+import asyncio
+import fcntl
+import gzip
+import json
+import logging
+import os
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from json_responses import dumps
+from ttl_cache import TTLCache
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional codec
+    zstandard = None
+
+# (timestamp, id): the keyset /api/transactions pages on, newest first
+Position = Tuple[str, str]
+
+
+def sort_key(doc: dict) -> Position:
+    return doc['timestamp'], doc['id']
+
+
+async def insert_new(collection, docs: List[dict]):
+    """insert_many that treats already-present ids as inserted"""
+    try:
+        # Copies: insert_many adds _id to the documents it is given
+        await collection.insert_many([dict(doc) for doc in docs], ordered=False)
+    except BulkWriteError as e:
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+
+
+class Segment:
+    def __init__(self, path: Path, file, docs: List[dict]):
+        self.path = path
+        self.file = file
+        self.docs = docs
+
+    def close(self):
+        self.file.close()
+        self.path.unlink(missing_ok=True)
+
+
+def lock_segment(path: Path, mode: str):
+    """Open and exclusively lock a segment; None if a live worker holds it"""
+    file = open(path, mode)
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        file.close()
+        return None
+    return file
+
+
+class TransactionLedger:
+    def __init__(self, wal_dir: Path, batch_size: int):
+        self.wal_dir = Path(wal_dir)
+        self.batch_size = batch_size
+        # Set once a full batch is waiting, to flush ahead of the timer
+        self.wakeup = asyncio.Event()
+        self._active: Optional[Segment] = None
+        self._sealed: List[Segment] = []
+        self._sequence = 0
+        self._written = 0
+        self._synced = 0
+        self._sync_task: Optional[asyncio.Future] = None
+        self._flushing = asyncio.Lock()
+
+    def __len__(self) -> int:
+        if self._active is None:
+            return 0
+        return sum(len(segment.docs) for segment in self._sealed + [self._active])
+
+    def open(self) -> int:
+        """Adopt segments left by dead workers and start a new one; returns documents recovered"""
+        self.wal_dir.mkdir(parents=True, exist_ok=True)
+        recovered = 0
+        for path in sorted(self.wal_dir.glob('*.wal')):
+            file = lock_segment(path, 'rb')
+            if file is None:
+                continue
+            docs = []
+            for line in file:
+                try:
+                    docs.append(json.loads(line))
+                except ValueError:
+                    pass  # torn final write from a crash; it was never acknowledged
+            self._sealed.append(Segment(path, file, docs))
+            recovered += len(docs)
+        self._rotate()
+        return recovered
+
+    def _rotate(self):
+        if self._active is not None:
+            if not self._active.docs:
+                return
+            self._sealed.append(self._active)
+        self._sequence += 1
+        path = self.wal_dir / f'{os.getpid()}-{os.urandom(4).hex()}-{self._sequence:08d}.wal'
+        self._active = Segment(path, lock_segment(path, 'ab'), [])
+
+    async def append(self, docs: List[dict]):
+        """Return once the documents are fsynced to the write-ahead log"""
+        if self._active is None:
+            raise RuntimeError('Transaction ledger is not open')
+        self._active.file.write(b''.join(dumps(doc) + b'\n' for doc in docs))
+        self._active.docs.extend(docs)
+        self._written += 1
+        if len(self) >= self.batch_size:
+            self.wakeup.set()
+        await self._sync()
+
+    async def _sync(self):
+        # Group commit: one fsync covers every append written before it started
+        target = self._written
+        while self._synced < target:
+            if self._sync_task is None:
+                self._sync_task = asyncio.ensure_future(self._fsync())
+            await asyncio.shield(self._sync_task)
+
+    async def _fsync(self):
+        # Only the active segment takes writes; flush() syncs before rotating
+        target = self._written
+        file = self._active.file
+        try:
+            file.flush()
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, file.fileno())
+            self._synced = target
+        finally:
+            # A failed sync fails every append waiting on it; the next
+            # append or flush tries again
+            self._sync_task = None
+
+    async def flush(self, collection) -> int:
+        """Insert every queued document into Mongo; returns how many were written"""
+        async with self._flushing:
+            self.wakeup.clear()
+            # Nothing awaits between the last check and the rotation, so the
+            # sealed segment is fully synced and never written again
+            try:
+                while self._synced < self._written:
+                    await self._sync()
+            except OSError as e:
+                # Its appends have failed; the documents still go to Mongo
+                # below, which is where they are durable
+                logging.error(f"Error syncing transaction log: {str(e)}")
+            self._rotate()
+            flushed = 0
+            while self._sealed:
+                segment = self._sealed[0]
+                for start in range(0, len(segment.docs), self.batch_size):
+                    await insert_new(collection, segment.docs[start:start + self.batch_size])
+                segment.close()
+                self._sealed.pop(0)
+                flushed += len(segment.docs)
+            return flushed
+
+    def unflushed(self, user_id: str) -> List[dict]:
+        """Queued documents of one user, for reads that must see their own trades"""
+        return [
+            doc for segment in self._sealed + [self._active]
+            for doc in segment.docs if doc['user_id'] == user_id
+        ]
+
+    def close(self):
+        """Release the segments; anything unflushed is replayed by the next worker to start"""
+        if self._active is None:
+            return
+        if not self._active.docs:
+            self._active.close()
+        for segment in self._sealed + [self._active]:
+            segment.file.close()
+
+
+def decompress(path: Path, raw: bytes) -> bytes:
+    """Decode every frame (zstd) or member (gzip) of an archive file or slice"""
+    if not path.name.endswith('.zst'):
+        return gzip.decompress(raw)
+    if zstandard is None:
+        raise RuntimeError(f"{path.name} needs the zstandard package")
+    chunks = []
+    while raw:
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        chunks.append(decompressor.decompress(raw))
+        raw = decompressor.unused_data
+    return b''.join(chunks)
+
+
+def parse_lines(data: bytes) -> List[dict]:
+    return [json.loads(line) for line in data.splitlines() if line]
+
+
+class TransactionArchive:
+    """Each month file holds one compressed frame per user, and a sidecar
+    transactions-YYYY-MM.index.json records the month's document count
+    and where each user's frame starts, so neither counting nor a single
+    user's read has to decompress the whole month. Months written before
+    the index existed are read whole and cached."""
+
+    def __init__(self, archive_dir: Path, cache_months: int = 4, cache_seconds: float = 300):
+        self.archive_dir = Path(archive_dir)
+        self.suffix = '.jsonl.zst' if zstandard is not None else '.jsonl.gz'
+        # Decompressed unindexed months, by user and newest first
+        self._months = TTLCache(cache_months, cache_seconds)
+        # file -> (mtime_ns, document count) for unindexed months
+        self._counts: Dict[Path, Tuple[int, int]] = {}
+        # file -> (mtime_ns, index or None)
+        self._indexes: Dict[Path, Tuple[int, Optional[dict]]] = {}
+
+    def months(self) -> Dict[str, Path]:
+        """month ('YYYY-MM') -> archive file, newest first"""
+        if not self.archive_dir.is_dir():
+            return {}
+        files = {}
+        for path in self.archive_dir.glob('transactions-*.jsonl.*'):
+            if path.name.endswith(('.zst', '.gz')):
+                files[path.name[len('transactions-'):len('transactions-YYYY-MM')]] = path
+        return dict(sorted(files.items(), reverse=True))
+
+    def index_path(self, month: str) -> Path:
+        return self.archive_dir / f'transactions-{month}.index.json'
+
+    def index(self, path: Path) -> Optional[dict]:
+        """The month's index, or None if it is missing or describes another file"""
+        stat = path.stat()
+        cached = self._indexes.get(path)
+        if cached is not None and cached[0] == stat.st_mtime_ns:
+            return cached[1]
+        try:
+            index = json.loads(self.index_path(path.name[len('transactions-'):len('transactions-YYYY-MM')]).read_bytes())
+        except (OSError, ValueError):
+            index = None
+        # A crash between replacing the month and its index leaves an index
+        # for the previous file behind
+        if index is not None and (index.get('file') != path.name or index.get('size') != stat.st_size):
+            index = None
+        self._indexes[path] = (stat.st_mtime_ns, index)
+        return index
+
+    def read_month(self, path: Path) -> List[dict]:
+        return parse_lines(decompress(path, path.read_bytes()))
+
+    def write_month(self, month: str, docs: List[dict]) -> int:
+        """Merge documents into a month's file; returns the file's document count"""
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        existing = self.months().get(month)
+        merged = {doc['id']: doc for doc in (self.read_month(existing) if existing else [])}
+        merged.update((doc['id'], doc) for doc in docs)
+        by_user: Dict[str, List[dict]] = {}
+        for doc in sorted(merged.values(), key=sort_key, reverse=True):
+            by_user.setdefault(doc['user_id'], []).append(doc)
+
+        frames = []
+        users = {}
+        offset = 0
+        for user_id, user_docs in sorted(by_user.items()):
+            data = b''.join(dumps(doc) + b'\n' for doc in user_docs)
+            if zstandard is not None:
+                frame = zstandard.ZstdCompressor(level=10).compress(data)
+            else:
+                frame = gzip.compress(data, compresslevel=9)
+            frames.append(frame)
+            users[user_id] = [offset, len(frame)]
+            offset += len(frame)
+
+        path = self.archive_dir / f'transactions-{month}{self.suffix}'
+        index = {'file': path.name, 'size': offset, 'count': len(merged), 'users': users}
+        for target, data in ((path, b''.join(frames)), (self.index_path(month), dumps(index))):
+            temporary = target.with_name(target.name + '.tmp')
+            with open(temporary, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, target)
+        if existing is not None and existing != path:
+            existing.unlink()
+        return len(merged)
+
+    def count(self) -> int:
+        total = 0
+        for path in self.months().values():
+            index = self.index(path)
+            if index is not None:
+                total += index['count']
+                continue
+            mtime = path.stat().st_mtime_ns
+            cached = self._counts.get(path)
+            if cached is None or cached[0] != mtime:
+                cached = self._counts[path] = (mtime, len(self.read_month(path)))
+            total += cached[1]
+        return total
+
+    def user_month(self, month: str, user_id: str) -> List[dict]:
+        """One user's documents from a month, newest first"""
+        path = self.months().get(month)
+        if path is None:
+            return []
+        index = self.index(path)
+        if index is not None:
+            if user_id not in index['users']:
+                return []
+            offset, length = index['users'][user_id]
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return parse_lines(decompress(path, f.read(length)))
+
+        key = (path, path.stat().st_mtime_ns)
+        by_user = self._months.get(key)
+        if by_user is None:
+            by_user = {}
+            for doc in self.read_month(path):
+                by_user.setdefault(doc['user_id'], []).append(doc)
+            for docs in by_user.values():
+                docs.sort(key=sort_key, reverse=True)
+            self._months.set(key, by_user)
+        return by_user.get(user_id, [])
+
+
+async def iter_transactions(cursor, pending: List[dict], archive: TransactionArchive,
+                            user_id: str, before: Optional[Position]) -> AsyncIterator[dict]:
+    """One user's transactions newest first: the Mongo cursor merged with
+    documents still queued in the ledger, then the archived months.
+
+    Keys must strictly decrease, which drops a queued document once its
+    flush has reached the cursor, and an archived one whose delete from
+    Mongo has not run yet."""
+    pending = sorted(
+        (doc for doc in pending if before is None or sort_key(doc) < before), key=sort_key, reverse=True
+    )
+    last = before
+
+    def fresh(doc: dict) -> bool:
+        nonlocal last
+        key = sort_key(doc)
+        if last is not None and key >= last:
+            return False
+        last = key
+        return True
+
+    async for doc in cursor:
+        while pending and sort_key(pending[0]) > sort_key(doc):
+            queued = pending.pop(0)
+            if fresh(queued):
+                yield queued
+        if fresh(doc):
+            yield doc
+    for doc in pending:
+        if fresh(doc):
+            yield doc
+
+    for month in archive.months():
+        if last is not None and month > last[0][:7]:
+            continue
+        for doc in await asyncio.to_thread(archive.user_month, month, user_id):
+            if fresh(doc):
+                yield doc
+
+
+async def archive_transactions(collection, archive: TransactionArchive, before: str) -> int:
+    """Move transactions with a timestamp older than `before` into the archive,
+    one month at a time; returns how many were moved"""
+    moved = 0
+    while True:
+        oldest = await collection.find_one(
+            {'timestamp': {'$lt': before}}, {'_id': 0, 'timestamp': 1}, sort=[('timestamp', 1)]
+        )
+        if oldest is None:
+            return moved
+        month = oldest['timestamp'][:7]
+        # First instant of the following month, as a comparable ISO prefix
+        year, number = int(month[:4]), int(month[5:7])
+        next_month = f'{year + number // 12:04d}-{number % 12 + 1:02d}'
+        docs = await collection.find(
+            {'timestamp': {'$gte': month, '$lt': min(next_month, before)}}, {'_id': 0}
+        ).to_list(None)
+        await asyncio.to_thread(archive.write_month, month, docs)
+        # Deleted only after the month file is durable; a crash in between
+        # re-archives the same ids, which write_month de-duplicates
+        ids = [doc['id'] for doc in docs]
+        for start in range(0, len(ids), 10000):
+            await collection.delete_many({'id': {'$in': ids[start:start + 10000]}})
+        moved += len(docs)
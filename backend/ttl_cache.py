@@ -0,0 +1,90 @@
+"""A small LRU cache whose entries also expire after a fixed TTL.
+
+Used by server.py to keep recently authenticated users in memory. An
+optional maxweight also bounds the summed weight of the entries, for
+values whose size varies (set() takes each value's weight). The cache
+is per process; writes made by other workers only show up once the
+entry expires, so the TTL bounds how stale a cached document can be.
+
+Invalidation is scoped per key: each key hashes to one of a fixed number
+of generation counters, so a write only discards fills of keys that
+share its stripe instead of every fill in flight.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+GENERATION_STRIPES = 4096
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float, maxweight: Optional[int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxweight = maxweight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        # Bumped by invalidations of the keys in each stripe so a read that
+        # raced a write can tell its result may be stale (see set())
+        self._generations = [0] * GENERATION_STRIPES
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._discard(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def generation(self, key: Hashable) -> int:
+        """Take before reading the value to set() for `key`"""
+        return self._generations[hash(key) % GENERATION_STRIPES]
+
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None, weight: int = 1):
+        """Store a value; skipped if `key` was invalidated since `generation`"""
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        if generation is not None and generation != self.generation(key):
+            return
+        self._discard(key)
+        if self.maxweight is not None and weight > self.maxweight:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value, weight)
+        self.weight += weight
+        while len(self._entries) > self.maxsize or (self.maxweight is not None and self.weight > self.maxweight):
+            self.weight -= self._entries.popitem(last=False)[1][2]
+
+    def invalidate(self, key: Hashable):
+        self._generations[hash(key) % GENERATION_STRIPES] += 1
+        self._discard(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.weight = 0
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        stats = {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+        if self.maxweight is not None:
+            stats.update(weight=self.weight, maxweight=self.maxweight)
+        return stats
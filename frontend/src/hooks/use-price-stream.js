@@ -0,0 +1,38 @@
+import { useEffect, useRef } from 'react';
+
+// Subscribes to /api/stream/prices and calls onDeltas with each batch of
+// { id, price, change, change_percent } updates. EventSource reconnects
+// on its own after network errors.
+export function usePriceStream(onDeltas) {
+  const handlerRef = useRef(onDeltas);
+  handlerRef.current = onDeltas;
+
+  useEffect(() => {
+    const source = new EventSource(`${process.env.REACT_APP_BACKEND_URL}/api/stream/prices`);
+
+    source.addEventListener('prices', (event) => {
+      try {
+        handlerRef.current(JSON.parse(event.data));
+      } catch (error) {
+        console.error('Error handling price update:', error);
+      }
+    });
+
+    return () => source.close();
+  }, []);
+}
+
+// Returns a copy of each movie with its latest streamed price applied
+export function applyPriceDeltas(movies, deltas) {
+  const byId = new Map(deltas.map((delta) => [delta.id, delta]));
+  return movies.map((movie) => {
+    const delta = byId.get(movie.id);
+    if (!delta) return movie;
+    return {
+      ...movie,
+      current_price: delta.price,
+      change: delta.change,
+      change_percent: delta.change_percent
+    };
+  });
+}
@@ -16,6 +16,7 @@ import {
 } from 'lucide-react';
 import { toast } from 'sonner';
 import Header from '../components/Header';
+import { usePriceStream, applyPriceDeltas } from '../hooks/use-price-stream';
 
 const DashboardPage = ({ user, onLogout }) => {
   const [portfolio, setPortfolio] = useState(null);
@@ -26,10 +27,46 @@ const DashboardPage = ({ user, onLogout }) => {
 
   useEffect(() => {
     fetchDashboardData();
-    const interval = setInterval(fetchDashboardData, 30000); // Refresh every 30 seconds
-    return () => clearInterval(interval);
   }, []);
 
+  usePriceStream((deltas) => {
+    setTrendingMovies((current) => applyPriceDeltas(current, deltas));
+    setPortfolio((current) => current && repriceHoldings(current, deltas));
+  });
+
+  // Revalue holdings and totals locally from streamed prices
+  const repriceHoldings = (current, deltas) => {
+    const prices = new Map(deltas.map((delta) => [delta.id, delta]));
+    let totalValue = 0;
+    let totalPL = 0;
+    const holdings = current.portfolio.map((holding) => {
+      const delta = prices.get(holding.movie_id);
+      const currentPrice = delta ? delta.price : holding.current_price;
+      const currentValue = holding.quantity * currentPrice;
+      const cost = holding.quantity * holding.avg_price;
+      const pl = currentValue - cost;
+      totalValue += currentValue;
+      totalPL += pl;
+      if (!delta) return holding;
+      return {
+        ...holding,
+        current_price: currentPrice,
+        current_value: Math.round(currentValue * 100) / 100,
+        pl: Math.round(pl * 100) / 100,
+        pl_percent: cost > 0 ? Math.round((pl / cost) * 10000) / 100 : 0,
+        day_change: delta.change,
+        day_change_percent: delta.change_percent
+      };
+    });
+    return {
+      ...current,
+      portfolio: holdings,
+      total_value: Math.round(totalValue * 100) / 100,
+      total_pl: Math.round(totalPL * 100) / 100,
+      total_assets: Math.round((totalValue + current.balance) * 100) / 100
+    };
+  };
+
   const fetchDashboardData = async () => {
     if (!isRefreshing) setIsLoading(true);
     const token = localStorage.getItem('token');
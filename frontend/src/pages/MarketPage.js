@@ -1,21 +1,37 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Card, CardContent, CardHeader, CardTitle } from '../components/ui/card';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '../components/ui/tabs';
 import { Badge } from '../components/ui/badge';
 import { TrendingUp, TrendingDown, Activity } from 'lucide-react';
 import Header from '../components/Header';
+import { usePriceStream, applyPriceDeltas } from '../hooks/use-price-stream';
+
+// Streamed deltas only reprice the movies already listed; the rankings
+// themselves are refetched at most this often while prices are moving
+const RERANK_INTERVAL_MS = 10000;
 
 const MarketPage = ({ user, onLogout }) => {
   const [marketData, setMarketData] = useState({ gainers: [], losers: [], volume_leaders: [] });
   const [isLoading, setIsLoading] = useState(true);
+  const lastFetchRef = useRef(0);
 
   useEffect(() => {
     fetchMarketData();
-    const interval = setInterval(fetchMarketData, 30000);
-    return () => clearInterval(interval);
   }, []);
 
+  usePriceStream((deltas) => {
+    setMarketData((current) => ({
+      gainers: applyPriceDeltas(current.gainers, deltas),
+      losers: applyPriceDeltas(current.losers, deltas),
+      volume_leaders: applyPriceDeltas(current.volume_leaders, deltas)
+    }));
+    if (Date.now() - lastFetchRef.current >= RERANK_INTERVAL_MS) {
+      fetchMarketData();
+    }
+  });
+
   const fetchMarketData = async () => {
+    lastFetchRef.current = Date.now();
     try {
       const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/market/trending`);
       if (response.ok) {
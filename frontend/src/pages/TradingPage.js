@@ -15,6 +15,7 @@ import { Badge } from '../components/ui/badge';
 import { TrendingUp, TrendingDown, Plus, Minus, ShoppingCart } from 'lucide-react';
 import { toast } from 'sonner';
 import Header from '../components/Header';
+import { usePriceStream, applyPriceDeltas } from '../hooks/use-price-stream';
 
 const TradingPage = ({ user, onLogout }) => {
   const [movies, setMovies] = useState([]);
@@ -26,13 +27,16 @@ const TradingPage = ({ user, onLogout }) => {
 
   useEffect(() => {
     fetchMovies();
-    const interval = setInterval(fetchMovies, 30000);
-    return () => clearInterval(interval);
   }, []);
 
+  usePriceStream((deltas) => {
+    setMovies((current) => applyPriceDeltas(current, deltas));
+    setSelectedMovie((current) => current && applyPriceDeltas([current], deltas)[0]);
+  });
+
   const fetchMovies = async () => {
     try {
-      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/movies`);
+      const response = await fetch(`${process.env.REACT_APP_BACKEND_URL}/api/movies?fields=symbol,title,poster,current_price,change,change_percent`);
       if (response.ok) {
         const data = await response.json();
         setMovies(data);
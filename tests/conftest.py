@@ -0,0 +1,35 @@
+"""The backend is a flat directory of modules, imported the way server.py
+and the benchmarks import them. API tests share one server on the
+in-memory store (STORAGE=memory) and keep apart by registering their own
+users and movies."""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    scratch = tmp_path_factory.mktemp('server')
+    os.environ.update({
+        'STORAGE': 'memory',
+        'DB_NAME': 'bollywood_sensex_test',
+        'TRANSACTION_WAL_DIR': str(scratch / 'wal'),
+        'TRANSACTION_ARCHIVE_DIR': str(scratch / 'archive'),
+        'BCRYPT_ROUNDS': '4',
+        # Keep the simulator from moving prices under the assertions
+        'PRICE_TICK_SECONDS': '3600',
+    })
+    import server
+    return server
+
+
+@pytest.fixture(scope='session')
+def client(server):
+    from starlette.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        yield client
@@ -0,0 +1,27 @@
+"""Helpers for the API tests that share the server fixture in conftest.py"""
+import uuid
+from datetime import datetime, timezone
+
+
+def add_movie(client, server, price: float = 100.0, shares: int = 100000, **fields) -> dict:
+    """Insert a movie the way /api/movies/sync does"""
+    movie = {
+        'id': str(uuid.uuid4()), 'tmdb_id': None, 'title': f'Movie {uuid.uuid4().hex[:8]}', 'symbol': 'MOV',
+        'poster': None, 'backdrop': None, 'release_date': '', 'synopsis': '', 'cast': [], 'genres': [],
+        'current_price': price, 'initial_price': price, 'total_shares': shares, 'available_shares': shares,
+        'volume': 0, 'change': 0.0, 'change_percent': 0.0, 'created_at': datetime.now(timezone.utc).isoformat(),
+        **fields,
+    }
+    client.portal.call(server.db.movies.insert_one, dict(movie))
+    server.market_board.add_movie(movie)
+    server.response_cache.bump()
+    return movie
+
+
+def register(client) -> dict:
+    """Auth headers for a new user with the starting balance"""
+    response = client.post('/api/auth/register', json={
+        'email': f'{uuid.uuid4().hex[:12]}@example.com', 'password': 'secret', 'name': 'Test User'
+    })
+    assert response.status_code == 200
+    return {'Authorization': f"Bearer {response.json()['token']}"}
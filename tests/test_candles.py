@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta, timezone
+
+from tests.support import add_movie, register
+
+
+def buy(client, headers, movie, quantity):
+    assert client.post('/api/trade/order', headers=headers, json={
+        'movie_id': movie['id'], 'action': 'buy', 'quantity': quantity
+    }).status_code == 200
+    return client.get(f"/api/movies/{movie['id']}").json()['current_price']
+
+
+def candles(client, movie, **params):
+    response = client.get(f"/api/movies/{movie['id']}/candles", params=params)
+    assert response.status_code == 200
+    return response.json()['candles']
+
+
+def test_candles_merge_flushed_and_pending_trades(client, server):
+    headers = register(client)
+    movie = add_movie(client, server)
+    prices = [buy(client, headers, movie, 100), buy(client, headers, movie, 200)]
+
+    # Still buffered in price_history
+    [pending] = candles(client, movie, interval='1d')
+    assert (pending['open'], pending['close'], pending['volume']) == (prices[0], prices[1], 300)
+
+    client.portal.call(server.flush_price_history)
+    assert candles(client, movie, interval='1d') == [pending]
+
+    # A later trade folds into the stored candle
+    prices.append(buy(client, headers, movie, 50))
+    [merged] = candles(client, movie, interval='1d')
+    assert (merged['time'], merged['open'], merged['close'], merged['volume']) == (pending['time'], prices[0], prices[2], 350)
+    assert (merged['low'], merged['high']) == (min(prices), max(prices))
+
+def test_candle_range_and_parameters(client, server):
+    headers = register(client)
+    movie = add_movie(client, server)
+    buy(client, headers, movie, 10)
+    client.portal.call(server.flush_price_history)
+
+    now = datetime.now(timezone.utc)
+    assert len(candles(client, movie, interval='1h', start=(now - timedelta(hours=2)).isoformat())) == 1
+    assert candles(client, movie, interval='1h', start=(now + timedelta(hours=1)).isoformat()) == []
+    assert candles(client, movie, interval='1h', end=(now - timedelta(hours=2)).isoformat()) == []
+    assert candles(client, add_movie(client, server), interval='1h') == []
+    for params in ({'interval': '2h'}, {'start': 'yesterday'}):
+        assert client.get(f"/api/movies/{movie['id']}/candles", params=params).status_code == 400
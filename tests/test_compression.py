@@ -0,0 +1,35 @@
+from tests.support import add_movie, register
+
+
+def test_large_uncached_responses_are_compressed(client, server):
+    headers = register(client)
+    for _ in range(10):
+        movie = add_movie(client, server)
+        for _ in range(4):
+            assert client.post('/api/trade/order', headers=headers, json={
+                'movie_id': movie['id'], 'action': 'buy', 'quantity': 1
+            }).status_code == 200
+
+    for path in ('/api/transactions', '/api/portfolio'):
+        plain = client.get(path, headers={**headers, 'Accept-Encoding': 'identity'})
+        assert len(plain.content) >= server.COMPRESSION_MINIMUM_SIZE, path
+        compressed = client.get(path, headers={**headers, 'Accept-Encoding': 'gzip'})
+        assert compressed.headers['content-encoding'] == 'gzip', path
+        assert compressed.json() == plain.json()
+
+
+def test_cached_responses_are_compressed_and_keep_their_etag(client, server):
+    for _ in range(20):
+        add_movie(client, server)
+    response = client.get('/api/movies', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert response.headers['etag'].startswith('W/"')
+    revalidated = client.get('/api/movies', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['etag']})
+    assert revalidated.status_code == 304
+
+
+def test_streams_are_not_compressed(client, server):
+    headers = register(client)
+    response = client.get('/api/transactions?format=ndjson', headers={**headers, 'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'content-encoding' not in response.headers
@@ -0,0 +1,19 @@
+import asyncio
+
+from db_indexes import ensure_indexes, missing_unique_indexes
+from memory_store import MemoryClient
+
+
+def test_missing_unique_indexes_are_reported():
+    async def scenario():
+        db = MemoryClient()['test']
+        await ensure_indexes(db)
+        assert await missing_unique_indexes(db) == []
+
+        bare = MemoryClient()['bare']
+        # Same fields, but not unique: guarded upserts could still duplicate
+        await bare.movies.create_index('id')
+        missing = await missing_unique_indexes(bare)
+        assert "movies ['id']" in missing and "portfolio ['user_id', 'movie_id']" in missing
+
+    asyncio.run(scenario())
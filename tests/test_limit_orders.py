@@ -0,0 +1,72 @@
+from tests.support import add_movie, register
+
+
+def me(client, headers) -> dict:
+    return client.get('/api/auth/me', headers=headers).json()
+
+
+def order_doc(client, server, order_id) -> dict:
+    return client.portal.call(server.db.orders.find_one, {'id': order_id}, {'_id': 0})
+
+
+def rest_a_sell(client, server, price: float, quantity: int):
+    """A seller holding shares with a limit sell resting on the book"""
+    movie = add_movie(client, server, price=price)
+    seller = register(client)
+    assert client.post('/api/trade/order', headers=seller, json={
+        'movie_id': movie['id'], 'action': 'buy', 'quantity': quantity
+    }).status_code == 200
+    sell = client.post('/api/trade/order', headers=seller, json={
+        'movie_id': movie['id'], 'action': 'sell', 'quantity': quantity, 'order_type': 'limit', 'price': price
+    }).json()['order']
+    return movie, seller, sell
+
+
+def buy(client, headers, movie, price: float, quantity: int) -> dict:
+    response = client.post('/api/trade/order', headers=headers, json={
+        'movie_id': movie['id'], 'action': 'buy', 'quantity': quantity, 'order_type': 'limit', 'price': price
+    })
+    assert response.status_code == 200
+    return response.json()['order']
+
+
+def test_filled_taker_settles_from_settling_to_filled(client, server):
+    movie, _, sell = rest_a_sell(client, server, 100.0, 5)
+    buyer = register(client)
+    order = buy(client, buyer, movie, 101.0, 5)
+    client.portal.call(server.order_events.join)
+
+    stored = order_doc(client, server, order['id'])
+    assert (stored['status'], stored['filled_quantity'], stored['remaining_quantity']) == ('filled', 5, 0)
+    assert order_doc(client, server, sell['id'])['status'] == 'filled'
+    # Held at the 101 limit, filled at 100
+    assert me(client, buyer)['balance'] == 100000.0 - 500.0
+
+
+def test_shard_takeover_releases_holds_of_fills_that_were_never_written(client, server, monkeypatch):
+    movie, seller, sell = rest_a_sell(client, server, 100.0, 5)
+    buyer = register(client)
+    seller_balance = me(client, seller)['balance']
+
+    # The matching worker dies after writing the accept but before its fills
+    put_nowait = server.order_events.put_nowait
+    monkeypatch.setattr(server.order_events, 'put_nowait', lambda event: None if event[0] == 'fill' else put_nowait(event))
+    order = buy(client, buyer, movie, 100.0, 3)
+    client.portal.call(server.order_events.join)
+    monkeypatch.undo()
+    assert order_doc(client, server, order['id'])['status'] == 'settling'
+    assert me(client, buyer)['balance'] == 100000.0 - 300.0
+
+    # Its shard's next owner loads the book from the database
+    server.matching_engine.drop([movie['id']])
+    client.portal.call(server.load_order_book_shard, server.order_book_leases.shard_of(movie['id']))
+
+    stored = order_doc(client, server, order['id'])
+    assert (stored['status'], stored['filled_quantity']) == ('cancelled', 0)
+    assert me(client, buyer)['balance'] == 100000.0
+    # The maker never traded: still resting in full, shares still reserved
+    assert order_doc(client, server, sell['id'])['status'] == 'open'
+    assert server.matching_engine.get_order(sell['id']).remaining == 5
+    holding = client.portal.call(server.db.portfolio.find_one, {'user_id': me(client, seller)['id'], 'movie_id': movie['id']})
+    assert (holding['quantity'], holding['reserved_quantity']) == (5, 5)
+    assert me(client, seller)['balance'] == seller_balance
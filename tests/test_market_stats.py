@@ -0,0 +1,39 @@
+import uuid
+
+from price_stream import price_delta
+from tests.support import add_movie
+
+
+def market_cap(client, server):
+    movies = client.portal.call(lambda: server.db.movies.find({}, {'current_price': 1, 'total_shares': 1}).to_list(None))
+    return sum(movie['current_price'] * movie['total_shares'] for movie in movies)
+
+
+def test_reconcile_keeps_the_aggregate_market_cap_and_the_board(client, server, monkeypatch):
+    movie = add_movie(client, server, price=100.0, shares=1000)
+    # Written by another worker whose relayed tick never arrived
+    client.portal.call(server.db.movies.update_one, {'id': movie['id']}, {'$set': {'current_price': 150.0}})
+    # A move this worker saw; the board keeps it rather than reloading
+    server.market_board.apply_prices([price_delta(movie['id'], 100.0, 0.0, 42.0)])
+    reloads = []
+    monkeypatch.setattr(server, 'load_market_board', lambda: reloads.append(1))
+
+    client.portal.call(server.reconcile_market_stats)
+
+    assert reloads == []
+    assert round(server.market_board.market_cap, 2) == round(market_cap(client, server), 2)
+    assert client.get('/api/market/stats').json()['total_market_cap'] == round(market_cap(client, server), 2)
+    assert movie['id'] in [entry['id'] for entry in server.market_board.trending(1000)['gainers']]
+
+
+def test_reconcile_reloads_when_another_worker_listed_a_movie(client, server):
+    listed = {
+        'id': str(uuid.uuid4()), 'title': 'Listed elsewhere', 'symbol': 'ELSE', 'current_price': 10.0,
+        'initial_price': 10.0, 'total_shares': 500, 'available_shares': 500, 'volume': 0,
+        'change': 0.0, 'change_percent': 0.0,
+    }
+    client.portal.call(server.db.movies.insert_one, listed)
+    client.portal.call(server.reconcile_market_stats)
+    stats = client.get('/api/market/stats').json()
+    assert stats['total_movies'] == client.portal.call(server.db.movies.count_documents, {})
+    assert stats['total_market_cap'] == round(market_cap(client, server), 2)
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from memory_store import MemoryClient
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def collection_with(name: str, docs=(), indexes=()):
+    collection = MemoryClient()['test'][name]
+    for keys, unique in indexes:
+        await collection.create_index(keys, unique=unique)
+    if docs:
+        await collection.insert_many([dict(doc) for doc in docs])
+    return collection
+
+
+def test_guarded_upsert_that_misses_collides_with_unique_index():
+    async def scenario():
+        movies = await collection_with('movies', [{'id': 'm', 'available_shares': 5}], [('id', True)])
+        # The guard fails on the existing document, so the upsert inserts
+        # a second 'm' and the unique index rejects it
+        with pytest.raises(DuplicateKeyError) as raised:
+            await movies.update_one(
+                {'id': 'm', 'available_shares': {'$gte': 10}}, {'$inc': {'available_shares': -10}}, upsert=True
+            )
+        assert raised.value.code == 11000
+        assert await movies.find_one({'id': 'm'}, {'_id': 0}) == {'id': 'm', 'available_shares': 5}
+
+    run(scenario())
+
+
+def test_ordered_bulk_write_reports_first_failing_index():
+    async def scenario():
+        movies = await collection_with(
+            'movies', [{'id': 'a', 'shares': 5}, {'id': 'b', 'shares': 1}, {'id': 'c', 'shares': 5}], [('id', True)]
+        )
+        with pytest.raises(BulkWriteError) as raised:
+            await movies.bulk_write([
+                UpdateOne({'id': movie_id, 'shares': {'$gte': 2}}, {'$inc': {'shares': -2}}, upsert=True)
+                for movie_id in ('a', 'b', 'c')
+            ], ordered=True)
+        errors = raised.value.details['writeErrors']
+        assert [(error['index'], error['code']) for error in errors] == [(1, 11000)]
+        shares = {doc['id']: doc['shares'] async for doc in movies.find({}, {'_id': 0})}
+        assert shares == {'a': 3, 'b': 1, 'c': 5}
+
+    run(scenario())
+
+
+def test_expr_guard_compares_fields_of_the_same_document():
+    async def scenario():
+        holdings = await collection_with('portfolio', [{'id': 'h', 'quantity': 10, 'reserved_quantity': 8}])
+        guard = {'id': 'h', '$expr': {'$gte': [{'$subtract': ['$quantity', '$reserved_quantity']}, 3]}}
+        assert (await holdings.update_one(guard, {'$inc': {'reserved_quantity': 3}})).matched_count == 0
+        guard['$expr']['$gte'][1] = 2
+        assert (await holdings.update_one(guard, {'$inc': {'reserved_quantity': 2}})).matched_count == 1
+        assert (await holdings.find_one({'id': 'h'}))['reserved_quantity'] == 10
+
+    run(scenario())
+
+
+def test_pipeline_update_evaluates_against_the_input_document():
+    async def scenario():
+        movies = await collection_with('movies', [{'id': 'm', 'current_price': 100.0, 'initial_price': 100.0}])
+        new_price = {'$round': [{'$max': [
+            {'$multiply': ['$current_price', 0.5]}, {'$multiply': ['$initial_price', 0.6]}
+        ]}, 2]}
+        after = await movies.find_one_and_update(
+            {'id': 'm'},
+            [{'$set': {
+                'current_price': new_price,
+                'change': {'$subtract': [new_price, '$current_price']},
+                'status': {'$cond': [{'$gt': ['$current_price', 50]}, 'open', 'halted']},
+            }}],
+            projection={'_id': 0, 'current_price': 1, 'change': 1, 'status': 1},
+            return_document=ReturnDocument.AFTER
+        )
+        assert after == {'current_price': 60.0, 'change': -40.0, 'status': 'open'}
+
+    run(scenario())
+
+
+def test_pull_removes_matching_array_items():
+    async def scenario():
+        users = await collection_with('users', [{'id': 'u', 'order_holds': ['a', 'b', 'c']}])
+        await users.update_one({'id': 'u'}, {'$pull': {'order_holds': {'$in': ['a', 'c']}}})
+        assert (await users.find_one({'id': 'u'}))['order_holds'] == ['b']
+
+    run(scenario())
+
+
+def test_sort_skip_limit_and_projection():
+    async def scenario():
+        docs = [{'id': f'{n:02d}', 'user_id': 'u' if n % 2 else 'v', 'timestamp': f't{n % 4}'} for n in range(10)]
+        transactions = await collection_with('transactions', docs, [([('user_id', 1), ('timestamp', -1), ('id', -1)], False)])
+        page = await transactions.find(
+            {'user_id': 'u'}, {'_id': 0, 'id': 1, 'timestamp': 1}
+        ).sort([('timestamp', -1), ('id', -1)]).skip(1).limit(3).to_list(None)
+        assert page == [
+            {'id': '03', 'timestamp': 't3'},
+            {'id': '09', 'timestamp': 't1'},
+            {'id': '05', 'timestamp': 't1'},
+        ]
+        excluded = await transactions.find_one({'id': '00'}, {'_id': 0, 'user_id': 0})
+        assert excluded == {'id': '00', 'timestamp': 't0'}
+
+    run(scenario())
+
+
+def test_documents_are_copied_on_read_and_write():
+    async def scenario():
+        doc = {'id': 'm', 'tags': ['a']}
+        movies = await collection_with('movies')
+        await movies.insert_one(doc)
+        doc['tags'].append('b')
+        read = await movies.find_one({'id': 'm'})
+        read['tags'].append('c')
+        assert (await movies.find_one({'id': 'm'}))['tags'] == ['a']
+
+    run(scenario())
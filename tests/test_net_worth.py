@@ -0,0 +1,94 @@
+import random
+
+from net_worth import NetWorthBoard
+
+
+class BruteForce:
+    """Net worths recomputed from scratch and ranked with sorted()"""
+
+    def __init__(self, users, holdings, prices):
+        self.order = [user['id'] for user in users]
+        self.cash = {user['id']: user['balance'] for user in users}
+        self.holdings = {}
+        for holding in holdings:
+            key = (holding['user_id'], holding['movie_id'])
+            self.holdings[key] = self.holdings.get(key, 0) + holding['quantity']
+        self.prices = dict(prices)
+
+    def worth(self, user_id):
+        return self.cash[user_id] + sum(
+            quantity * self.prices[movie_id] for (holder, movie_id), quantity in self.holdings.items() if holder == user_id
+        )
+
+    def ranking(self):
+        worths = {user_id: self.worth(user_id) for user_id in self.order}
+        ranked = sorted(self.order, key=lambda user_id: (-worths[user_id], self.order.index(user_id)))
+        return [
+            (user_id, 1 + sum(1 for other in worths.values() if other > worths[user_id]), worths[user_id])
+            for user_id in ranked
+        ]
+
+
+def test_board_matches_a_brute_force_ranking_through_random_trades_and_prices():
+    rng = random.Random(23)
+    movies = [f'm{i}' for i in range(40)]
+    # Whole-number prices and amounts keep sums exact and make ties common
+    prices = {movie_id: float(rng.randint(1, 5)) for movie_id in movies}
+    users = [{'id': f'u{i}', 'name': f'User {i}', 'balance': float(rng.randint(0, 20))} for i in range(60)]
+    holdings = [
+        {'user_id': rng.choice(users)['id'], 'movie_id': rng.choice(movies), 'quantity': rng.randint(1, 5)}
+        for _ in range(80)
+    ]
+    board = NetWorthBoard()
+    board.load(users, holdings, prices)
+    expected = BruteForce(users, holdings, prices)
+
+    for step in range(400):
+        action = rng.random()
+        if action < 0.4:
+            user_id, movie_id = rng.choice(expected.order), rng.choice(movies)
+            held = expected.holdings.get((user_id, movie_id), 0)
+            kind = 'SELL' if held and rng.random() < 0.5 else 'BUY'
+            quantity = rng.randint(1, held) if kind == 'SELL' else rng.randint(1, 4)
+            amount = quantity * expected.prices[movie_id]
+            board.apply_transactions([{
+                'user_id': user_id, 'movie_id': movie_id, 'type': kind,
+                'quantity': quantity, 'amount': amount, 'price': expected.prices[movie_id],
+            }])
+            sign = 1 if kind == 'BUY' else -1
+            expected.cash[user_id] -= sign * amount
+            expected.holdings[(user_id, movie_id)] = held + sign * quantity
+        elif action < 0.8:
+            # One movie, as a trade moves it, or all of them, as a tick does
+            moved = [rng.choice(movies)] if rng.random() < 0.7 else movies
+            deltas = [{'id': movie_id, 'price': float(rng.randint(1, 5))} for movie_id in moved]
+            board.set_prices(deltas)
+            for delta in deltas:
+                expected.prices[delta['id']] = delta['price']
+            board.reprice()
+        else:
+            user_id = f'n{step}'
+            cash = float(rng.randint(0, 20))
+            board.add_user(user_id, user_id, cash)
+            expected.order.append(user_id)
+            expected.cash[user_id] = cash
+
+        ranking = expected.ranking()
+        page = board.page(0, len(ranking))
+        assert [(entry['user_id'], entry['rank'], entry['net_worth']) for entry in page] == ranking, step
+        user_id, rank, worth = rng.choice(ranking)
+        assert (board.rank(user_id)['rank'], board.rank(user_id)['net_worth']) == (rank, worth)
+        offset = rng.randrange(len(ranking))
+        assert board.page(offset, 5) == page[offset:offset + 5]
+
+
+def test_price_moves_wait_for_reprice():
+    board = NetWorthBoard()
+    board.load(
+        [{'id': 'a', 'name': 'A', 'balance': 10.0}, {'id': 'b', 'name': 'B', 'balance': 15.0}],
+        [{'user_id': 'a', 'movie_id': 'm', 'quantity': 1}], {'m': 1.0},
+    )
+    board.set_prices([{'id': 'm', 'price': 10.0}])
+    assert board.rank('a')['rank'] == 2
+    board.reprice()
+    assert (board.rank('a')['rank'], board.rank('a')['net_worth']) == (1, 20.0)
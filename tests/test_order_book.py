@@ -0,0 +1,88 @@
+from order_book import LimitOrder, MatchingEngine, to_ticks
+
+
+def order(order_id: str, user_id: str, side: str, price: float, quantity: int) -> LimitOrder:
+    return LimitOrder(id=order_id, user_id=user_id, movie_id='m', side=side,
+                      price_ticks=to_ticks(price), quantity=quantity)
+
+
+def test_buy_matches_best_ask_first_then_oldest_at_each_level():
+    engine = MatchingEngine()
+    engine.submit(order('s1', 'alice', 'sell', 101.0, 5))
+    engine.submit(order('s2', 'bob', 'sell', 100.0, 5))
+    engine.submit(order('s3', 'carol', 'sell', 100.0, 5))
+
+    result = engine.submit(order('b1', 'dave', 'buy', 101.0, 12))
+
+    assert [(fill.sell_order_id, fill.price, fill.quantity) for fill in result.fills] == [
+        ('s2', 100.0, 5), ('s3', 100.0, 5), ('s1', 101.0, 2)
+    ]
+    assert not result.rested
+    assert engine.get_order('s1').remaining == 3
+    assert engine.get_order('s2') is None
+    assert engine.depth('m') == {'bids': [], 'asks': [{'price': 101.0, 'quantity': 3, 'orders': 1}]}
+
+
+def test_unfilled_remainder_rests_at_its_limit():
+    engine = MatchingEngine()
+    engine.submit(order('s1', 'alice', 'sell', 100.0, 2))
+
+    result = engine.submit(order('b1', 'bob', 'buy', 100.5, 5))
+
+    assert [fill.quantity for fill in result.fills] == [2]
+    assert result.rested
+    assert engine.depth('m')['bids'] == [{'price': 100.5, 'quantity': 3, 'orders': 1}]
+    assert [o.id for o in engine.open_orders('bob')] == ['b1']
+
+
+def test_orders_that_do_not_cross_both_rest():
+    engine = MatchingEngine()
+    engine.submit(order('b1', 'alice', 'buy', 99.0, 1))
+    result = engine.submit(order('s1', 'bob', 'sell', 99.5, 1))
+
+    assert result.fills == []
+    assert engine.depth('m') == {
+        'bids': [{'price': 99.0, 'quantity': 1, 'orders': 1}],
+        'asks': [{'price': 99.5, 'quantity': 1, 'orders': 1}],
+    }
+
+
+def test_self_trade_prevention_cancels_the_resting_order():
+    engine = MatchingEngine()
+    engine.submit(order('s1', 'alice', 'sell', 100.0, 5))
+    engine.submit(order('s2', 'bob', 'sell', 100.0, 5))
+
+    result = engine.submit(order('b1', 'alice', 'buy', 100.0, 5))
+
+    assert [cancelled.id for cancelled in result.cancelled] == ['s1']
+    assert [(fill.sell_order_id, fill.buy_user_id) for fill in result.fills] == [('s2', 'alice')]
+    assert engine.get_order('s1') is None
+    assert engine.cancel('s1') is None
+    assert engine.depth('m') == {'bids': [], 'asks': []}
+
+
+def test_cancel_removes_the_order_and_empty_level():
+    engine = MatchingEngine()
+    engine.submit(order('b1', 'alice', 'buy', 99.0, 3))
+    engine.submit(order('b2', 'bob', 'buy', 98.0, 3))
+
+    assert engine.cancel('b1').id == 'b1'
+    assert engine.cancel('b1') is None
+    assert engine.depth('m')['bids'] == [{'price': 98.0, 'quantity': 3, 'orders': 1}]
+
+
+def test_restore_keeps_time_priority_and_drop_forgets_books():
+    engine = MatchingEngine()
+    engine.restore([
+        LimitOrder(id='s2', user_id='bob', movie_id='m', side='sell', price_ticks=10000, quantity=1,
+                   created_at='2026-01-02T00:00:00'),
+        LimitOrder(id='s1', user_id='alice', movie_id='m', side='sell', price_ticks=10000, quantity=4,
+                   remaining=1, created_at='2026-01-01T00:00:00'),
+    ])
+
+    result = engine.submit(order('b1', 'carol', 'buy', 100.0, 1))
+
+    assert [fill.sell_order_id for fill in result.fills] == ['s1']
+    engine.drop(['m'])
+    assert engine.get_order('s2') is None
+    assert engine.depth('m') == {'bids': [], 'asks': []}
@@ -0,0 +1,53 @@
+from tests.support import add_movie, register
+
+
+def walk(client, path, limit, headers=None):
+    """Every page of a cursor-paginated endpoint, following X-Next-Cursor"""
+    pages, params = [], {'limit': limit}
+    while True:
+        response = client.get(path, params=params, headers=headers)
+        assert response.status_code == 200
+        pages.append(response.json())
+        if 'x-next-cursor' not in response.headers:
+            return pages
+        params = {'limit': limit, 'cursor': response.headers['x-next-cursor']}
+
+
+def test_transaction_pages_continue_where_the_last_one_ended(client, server):
+    headers = register(client)
+    movie = add_movie(client, server)
+    for quantity in range(1, 8):
+        assert client.post('/api/trade/order', headers=headers, json={
+            'movie_id': movie['id'], 'action': 'buy', 'quantity': quantity
+        }).status_code == 200
+
+    pages = walk(client, '/api/transactions', 3, headers)
+    assert [len(page) for page in pages] == [3, 3, 1]
+    walked = [transaction for page in pages for transaction in page]
+    assert [transaction['quantity'] for transaction in walked] == list(range(7, 0, -1))
+    assert walked == client.get('/api/transactions', params={'limit': 100}, headers=headers).json()
+
+
+def test_leaderboard_pages_add_up_to_one_page(client, server):
+    for _ in range(5):
+        register(client)
+    whole = client.get('/api/leaderboard', params={'limit': server.MAX_PAGE_SIZE}).json()
+    assert len(whole) >= 5
+
+    walked = [entry for page in walk(client, '/api/leaderboard', 2) for entry in page]
+    assert walked == whole
+    assert [entry['rank'] for entry in walked] == sorted(entry['rank'] for entry in walked)
+
+
+def test_movie_pages_are_in_id_order(client, server):
+    for _ in range(5):
+        add_movie(client, server)
+    walked = [movie['id'] for page in walk(client, '/api/movies', 4) for movie in page]
+    assert walked == sorted(walked) and len(walked) == len(set(walked)) >= 5
+
+
+def test_malformed_cursors_are_rejected(client, server):
+    headers = register(client)
+    for path, cursor in (('/api/transactions', 'not-a-cursor'), ('/api/leaderboard', server.encode_cursor({'offset': -1})),
+                         ('/api/movies', server.encode_cursor({'title': 'x'}))):
+        assert client.get(path, params={'cursor': cursor}, headers=headers).status_code == 400, path
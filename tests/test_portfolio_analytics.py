@@ -0,0 +1,71 @@
+import random
+from datetime import date
+
+import numpy as np
+import pytest
+
+from portfolio_analytics import analyze, merge, summarize
+
+TODAY = date(2026, 1, 4)
+
+
+def trade(day: int, movie_id: str, action: str, quantity: int, price: float, second: int = 0) -> dict:
+    return {
+        'timestamp': f'2026-01-{day:02d}T10:00:{second:02d}+00:00', 'movie_id': movie_id, 'type': action,
+        'quantity': quantity, 'price': price, 'amount': quantity * price,
+    }
+
+
+def closes(*series: float):
+    return (date(2026, 1, 1).toordinal(), np.array(series, dtype=np.float64))
+
+
+def test_equity_pl_and_drawdown_match_a_hand_computed_replay():
+    # Starting cash 1000: buy 10 @ 10 on the 1st, sell 5 @ 12 on the 2nd.
+    # Closes 10, 12, 8 and a live price of 9 on the 4th give equity
+    # 900+100, 960+60, 960+40, 960+45
+    transactions = [trade(2, 'a', 'SELL', 5, 12.0), trade(1, 'a', 'BUY', 10, 10.0)]
+    holdings = [{'movie_id': 'a', 'quantity': 5, 'avg_price': 10.0}]
+    movies = {'a': {'current_price': 9.0, 'title': 'A', 'symbol': 'AAA'}}
+
+    result = analyze(summarize(transactions), holdings, {'a': closes(10, 12, 8)}, movies, 960.0, TODAY)
+
+    assert [(point['date'], point['equity'], point['cash'], point['holdings_value']) for point in result['equity_curve']] == [
+        ('2026-01-01', 1000.0, 900.0, 100.0),
+        ('2026-01-02', 1020.0, 960.0, 60.0),
+        ('2026-01-03', 1000.0, 960.0, 40.0),
+        ('2026-01-04', 1005.0, 960.0, 45.0),
+    ]
+    # Sold 5 bought at 10 for 12; the 5 left are marked at 9
+    assert (result['realized_pl'], result['unrealized_pl'], result['total_pl']) == (10.0, -5.0, 5.0)
+    # 1020 -> 1000
+    assert result['max_drawdown_percent'] == pytest.approx(100 * 20 / 1020, abs=0.005)
+    assert (result['max_drawdown_peak'], result['max_drawdown_trough']) == ('2026-01-02', '2026-01-03')
+    # Returns +2%, -1.96%, +0.5%
+    returns = [1020 / 1000 - 1, 1000 / 1020 - 1, 1005 / 1000 - 1]
+    assert result['daily_volatility'] == pytest.approx(100 * np.std(returns, ddof=1), abs=0.0001)
+    assert result['contributions'][0]['total_pl'] == 5.0
+    assert result['transactions'] == 2
+
+
+def test_day_without_a_candle_uses_that_days_last_trade():
+    transactions = [
+        trade(2, 'a', 'BUY', 4, 11.0, second=1), trade(2, 'a', 'BUY', 2, 13.0, second=2), trade(1, 'a', 'BUY', 1, 10.0),
+    ]
+    # No candle on the 2nd: the 13.0 trade closes it and carries into the 3rd
+    result = analyze(summarize(transactions), [], {'a': closes(10, np.nan, np.nan)}, {'a': {}}, 0.0, TODAY)
+    assert [point['holdings_value'] for point in result['equity_curve']] == [10.0, 91.0, 91.0, 91.0]
+
+
+def test_merged_nettings_replay_like_the_whole_log():
+    rng = random.Random(7)
+    transactions = [
+        trade(1 + n // 10, rng.choice('abc'), rng.choice(['BUY', 'SELL']), rng.randint(1, 9), rng.randint(5, 20), second=n % 10)
+        for n in range(30)
+    ]
+    movies = {movie_id: {'current_price': 10.0} for movie_id in 'abc'}
+    whole = analyze(summarize(transactions), [], {}, movies, 500.0, TODAY)
+    # Split mid-day, as the settled cutoff does
+    halves = merge(summarize(transactions[:15]), summarize(transactions[15:]))
+    assert analyze(halves, [], {}, movies, 500.0, TODAY) == whole
+    assert halves.count == 30
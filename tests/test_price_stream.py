@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from memory_store import MemoryClient
+from price_stream import PriceBroadcaster, PriceRelay, price_delta
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_slow_subscriber_gets_latest_delta_per_movie():
+    async def scenario():
+        broadcaster = PriceBroadcaster()
+        subscription = broadcaster.subscribe()
+        broadcaster.publish([price_delta('a', 1.0, 0.0, 0.0), price_delta('b', 2.0, 0.0, 0.0)])
+        broadcaster.publish([price_delta('a', 1.5, 0.5, 50.0)])
+        batch = await subscription.next_batch()
+        assert sorted((delta['id'], delta['price']) for delta in batch) == [('a', 1.5), ('b', 2.0)]
+
+    run(scenario())
+
+
+def test_relay_delivers_other_workers_ticks_once():
+    async def scenario():
+        db = MemoryClient()['test']
+        first, second = PriceRelay('first'), PriceRelay('second')
+
+        first.push([price_delta('a', 101.0, 1.0, 1.0)], {'a': 5})
+        first.push([price_delta('a', 102.0, 2.0, 2.0)], {'a': 3})
+        assert await first.exchange(db) == ([], {})
+
+        deltas, volumes = await second.exchange(db)
+        assert [(delta['id'], delta['price']) for delta in deltas] == [('a', 102.0)]
+        assert volumes == {'a': 8}
+        # Still inside the overlap window, but already delivered
+        assert await second.exchange(db) == ([], {})
+
+    run(scenario())
+
+
+def test_relay_picks_up_a_tick_inserted_late_within_the_overlap():
+    async def scenario():
+        db = MemoryClient()['test']
+        reader = PriceRelay('reader', overlap_seconds=5)
+        assert await reader.exchange(db) == ([], {})
+        # Stamped before the reader's last read, but only inserted now
+        await db.price_ticks.insert_one({
+            'worker': 'slow', 'at': datetime.now(timezone.utc) - timedelta(seconds=2),
+            'deltas': [price_delta('b', 50.0, -1.0, -2.0)], 'volumes': {},
+        })
+        deltas, _ = await reader.exchange(db)
+        assert [delta['id'] for delta in deltas] == ['b']
+
+    run(scenario())
+
+
+def test_relay_keeps_pending_deltas_when_the_write_fails():
+    class FailingCollection:
+        async def insert_one(self, document):
+            raise ConnectionError('down')
+
+    async def scenario():
+        relay = PriceRelay('worker')
+        relay.push([price_delta('a', 1.0, 0.0, 0.0)], {'a': 1})
+        try:
+            await relay.exchange({'price_ticks': FailingCollection()})
+        except ConnectionError:
+            pass
+        relay.push([], {'a': 2})
+        db = MemoryClient()['test']
+        await relay.exchange(db)
+        tick = await db.price_ticks.find_one({})
+        assert tick['volumes'] == {'a': 3}
+        assert [delta['id'] for delta in tick['deltas']] == ['a']
+
+    run(scenario())
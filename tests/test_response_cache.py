@@ -0,0 +1,65 @@
+from tests.support import add_movie, register
+
+
+def test_trade_in_one_movie_keeps_other_movies_cached(client, server):
+    headers = register(client)
+    traded, other = add_movie(client, server), add_movie(client, server)
+    first = {movie['id']: client.get(f"/api/movies/{movie['id']}") for movie in (traded, other)}
+
+    assert client.post('/api/trade/order', headers=headers, json={
+        'movie_id': traded['id'], 'action': 'buy', 'quantity': 500
+    }).status_code == 200
+
+    hits = server.response_cache.entries.hits
+    assert client.get(f"/api/movies/{other['id']}").headers['etag'] == first[other['id']].headers['etag']
+    assert server.response_cache.entries.hits == hits + 1
+    moved = client.get(f"/api/movies/{traded['id']}")
+    assert server.response_cache.entries.hits == hits + 1
+    assert moved.json()['available_shares'] == traded['available_shares'] - 500
+    assert moved.json()['current_price'] > traded['current_price']
+
+
+def test_catalogue_responses_follow_every_price_move(client, server):
+    movie = add_movie(client, server)
+    listed = client.get('/api/market/stats').json()
+    client.portal.call(server.db.movies.update_one, {'id': movie['id']}, {'$set': {'current_price': 200.0}})
+    server.publish_prices([{'id': movie['id'], 'price': 200.0, 'change': 100.0, 'change_percent': 100.0}])
+    assert client.get('/api/market/stats').json()['total_market_cap'] != listed['total_market_cap']
+
+
+def test_unchanged_movie_revalidates_with_304_until_it_moves(client, server):
+    headers = register(client)
+    movie = add_movie(client, server)
+    first = client.get(f"/api/movies/{movie['id']}", headers={'Accept-Encoding': 'identity'})
+    etag = first.headers['etag']
+
+    revalidated = client.get(f"/api/movies/{movie['id']}", headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+    assert (revalidated.status_code, revalidated.content, revalidated.headers['etag']) == (304, b'', etag)
+    assert client.get(f"/api/movies/{movie['id']}", headers={'If-None-Match': f'"other", W/{etag}'}).status_code == 304
+
+    assert client.post('/api/trade/order', headers=headers, json={
+        'movie_id': movie['id'], 'action': 'buy', 'quantity': 10
+    }).status_code == 200
+    moved = client.get(f"/api/movies/{movie['id']}", headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+    assert moved.status_code == 200 and moved.headers['etag'] != etag
+    assert moved.json()['available_shares'] == movie['available_shares'] - 10
+
+
+def test_trades_invalidate_the_traders_cached_user_and_analytics(client, server):
+    headers, bystander = register(client), register(client)
+    movie = add_movie(client, server, price=10.0)
+    balance = client.get('/api/auth/me', headers=headers).json()['balance']
+    assert client.get('/api/portfolio/analytics', headers=headers).json()['transactions'] == 0
+    client.get('/api/portfolio/analytics', headers=bystander)
+    hits = server.analytics_cache.hits
+
+    assert client.post('/api/trade/order', headers=headers, json={
+        'movie_id': movie['id'], 'action': 'buy', 'quantity': 3
+    }).status_code == 200
+
+    assert client.get('/api/auth/me', headers=headers).json()['balance'] == balance - 30.0
+    assert client.get('/api/portfolio/analytics', headers=headers).json()['transactions'] == 1
+    assert server.analytics_cache.hits == hits
+    # Another user's entry outlives the trade
+    client.get('/api/portfolio/analytics', headers=bystander)
+    assert server.analytics_cache.hits == hits + 1
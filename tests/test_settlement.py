@@ -0,0 +1,137 @@
+import pytest
+
+from tests.support import add_movie, register
+
+
+def read_state(client, server, user_id, movie_ids):
+    user = client.portal.call(server.db.users.find_one, {'id': user_id}, {'_id': 0, 'balance': 1})
+    movies = client.portal.call(lambda: server.db.movies.find({'id': {'$in': movie_ids}}, {'_id': 0}).to_list(None))
+    holdings = client.portal.call(lambda: server.db.portfolio.find({'user_id': user_id}, {'_id': 0}).to_list(None))
+    return user['balance'], {movie['id']: movie for movie in movies}, {holding['movie_id']: holding for holding in holdings}
+
+
+def test_failed_holding_write_undoes_the_balance_and_share_writes(client, server):
+    headers = register(client)
+    user_id = client.get('/api/auth/me', headers=headers).json()['id']
+    first, second = add_movie(client, server), add_movie(client, server)
+    run = [(0, server.TradeOrder(movie_id=first['id'], action='buy', quantity=3)),
+           (1, server.TradeOrder(movie_id=second['id'], action='buy', quantity=2))]
+    balance, movies, holdings = read_state(client, server, user_id, [first['id'], second['id']])
+    plan = server.plan_market_run(user_id, run, balance, movies, holdings)
+
+    # A holding of the second movie appears after the read, so its guarded
+    # upsert collides with the unique (user_id, movie_id) index
+    client.portal.call(server.db.portfolio.insert_one, {
+        'id': 'concurrent', 'user_id': user_id, 'movie_id': second['id'], 'quantity': 1, 'avg_price': 100.0
+    })
+    with pytest.raises(server.SettlementConflict):
+        client.portal.call(server.write_market_plan, user_id, plan, movies, holdings)
+
+    after_balance, after_movies, after_holdings = read_state(client, server, user_id, [first['id'], second['id']])
+    assert after_balance == balance
+    assert {movie_id: movie['available_shares'] for movie_id, movie in after_movies.items()} == {
+        first['id']: first['available_shares'], second['id']: second['available_shares']
+    }
+    assert list(after_holdings) == [second['id']] and after_holdings[second['id']]['id'] == 'concurrent'
+    assert client.get('/api/transactions', headers=headers).json() == []
+
+
+def test_committed_plan_moves_prices_in_one_bulk_write(client, server, monkeypatch):
+    headers = register(client)
+    user_id = client.get('/api/auth/me', headers=headers).json()['id']
+    movie = add_movie(client, server, price=50.0)
+    run = [(0, server.TradeOrder(movie_id=movie['id'], action='buy', quantity=100))]
+    balance, movies, holdings = read_state(client, server, user_id, [movie['id']])
+    plan = server.plan_market_run(user_id, run, balance, movies, holdings)
+    # Another trade moves the price after the read; the run's impact compounds on it
+    client.portal.call(server.db.movies.update_one, {'id': movie['id']}, {'$set': {'current_price': 60.0}})
+
+    writes, published = [], []
+    bulk_write = type(server.db.movies).bulk_write
+    monkeypatch.setattr(type(server.db.movies), 'bulk_write', lambda self, requests, **kwargs: (
+        writes.append((self.name, len(requests))), bulk_write(self, requests, **kwargs))[1])
+    monkeypatch.setattr(type(server.db.movies), 'find_one_and_update', None)
+    monkeypatch.setattr(server, 'publish_prices', lambda deltas, volumes: published.extend(deltas))
+    client.portal.call(server.write_market_plan, user_id, plan, movies, holdings)
+
+    stored = client.portal.call(server.db.movies.find_one, {'id': movie['id']})
+    factor = plan['movies'][movie['id']]['current_price'] / 50.0
+    assert factor > 1
+    assert stored['current_price'] == round(60.0 * factor, 2)
+    # Shares, holdings, then every price at once
+    assert writes == [('movies', 1), ('portfolio', 1), ('movies', 1)]
+    assert [(delta['id'], delta['price']) for delta in published] == [(movie['id'], stored['current_price'])]
+
+
+def interleave_holding_change(monkeypatch, server, user_id, movie_id, attempts):
+    """Change a holding between each settlement's reads and its writes, for the first `attempts` settlements"""
+    write_market_plan = server.write_market_plan
+    calls = []
+
+    async def racing(*args):
+        calls.append(args)
+        if len(calls) <= attempts:
+            await server.db.portfolio.update_one({'user_id': user_id, 'movie_id': movie_id}, {'$inc': {'quantity': 1}})
+        return await write_market_plan(*args)
+
+    monkeypatch.setattr(server, 'write_market_plan', racing)
+    return calls
+
+
+def batch_state(client, server, headers, movies):
+    user_id = client.get('/api/auth/me', headers=headers).json()['id']
+    balance, stored, holdings = read_state(client, server, user_id, [movie['id'] for movie in movies])
+    return (
+        balance, {movie_id: movie['available_shares'] for movie_id, movie in stored.items()},
+        {movie_id: holding['quantity'] for movie_id, holding in holdings.items()},
+        len(client.get('/api/transactions', headers=headers).json()),
+    )
+
+
+def test_batch_that_keeps_losing_the_race_changes_nothing(client, server, monkeypatch):
+    headers = register(client)
+    user_id = client.get('/api/auth/me', headers=headers).json()['id']
+    first, second = add_movie(client, server), add_movie(client, server)
+    assert client.post('/api/trade/order', headers=headers, json={
+        'movie_id': second['id'], 'action': 'buy', 'quantity': 2
+    }).status_code == 200
+    before = batch_state(client, server, headers, [first, second])
+
+    calls = interleave_holding_change(monkeypatch, server, user_id, second['id'], attempts=server.SETTLEMENT_MAX_RETRIES + 1)
+    response = client.post('/api/trade/orders/batch', headers=headers, json={'orders': [
+        {'movie_id': first['id'], 'action': 'buy', 'quantity': 3},
+        {'movie_id': second['id'], 'action': 'buy', 'quantity': 4},
+    ]})
+
+    assert response.status_code == 200
+    assert (response.json()['accepted'], response.json()['rejected']) == (0, 2)
+    assert len(calls) == server.SETTLEMENT_MAX_RETRIES + 1
+    balance, shares, holdings, transactions = batch_state(client, server, headers, [first, second])
+    # Only the interleaved changes landed
+    assert (balance, shares, transactions) == before[0:2] + before[3:]
+    assert holdings == {second['id']: before[2][second['id']] + len(calls)}
+
+
+def test_batch_that_loses_one_race_settles_exactly_once(client, server, monkeypatch):
+    headers = register(client)
+    user_id = client.get('/api/auth/me', headers=headers).json()['id']
+    first, second = add_movie(client, server, price=10.0), add_movie(client, server, price=20.0)
+    assert client.post('/api/trade/order', headers=headers, json={
+        'movie_id': second['id'], 'action': 'buy', 'quantity': 2
+    }).status_code == 200
+    balance, shares, holdings, transactions = batch_state(client, server, headers, [first, second])
+
+    calls = interleave_holding_change(monkeypatch, server, user_id, second['id'], attempts=1)
+    response = client.post('/api/trade/orders/batch', headers=headers, json={'orders': [
+        {'movie_id': first['id'], 'action': 'buy', 'quantity': 3},
+        {'movie_id': second['id'], 'action': 'buy', 'quantity': 4},
+    ]})
+
+    assert response.json()['accepted'] == 2 and len(calls) == 2
+    spent = sum(result['transaction']['amount'] for result in response.json()['results'])
+    assert batch_state(client, server, headers, [first, second]) == (
+        balance - spent,
+        {first['id']: shares[first['id']] - 3, second['id']: shares[second['id']] - 4},
+        {first['id']: 3, second['id']: holdings[second['id']] + 1 + 4},
+        transactions + 2,
+    )
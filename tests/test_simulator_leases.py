@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+from memory_store import MemoryClient
+from simulator_leases import ShardLeases
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_workers_split_shards_fairly():
+    async def scenario():
+        db = MemoryClient()['test']
+        first, second = ShardLeases('first', 4, ttl=10), ShardLeases('second', 4, ttl=10)
+        assert await first.heartbeat(db) == [0, 1, 2, 3]
+        assert await second.heartbeat(db) == []
+        # The first worker hands back its surplus on its next heartbeat
+        assert await first.heartbeat(db) == [0, 1]
+        assert await second.heartbeat(db) == [2, 3]
+        assert first.owns('00') and second.owns('ff')
+
+    run(scenario())
+
+
+def test_standby_takes_over_a_dead_owner_within_a_third_past_the_ttl():
+    async def scenario():
+        ttl = 0.6
+        db = MemoryClient()['test']
+        owner, standby = ShardLeases('owner', 4, ttl), ShardLeases('standby', 4, ttl)
+        await owner.heartbeat(db)
+        died = time.monotonic()
+        # The standby polls at the same TTL / 3 cadence as server.py
+        while await standby.heartbeat(db) != [0, 1, 2, 3]:
+            assert time.monotonic() - died < 3 * ttl, 'standby never took over'
+            await asyncio.sleep(ttl / 3)
+        assert time.monotonic() - died <= ttl + ttl / 3 + 0.2
+
+    run(scenario())
+
+
+def test_default_lease_lets_a_standby_tick_before_a_full_interval_is_lost(server):
+    # Takeover (TTL + TTL / 3) must fit inside one tick interval
+    assert server.SIMULATOR_LEASE_SECONDS * 4 / 3 < server.PRICE_TICK_SECONDS
@@ -0,0 +1,127 @@
+import asyncio
+import gzip
+import json
+import os
+
+import pytest
+
+import transaction_ledger
+from memory_store import MemoryClient
+from transaction_ledger import TransactionArchive, TransactionLedger, sort_key
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def transaction(n: int, user_id: str = 'u') -> dict:
+    return {'id': f'{n:04d}', 'user_id': user_id, 'timestamp': f'2026-01-{1 + n % 28:02d}T00:00:{n % 60:02d}'}
+
+
+async def transactions_collection():
+    collection = MemoryClient()['test']['transactions']
+    await collection.create_index('id', unique=True)
+    return collection
+
+
+def crash(ledger: TransactionLedger):
+    """Drop the segment locks without deleting or flushing anything"""
+    for segment in ledger._sealed + [ledger._active]:
+        segment.file.close()
+
+
+def test_wal_is_replayed_after_a_crash(tmp_path):
+    async def scenario():
+        collection = await transactions_collection()
+        ledger = TransactionLedger(tmp_path, batch_size=100)
+        ledger.open()
+        await ledger.append([transaction(1), transaction(2)])
+        await ledger.append([transaction(3)])
+        # The first document already reached Mongo before the crash
+        await collection.insert_one(transaction(1))
+        segment = ledger._active.path
+        crash(ledger)
+        # A torn final write was never acknowledged and is skipped
+        with open(segment, 'ab') as f:
+            f.write(b'{"id": "0004", "user_')
+
+        restarted = TransactionLedger(tmp_path, batch_size=100)
+        assert restarted.open() == 3
+        assert len(restarted.unflushed('u')) == 3
+        assert await restarted.flush(collection) == 3
+        assert sorted(await collection.distinct('id')) == ['0001', '0002', '0003']
+        assert list(tmp_path.glob('*.wal')) == [restarted._active.path]
+        restarted.close()
+
+    run(scenario())
+
+
+def test_live_segments_are_not_replayed_by_another_worker(tmp_path):
+    async def scenario():
+        ledger = TransactionLedger(tmp_path, batch_size=100)
+        ledger.open()
+        await ledger.append([transaction(1)])
+
+        other = TransactionLedger(tmp_path, batch_size=100)
+        assert other.open() == 0
+        other.close()
+        ledger.close()
+
+    run(scenario())
+
+
+def test_failed_fsync_fails_the_append_and_is_retried(tmp_path, monkeypatch):
+    async def scenario():
+        ledger = TransactionLedger(tmp_path, batch_size=100)
+        ledger.open()
+        fsync = os.fsync
+        failures = [OSError(5, 'Input/output error')]
+
+        def flaky_fsync(fd):
+            if failures:
+                raise failures.pop()
+            fsync(fd)
+
+        monkeypatch.setattr(transaction_ledger.os, 'fsync', flaky_fsync)
+        with pytest.raises(OSError):
+            await ledger.append([transaction(1)])
+        await ledger.append([transaction(2)])
+        assert ledger._synced == ledger._written
+        ledger.close()
+
+    run(scenario())
+
+
+def test_archive_index_serves_counts_and_single_users(tmp_path):
+    archive = TransactionArchive(tmp_path)
+    docs = [transaction(n, user_id=f'u{n % 3}') for n in range(300)]
+    assert archive.write_month('2026-01', docs[:200]) == 200
+    assert archive.write_month('2026-01', docs[100:]) == 300
+
+    assert archive.count() == 300
+    user_docs = archive.user_month('2026-01', 'u1')
+    assert len(user_docs) == 100
+    assert user_docs == sorted(user_docs, key=sort_key, reverse=True)
+    assert archive.user_month('2026-01', 'nobody') == []
+    assert len(archive.read_month(archive.months()['2026-01'])) == 300
+
+
+def test_archive_reads_months_without_a_valid_index(tmp_path):
+    archive = TransactionArchive(tmp_path)
+    archive.write_month('2026-01', [transaction(n) for n in range(10)])
+    # Replaced without its index, as after a crash between the two renames
+    lines = b''.join(json.dumps(transaction(n, user_id='v')).encode() + b'\n' for n in range(4))
+    (tmp_path / f'transactions-2026-01{archive.suffix}').write_bytes(
+        gzip.compress(lines) if archive.suffix.endswith('.gz') else pytest.importorskip('zstandard').compress(lines)
+    )
+
+    reopened = TransactionArchive(tmp_path)
+    assert reopened.count() == 4
+    assert len(reopened.user_month('2026-01', 'v')) == 4
+    assert reopened.user_month('2026-01', 'u') == []
+
+
+def test_append_before_open_is_rejected(tmp_path):
+    ledger = TransactionLedger(tmp_path, batch_size=100)
+    with pytest.raises(RuntimeError, match='not open'):
+        run(ledger.append([transaction(1)]))
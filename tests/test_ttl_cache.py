@@ -0,0 +1,24 @@
+from ttl_cache import TTLCache
+
+
+def test_weight_bound_evicts_least_recently_used():
+    cache = TTLCache(10, 60, maxweight=100)
+    cache.set('a', 'A', weight=40)
+    cache.set('b', 'B', weight=40)
+    cache.get('a')
+    cache.set('c', 'C', weight=40)
+    assert (cache.get('a'), cache.get('b'), cache.get('c')) == ('A', None, 'C')
+    assert cache.weight == 80
+    # Replacing an entry releases its old weight; one heavier than the bound is not kept
+    cache.set('a', 'A2', weight=10)
+    cache.set('d', 'D', weight=101)
+    assert cache.weight == 50 and cache.get('d') is None
+
+
+def test_invalidation_only_discards_fills_of_its_own_key():
+    cache = TTLCache(10, 60)
+    generation, other = cache.generation('a'), cache.generation('b')
+    cache.invalidate('b')
+    cache.set('a', 'A', generation)
+    cache.set('b', 'B', other)
+    assert (cache.get('a'), cache.get('b')) == ('A', None)